@@ -9,30 +9,254 @@ This module provides an AI-powered study assistant feature that can help student
 - Providing study guidance
 
 The AI assistant is triggered when users send messages starting with '@bot' in the chat.
+
+Requests go through the async OpenAI client, so an LLM round trip never blocks
+the event loop (and with it every WebSocket). At most AI_MAX_CONCURRENCY calls
+run upstream at once. Answers are cached for AI_CACHE_TTL_SECONDS, keyed on the
+model and the normalized question, and identical questions asked while an
+answer is still being generated share that one upstream call (single-flight):
+twenty students asking "@bot explain photosynthesis" cost one completion.
+
+stream_answer() yields the answer as it is generated; the chat WebSocket uses it
+to stream tokens to the room. Point AI_BASE_URL at any OpenAI-compatible server
+(e.g. a local mock, see app/test_ai_cache.py) for testing.
 """
 
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
-from openai import OpenAI
+from openai import AsyncOpenAI
+import asyncio
+import hashlib
 import os
-from typing import Optional
+import re
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from app.rate_limit import rate_limit
 
 # Create router for AI helper endpoints
 router = APIRouter(prefix="/ai", tags=["AI Helper"])
 
+AI_BASE_URL = os.getenv("AI_BASE_URL", "https://openrouter.ai/api/v1")
+AI_MODEL = os.getenv("AI_MODEL", "openai/gpt-oss-20b:free")  # Free OpenRouter model
+AI_MAX_TOKENS = int(os.getenv("AI_MAX_TOKENS", "500"))  # Limit response length for chat compatibility
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", "60"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "4"))
+AI_CACHE_SIZE = int(os.getenv("AI_CACHE_SIZE", "256"))
+AI_CACHE_TTL_SECONDS = int(os.getenv("AI_CACHE_TTL_SECONDS", "600"))
+
+# Create a study-focused system prompt to ensure the AI provides academic help
+SYSTEM_PROMPT = """You are an AI Study Assistant designed to help students with academic topics. 
+        Your role is to:
+        - Explain complex concepts in simple, understandable terms
+        - Provide study guidance and learning strategies
+        - Answer academic questions clearly and concisely
+        - Summarize discussion points when requested
+        - Offer helpful study tips and techniques
+        
+        Keep your responses focused on educational content and be encouraging to students.
+        If a question is not academic-related, politely redirect to study topics."""
+
 # OpenAI client will be initialized when needed
 client = None
 
 def get_openai_client():
-    """Initialize and return OpenAI client if API key is available"""
+    """Initialize and return the async OpenAI client if API key is available"""
     global client
     if client is None and os.getenv("OPENROUTER_API_KEY"):
-        client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
+        client = AsyncOpenAI(
+            base_url=AI_BASE_URL,
             api_key=os.getenv("OPENROUTER_API_KEY"),
+            timeout=AI_TIMEOUT_SECONDS,
         )
     return client
 
+
+class AINotConfigured(Exception):
+    """OPENROUTER_API_KEY is not set."""
+
+
+def normalize_prompt(text: str) -> str:
+    """Cache key form of a question: case, spacing and trailing punctuation don't matter."""
+    return re.sub(r"\s+", " ", text).strip().lower().rstrip("?!. ")
+
+
+class ResponseCache:
+    """LRU cache of finished answers that expire after a TTL."""
+
+    def __init__(self, max_entries: int = AI_CACHE_SIZE, ttl: int = AI_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[str, str]) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            self._entries.pop(key, None)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: Tuple[str, str], reply: str):
+        self._entries[key] = (time.monotonic() + self.ttl, reply)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+class _Flight:
+    """One upstream completion in progress; any number of followers read its deltas."""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.followers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def push(self, delta: str):
+        self.chunks.append(delta)
+        self._notify()
+
+    def finish(self, error: Optional[Exception] = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self) -> AsyncIterator[str]:
+        """Yield every delta so far, then new ones as they arrive."""
+        self.followers += 1
+        position = 0
+        while True:
+            changed = self._changed
+            while position < len(self.chunks):
+                yield self.chunks[position]
+                position += 1
+            if self.done:
+                if self.error:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+response_cache = ResponseCache()
+_inflight: Dict[Tuple[str, str], _Flight] = {}
+_semaphore: Optional[asyncio.Semaphore] = None
+upstream_calls = 0
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+    return _semaphore
+
+
+async def _produce(key: Tuple[str, str], messages: List[dict], flight: _Flight):
+    """Run the upstream streaming completion for a flight, then cache the answer."""
+    global upstream_calls
+    try:
+        openai_client = get_openai_client()
+        async with _get_semaphore():
+            upstream_calls += 1
+            stream = await openai_client.chat.completions.create(
+                model=key[0],
+                messages=messages,
+                max_tokens=AI_MAX_TOKENS,
+                temperature=0.7,  # Balanced creativity and accuracy
+                stream=True,
+            )
+            async for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    flight.push(delta)
+        response_cache.set(key, "".join(flight.chunks))
+        flight.finish()
+    except Exception as e:
+        flight.finish(e)
+    finally:
+        _inflight.pop(key, None)
+
+
+def build_messages(question: str, context: Optional[str] = None) -> List[dict]:
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+    if context:
+        messages.append({"role": "system", "content": f"Context from the study room:\n{context}"})
+    messages.append({"role": "user", "content": question})
+    return messages
+
+
+async def stream_answer(
+    question: str, model: str = AI_MODEL, context: Optional[str] = None, context_key: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Stream the assistant's answer to a question.
+
+    A cached answer is yielded in one piece. Otherwise the deltas of the
+    upstream completion are yielded as they arrive, shared with anyone else
+    asking the same question (with the same context) at the same time.
+    context_key identifies the context in the cache instead of its text, for
+    callers that know which state the context was built from.
+
+    Raises:
+        AINotConfigured: If OPENROUTER_API_KEY is not set
+    """
+    if not get_openai_client():
+        raise AINotConfigured()
+
+    key = (model, normalize_prompt(question))
+    if context:
+        # Answers depend on the room context they were given
+        key = (model, f"{key[1]}\x00{context_key or hashlib.sha1(context.encode()).hexdigest()}")
+    cached = response_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    flight = _inflight.get(key)
+    if flight is None:
+        flight = _Flight()
+        _inflight[key] = flight
+        messages = build_messages(question, context)
+        # A task of its own, so followers still get the answer if the first asker goes away
+        flight.task = asyncio.create_task(_produce(key, messages, flight))
+    async for delta in flight.follow():
+        yield delta
+
+
+async def answer(
+    question: str, model: str = AI_MODEL, context: Optional[str] = None, context_key: Optional[str] = None
+) -> str:
+    """The complete answer to a question (cached and coalesced like stream_answer)."""
+    return "".join([delta async for delta in stream_answer(question, model, context, context_key)])
+
+
+async def complete(messages: List[dict], model: str = AI_MODEL, max_tokens: int = AI_MAX_TOKENS) -> str:
+    """One uncached completion for internal prompts (e.g. room summaries), within the concurrency limit."""
+    global upstream_calls
+    openai_client = get_openai_client()
+    if not openai_client:
+        raise AINotConfigured()
+    async with _get_semaphore():
+        upstream_calls += 1
+        response = await openai_client.chat.completions.create(
+            model=model,
+            messages=messages,
+            max_tokens=max_tokens,
+            temperature=0.3,
+        )
+    return response.choices[0].message.content or ""
+
 # Pydantic model for request validation
 class AIHelperRequest(BaseModel):
     """Request model for AI helper endpoint"""
@@ -43,7 +267,7 @@ class AIHelperResponse(BaseModel):
     """Response model for AI helper endpoint"""
     reply: str
 
-@router.post("/helper", response_model=AIHelperResponse)
+@router.post("/helper", response_model=AIHelperResponse, dependencies=[Depends(rate_limit("ai"))])
 async def ai_helper(request: AIHelperRequest):
     """
     AI-Powered Study Assistant Endpoint
@@ -62,46 +286,15 @@ async def ai_helper(request: AIHelperRequest):
     """
     
     # Validate that the API key is configured
-    if not os.getenv("OPENROUTER_API_KEY"):
+    if not get_openai_client():
         raise HTTPException(
             status_code=500, 
             detail="AI service not configured. Please set OPENROUTER_API_KEY environment variable."
         )
     
     try:
-        # Get the OpenAI client
-        openai_client = get_openai_client()
-        if not openai_client:
-            raise HTTPException(
-                status_code=500, 
-                detail="AI service not configured. Please set OPENROUTER_API_KEY environment variable."
-            )
-        
-        # Create a study-focused system prompt to ensure the AI provides academic help
-        system_prompt = """You are an AI Study Assistant designed to help students with academic topics. 
-        Your role is to:
-        - Explain complex concepts in simple, understandable terms
-        - Provide study guidance and learning strategies
-        - Answer academic questions clearly and concisely
-        - Summarize discussion points when requested
-        - Offer helpful study tips and techniques
-        
-        Keep your responses focused on educational content and be encouraging to students.
-        If a question is not academic-related, politely redirect to study topics."""
-        
-        # Send the message to the AI model
-        response = openai_client.chat.completions.create(
-            model="openai/gpt-oss-20b:free",  # Free OpenRouter model
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": request.message}
-            ],
-            max_tokens=500,  # Limit response length for chat compatibility
-            temperature=0.7,  # Balanced creativity and accuracy
-        )
-        
-        # Extract the AI's response
-        ai_reply = response.choices[0].message.content
+        # Send the message to the AI model (served from cache / shared with identical questions in flight)
+        ai_reply = await answer(request.message)
         
         # Return the response in the expected format
         return AIHelperResponse(reply=ai_reply)
@@ -129,6 +322,14 @@ async def ai_health_check():
     return {
         "status": "healthy" if api_key_configured else "misconfigured",
         "api_key_configured": api_key_configured,
-        "model": "openai/gpt-oss-20b:free",
-        "service": "OpenRouter AI"
+        "model": AI_MODEL,
+        "service": "OpenRouter AI",
+        "base_url": AI_BASE_URL,
+        "in_flight": len(_inflight),
+        "upstream_calls": upstream_calls,
+        "cache": {
+            "entries": len(response_cache._entries),
+            "hits": response_cache.hits,
+            "misses": response_cache.misses
+        }
     }
@@ -0,0 +1,169 @@
+# app/archive.py
+"""
+Compressed, time-partitioned message archive.
+
+Messages the retention archiver (app/retention.py) moves out of the messages
+table live in segment files under ARCHIVE_DIR, partitioned by room and month:
+
+    {room id}/{YYYY-MM}/{first id}-{last id}-{token}.ndjson.zst
+
+Each line is one message as /chat/history serves it, oldest first. The
+archive_segments table is the manifest: a file it doesn't list is not part of
+the archive (e.g. one left behind by a run that failed before committing).
+
+Segments are zstd-compressed when the zstandard package is installed and
+gzipped otherwise; readers go by the file extension, so both can coexist.
+
+read_page() continues a room's history pagination past the oldest message
+still in the database. The last ARCHIVE_CACHE_SEGMENTS segments read are kept
+decompressed, since paging through old history reads the same segment again
+and again.
+"""
+
+import asyncio
+import gzip
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.codec import loads
+from app import models
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+ARCHIVE_DIR = Path(os.getenv("ARCHIVE_DIR", Path(__file__).parent / "archives"))
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd" if zstandard else "gzip")
+ARCHIVE_ZSTD_LEVEL = int(os.getenv("ARCHIVE_ZSTD_LEVEL", "9"))
+ARCHIVE_CACHE_SEGMENTS = int(os.getenv("ARCHIVE_CACHE_SEGMENTS", "16"))
+
+SUFFIXES = {"zstd": ".ndjson.zst", "gzip": ".ndjson.gz"}
+
+# (message ids, encoded messages), both oldest first
+Segment = Tuple[List[int], List[str]]
+
+
+def _compress(data: bytes) -> bytes:
+    if ARCHIVE_COMPRESSION == "zstd":
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(path: Path, data: bytes) -> bytes:
+    if path.name.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError(f"{path.name} is zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+
+def write_segment(room_pk: int, month: str, lines: List[str], first_id: int, last_id: int) -> Tuple[str, int]:
+    """
+    Write encoded messages (oldest first) as a new segment file. Blocking: run
+    it in a thread. Returns the path relative to ARCHIVE_DIR and the file size.
+    """
+    relative = Path(str(room_pk), month, f"{first_id}-{last_id}-{uuid.uuid4().hex[:8]}{SUFFIXES[ARCHIVE_COMPRESSION]}")
+    path = ARCHIVE_DIR / relative
+    path.parent.mkdir(parents=True, exist_ok=True)
+    data = _compress(("\n".join(lines) + "\n").encode())
+    temp_path = path.with_name(path.name + ".tmp")
+    with open(temp_path, "wb") as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+    return relative.as_posix(), len(data)
+
+
+def remove_segment(relative: str):
+    (ARCHIVE_DIR / relative).unlink(missing_ok=True)
+
+
+def read_segment(relative: str) -> Segment:
+    """Decompress a segment file. Blocking: run it in a thread."""
+    path = ARCHIVE_DIR / relative
+    lines = _decompress(path, path.read_bytes()).decode().splitlines()
+    return [loads(line)["id"] for line in lines], lines
+
+
+class SegmentCache:
+    """LRU of decompressed segments."""
+
+    def __init__(self, size: int = ARCHIVE_CACHE_SEGMENTS):
+        self.size = size
+        self._segments: "OrderedDict[str, Segment]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, relative: str) -> Segment:
+        segment = self._segments.get(relative)
+        if segment is not None:
+            self._segments.move_to_end(relative)
+            self.hits += 1
+            return segment
+        self.misses += 1
+        segment = await asyncio.to_thread(read_segment, relative)
+        self._segments[relative] = segment
+        if len(self._segments) > self.size:
+            self._segments.popitem(last=False)
+        return segment
+
+
+segment_cache = SegmentCache()
+
+
+async def read_page(
+    db: AsyncSession,
+    room_pk: int,
+    before_id: Optional[int],
+    limit: int,
+    after_id: int = 0
+) -> Tuple[List[dict], bool]:
+    """
+    The `limit` newest archived messages of a room with after_id < id < before_id,
+    oldest first, and whether more of them exist.
+    """
+    query = select(models.ArchiveSegment.path, models.ArchiveSegment.last_id).where(
+        models.ArchiveSegment.room_id == room_pk,
+        models.ArchiveSegment.last_id > after_id
+    )
+    if before_id is not None:
+        query = query.where(models.ArchiveSegment.first_id < before_id)
+    segments = (await db.execute(query.order_by(models.ArchiveSegment.last_id.desc()))).all()
+
+    found: List[Tuple[int, str]] = []
+    for relative, last_id in segments:
+        if len(found) > limit:
+            # Segments come newest first; stop once none can beat the messages we have
+            found.sort(reverse=True)
+            if last_id < found[limit][0]:
+                break
+        ids, lines = await segment_cache.get(relative)
+        found.extend(
+            (message_id, line) for message_id, line in zip(ids, lines)
+            if message_id > after_id and (before_id is None or message_id < before_id)
+        )
+    found.sort(reverse=True)
+    has_more = len(found) > limit
+    page = found[:limit]
+    page.reverse()
+    return [loads(line) for _, line in page], has_more
+
+
+async def archive_stats(db: AsyncSession, room_pk: int) -> dict:
+    segments, messages, size, oldest = (await db.execute(
+        select(
+            func.count(),
+            func.coalesce(func.sum(models.ArchiveSegment.message_count), 0),
+            func.coalesce(func.sum(models.ArchiveSegment.size), 0),
+            func.min(models.ArchiveSegment.first_id)
+        ).where(models.ArchiveSegment.room_id == room_pk)
+    )).one()
+    return {"segments": segments, "messages": messages, "bytes": size, "oldest_message_id": oldest}
@@ -2,20 +2,13 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from fastapi.security import OAuth2PasswordRequestForm
-from app.database import SessionLocal  # Add "app."
+from app.database import get_db
 from app import models, utils  # Add "app."
 
 # ... rest of the code same
 
 router = APIRouter(prefix="/auth", tags=["Auth"])
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 @router.post("/register")
 def register(username: str, password: str, db: Session = Depends(get_db)):
     if db.query(models.User).filter(models.User.username == username).first():
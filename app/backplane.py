@@ -0,0 +1,399 @@
+# app/backplane.py
+"""
+Pub/sub backplane that carries room events between server processes.
+
+ConnectionManager only knows the sockets connected to its own process. Every
+broadcast is delivered to those local sockets directly and also published on
+the backplane, so other workers (uvicorn --workers N, several pods) can deliver
+it to their sockets. Presence is shared the same way: each worker publishes the
+users it has in a room, and the online list is the union over live workers.
+
+Pick the implementation with BACKPLANE_URL:
+- unset or "memory://": InProcessBackplane, for a single process
+- "redis://host:port/db": RedisBackplane, speaking the Redis protocol to Redis
+  or any compatible server
+
+Publishing never holds up a broadcast: events go on a bounded outbox that a
+publisher task sends in order, pipelining whatever has piled up into one
+round trip, much as ConnectionWriter drains a socket's queue.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import uuid
+from collections import deque
+from typing import Awaitable, Callable, Deque, List, Optional, Sequence, Set
+from urllib.parse import urlparse
+
+BACKPLANE_URL = os.getenv("BACKPLANE_URL", "memory://")
+BACKPLANE_CHANNEL = os.getenv("BACKPLANE_CHANNEL", "studychat:rooms")
+WORKER_TTL_SECONDS = int(os.getenv("BACKPLANE_WORKER_TTL_SECONDS", "30"))
+RECONNECT_SECONDS = 1.0
+# Longest a connect or command may take; presence reads wait on it, so keep it short
+BACKPLANE_TIMEOUT_SECONDS = float(os.getenv("BACKPLANE_TIMEOUT_SECONDS", "1"))
+# After a connection failure commands fail fast for this long instead of each waiting out the timeout
+BACKPLANE_BACKOFF_SECONDS = float(os.getenv("BACKPLANE_BACKOFF_SECONDS", "5"))
+# Events waiting to be published; past this the oldest are dropped (other workers miss them)
+PUBLISH_QUEUE_SIZE = int(os.getenv("BACKPLANE_PUBLISH_QUEUE_SIZE", "10000"))
+PUBLISH_BATCH_SIZE = 500  # Most PUBLISH commands pipelined in one write
+
+# deliver(room_id, message_type, coalesce_key, frame) for events from other workers
+DeliverCallback = Callable[[str, Optional[str], Optional[str], str], Awaitable[None]]
+
+
+class Backplane:
+    """Interface the ConnectionManager talks to."""
+
+    async def start(self, deliver: DeliverCallback):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, room_id: str, message_type: Optional[str], key: Optional[str], frame: str):
+        """Send an already-serialized frame to the other workers."""
+        raise NotImplementedError
+
+    async def sync_presence(self, room_id: str, local_users: List[str]):
+        """Record which users this worker currently has in the room."""
+        raise NotImplementedError
+
+    async def room_users(self, room_id: str, local_users: List[str]) -> List[str]:
+        """Online users in the room across all workers."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {}
+
+
+class InProcessBackplane(Backplane):
+    """Single-process backplane: there are no other workers to talk to."""
+
+    async def publish(self, room_id: str, message_type: Optional[str], key: Optional[str], frame: str):
+        pass
+
+    async def sync_presence(self, room_id: str, local_users: List[str]):
+        pass
+
+    async def room_users(self, room_id: str, local_users: List[str]) -> List[str]:
+        return list(local_users)
+
+
+class RespError(Exception):
+    """Error reply from the Redis-protocol server."""
+
+
+class RespConnection:
+    """
+    Minimal asyncio client for the Redis serialization protocol (RESP2).
+
+    Connecting and every command are bounded by BACKPLANE_TIMEOUT_SECONDS. When
+    the server can't be reached, command() fails right away for the next
+    BACKPLANE_BACKOFF_SECONDS instead of holding every caller up again.
+    """
+
+    def __init__(self, host: str, port: int, db: int = 0, password: Optional[str] = None):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self.reader: Optional[asyncio.StreamReader] = None
+        self.writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+        self._down_until = 0.0  # Loop time until which commands fail fast
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), BACKPLANE_TIMEOUT_SECONDS
+        )
+        try:
+            if self.password:
+                await asyncio.wait_for(self._roundtrip([("AUTH", self.password)]), BACKPLANE_TIMEOUT_SECONDS)
+            if self.db:
+                await asyncio.wait_for(self._roundtrip([("SELECT", self.db)]), BACKPLANE_TIMEOUT_SECONDS)
+        except Exception:
+            await self.close()
+            raise
+
+    async def close(self):
+        if self.writer:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+            self.writer = None
+
+    async def command(self, *args):
+        return (await self.pipeline([args]))[0]
+
+    async def pipeline(self, commands: Sequence[tuple]) -> list:
+        """Send several commands in one write and read their replies: one round trip."""
+        self._check_backoff()
+        async with self._lock:
+            # Callers queued behind a failed attempt give up too
+            self._check_backoff()
+            try:
+                if self.writer is None:
+                    await self.connect()
+                return await asyncio.wait_for(self._roundtrip(commands), BACKPLANE_TIMEOUT_SECONDS)
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                # Drop the broken (or half-read) connection; the first command after the backoff reconnects
+                await self.close()
+                self._down_until = asyncio.get_running_loop().time() + BACKPLANE_BACKOFF_SECONDS
+                raise
+
+    def _check_backoff(self):
+        wait = self._down_until - asyncio.get_running_loop().time()
+        if wait > 0:
+            raise ConnectionError(f"{self.host}:{self.port} unreachable, retrying in {wait:.1f}s")
+
+    async def _roundtrip(self, commands: Sequence[tuple]) -> list:
+        for args in commands:
+            self.send(*args)
+        await self.writer.drain()
+        replies, error = [], None
+        for _ in commands:
+            # Read every reply, even after an error one, so the next command gets its own
+            try:
+                replies.append(await self.read_reply())
+            except RespError as e:
+                error = error or e
+                replies.append(None)
+        if error:
+            raise error
+        return replies
+
+    def send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self.writer.write(b"".join(parts))
+
+    async def read_reply(self):
+        line = await self.reader.readuntil(b"\r\n")
+        prefix, body = line[:1], line[1:-2]
+        if prefix == b"+":
+            return body.decode()
+        if prefix == b"-":
+            raise RespError(body.decode())
+        if prefix == b":":
+            return int(body)
+        if prefix == b"$":
+            length = int(body)
+            if length < 0:
+                return None
+            data = await self.reader.readexactly(length + 2)
+            return data[:-2].decode()
+        if prefix == b"*":
+            count = int(body)
+            if count < 0:
+                return None
+            return [await self.read_reply() for _ in range(count)]
+        raise RespError(f"Unexpected reply: {line!r}")
+
+
+class RedisBackplane(Backplane):
+    """
+    Backplane over a Redis-protocol server.
+
+    Events go through PUBLISH/SUBSCRIBE on one channel, wrapped in an envelope
+    carrying the origin worker so a worker skips its own events. Presence lives
+    in one hash per room (field = worker id, value = that worker's users) and
+    only counts workers whose heartbeat key has not expired.
+    """
+
+    def __init__(self, url: str):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.password = parsed.password
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.commands = RespConnection(self.host, self.port, self.db, self.password)
+        self.deliver: Optional[DeliverCallback] = None
+        self._rooms_with_presence: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+        self._outbox: Deque[str] = deque()  # Envelopes waiting for the publisher task
+        self._outbox_ready = asyncio.Event()
+        self._publisher: Optional[asyncio.Task] = None
+        self._closing = False
+        self.published = 0
+        self.publish_dropped = 0  # Overflowed the outbox, or lost to a failed PUBLISH
+
+    @staticmethod
+    def presence_key(room_id: str) -> str:
+        return f"studychat:presence:{room_id}"
+
+    @staticmethod
+    def worker_key(worker_id: str) -> str:
+        return f"studychat:worker:{worker_id}"
+
+    async def start(self, deliver: DeliverCallback):
+        self.deliver = deliver
+        try:
+            await self._heartbeat_once()
+        except Exception as e:
+            # Serve local sockets while Redis is down; the heartbeat loop keeps trying
+            print(f"Backplane heartbeat failed: {e}")
+        subscribed = asyncio.Event()
+        self._outbox_ready = asyncio.Event()  # Of the running loop: the app may be started again (tests)
+        self._closing = False
+        self._publisher = asyncio.create_task(self._publish_loop())
+        self._tasks = [
+            asyncio.create_task(self._subscribe_loop(subscribed)),
+            asyncio.create_task(self._heartbeat_loop()),
+        ]
+        try:
+            await asyncio.wait_for(subscribed.wait(), BACKPLANE_TIMEOUT_SECONDS)
+            print(f"📡 Backplane connected to {self.host}:{self.port} as {self.worker_id}")
+        except asyncio.TimeoutError:
+            # Keep serving local sockets; the subscribe loop keeps retrying
+            print(f"⚠️ Backplane subscription to {self.host}:{self.port} not confirmed yet")
+
+    async def stop(self):
+        if self._publisher:
+            # Not cancelled: it hands over what's still queued, then exits
+            self._closing = True
+            self._outbox_ready.set()
+            await self._publisher
+            self._publisher = None
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except (asyncio.CancelledError, Exception):
+                pass
+        try:
+            # Take this worker's users out of every room right away instead of waiting for the TTL
+            for room_id in self._rooms_with_presence:
+                await self.commands.command("HDEL", self.presence_key(room_id), self.worker_id)
+            await self.commands.command("DEL", self.worker_key(self.worker_id))
+        except Exception as e:
+            print(f"Error clearing backplane presence: {e}")
+        await self.commands.close()
+
+    async def publish(self, room_id: str, message_type: Optional[str], key: Optional[str], frame: str):
+        """Queue the event for the publisher task; the broadcast doesn't wait for Redis."""
+        if len(self._outbox) >= PUBLISH_QUEUE_SIZE:
+            self._outbox.popleft()
+            self.publish_dropped += 1
+        self._outbox.append(json.dumps({
+            "origin": self.worker_id,
+            "room": room_id,
+            "type": message_type,
+            "key": key,
+            "frame": frame
+        }))
+        self._outbox_ready.set()
+
+    async def _publish_loop(self):
+        while True:
+            await self._send_outbox()
+            if self._closing:
+                return
+            self._outbox_ready.clear()
+            await self._outbox_ready.wait()
+
+    async def _send_outbox(self):
+        """Publish queued envelopes in order, pipelined in batches."""
+        while self._outbox:
+            batch = [self._outbox.popleft() for _ in range(min(len(self._outbox), PUBLISH_BATCH_SIZE))]
+            try:
+                await self.commands.pipeline([("PUBLISH", BACKPLANE_CHANNEL, envelope) for envelope in batch])
+                self.published += len(batch)
+            except Exception as e:
+                # Local sockets already have these events; other workers miss them
+                self.publish_dropped += len(batch)
+                print(f"Error publishing {len(batch)} events to backplane: {e}")
+
+    def stats(self) -> dict:
+        return {"publish_queue": len(self._outbox), "published": self.published, "publish_dropped": self.publish_dropped}
+
+    async def sync_presence(self, room_id: str, local_users: List[str]):
+        try:
+            if local_users:
+                await self.commands.command("HSET", self.presence_key(room_id), self.worker_id, json.dumps(local_users))
+                self._rooms_with_presence.add(room_id)
+            else:
+                await self.commands.command("HDEL", self.presence_key(room_id), self.worker_id)
+                self._rooms_with_presence.discard(room_id)
+        except Exception as e:
+            print(f"Error syncing presence to backplane: {e}")
+
+    async def room_users(self, room_id: str, local_users: List[str]) -> List[str]:
+        users = list(local_users)
+        try:
+            flat = await self.commands.command("HGETALL", self.presence_key(room_id)) or []
+            others = {flat[i]: flat[i + 1] for i in range(0, len(flat), 2) if flat[i] != self.worker_id}
+            if not others:
+                return users
+            # Ignore workers that died without cleaning up (heartbeat expired)
+            alive = await self.commands.command("MGET", *[self.worker_key(worker) for worker in others])
+            for (worker, value), is_alive in zip(others.items(), alive):
+                if is_alive is None:
+                    continue
+                for username in json.loads(value):
+                    if username not in users:
+                        users.append(username)
+        except Exception as e:
+            print(f"Error reading presence from backplane: {e}")
+        return users
+
+    async def _heartbeat_once(self):
+        await self.commands.command("SET", self.worker_key(self.worker_id), "1", "EX", WORKER_TTL_SECONDS)
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(WORKER_TTL_SECONDS / 3)
+            try:
+                await self._heartbeat_once()
+            except Exception as e:
+                print(f"Backplane heartbeat failed: {e}")
+
+    async def _subscribe_loop(self, subscribed: asyncio.Event):
+        """Hold a dedicated SUBSCRIBE connection open, reconnecting if it drops."""
+        while True:
+            connection = RespConnection(self.host, self.port, self.db, self.password)
+            try:
+                await connection.connect()
+                connection.send("SUBSCRIBE", BACKPLANE_CHANNEL)
+                await connection.writer.drain()
+                while True:
+                    reply = await connection.read_reply()
+                    if reply[0] == "subscribe":
+                        subscribed.set()
+                    elif reply[0] == "message":
+                        await self._handle_envelope(reply[2])
+            except asyncio.CancelledError:
+                await connection.close()
+                raise
+            except Exception as e:
+                print(f"Backplane subscription lost, reconnecting: {e}")
+                await connection.close()
+                await asyncio.sleep(RECONNECT_SECONDS)
+
+    async def _handle_envelope(self, data: str):
+        try:
+            envelope = json.loads(data)
+        except json.JSONDecodeError:
+            return
+        if envelope.get("origin") == self.worker_id:
+            return
+        try:
+            await self.deliver(envelope["room"], envelope.get("type"), envelope.get("key"), envelope["frame"])
+        except Exception as e:
+            print(f"Error delivering backplane event: {e}")
+
+
+def create_backplane(url: str = BACKPLANE_URL) -> Backplane:
+    scheme = urlparse(url).scheme
+    if scheme in ("", "memory"):
+        return InProcessBackplane()
+    if scheme == "redis":
+        return RedisBackplane(url)
+    raise ValueError(f"Unsupported BACKPLANE_URL scheme: {scheme}")
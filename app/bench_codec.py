@@ -0,0 +1,80 @@
+# app/bench_codec.py
+"""
+Measure the ingress/egress path with the chat wire codec.
+
+Pushes the same chat frames as app/test_codec.py through the old path
+(json.loads, dict lookups, re.findall, json.dumps once per recipient) and the
+current one (decode_frame, the precompiled mention pattern, one encode_frame
+per broadcast) and prints messages per second for each. Not part of the test
+suite: timings depend on the machine.
+
+Run with: python -m app.bench_codec
+"""
+
+import json
+import re
+import time
+
+from app import codec
+from app.codec import decode_frame, encode_frame, extract_mentions
+from app.test_codec import SAMPLE_FRAMES
+
+RECIPIENTS = 30  # Sockets in the room
+MESSAGES = 20000
+
+
+def old_path(raw: str) -> int:
+    data = json.loads(raw)
+    message_type = data.get("type", "chat")
+    payload = {
+        "type": message_type,
+        "username": data.get("username", "anon"),
+        "message": data.get("message", ""),
+        "mentions": list(set(re.findall(r'@(\w+)', data.get("message", "")))),
+        "id": 1
+    }
+    if "file_url" in data:
+        payload["file_url"] = data["file_url"]
+        payload["filename"] = data.get("filename")
+        payload["file_type"] = data.get("file_type")
+        payload["file_size"] = data.get("file_size")
+    return sum(len(json.dumps(payload)) for _ in range(RECIPIENTS))
+
+
+def new_path(raw: bytes) -> int:
+    frame = decode_frame(raw, "anon")
+    payload = {
+        "type": frame.type,
+        "username": frame.username,
+        "message": frame.message,
+        "mentions": extract_mentions(frame.message),
+        "id": 1
+    }
+    if frame.has_file:
+        payload["file_url"] = frame.file_url
+        payload["filename"] = frame.filename
+        payload["file_type"] = frame.file_type
+        payload["file_size"] = frame.file_size
+    encoded = encode_frame(payload)
+    return sum(len(encoded) for _ in range(RECIPIENTS))
+
+
+def measure(path, frames) -> float:
+    started = time.perf_counter()
+    for i in range(MESSAGES):
+        path(frames[i % len(frames)])
+    return MESSAGES / (time.perf_counter() - started)
+
+
+def benchmark():
+    encoded_frames = [raw.encode() for raw in SAMPLE_FRAMES]
+    old_rate = measure(old_path, SAMPLE_FRAMES)
+    new_rate = measure(new_path, encoded_frames)
+    print(f"   JSON library: {'orjson' if codec.orjson else 'json (orjson not installed)'}")
+    print(f"   Old path: {old_rate:>10,.0f} messages/s ({RECIPIENTS} recipients)")
+    print(f"   Codec:    {new_rate:>10,.0f} messages/s ({new_rate / old_rate:.1f}x)")
+
+
+if __name__ == "__main__":
+    print("⏱️  Ingress/egress microbenchmark:")
+    benchmark()
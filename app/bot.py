@@ -0,0 +1,268 @@
+# app/bot.py
+"""
+Server-side @bot: answers questions asked in the chat with the room as context.
+
+A chat message starting with "@bot" is persisted and broadcast like any other,
+then queued here. BOT_WORKERS background tasks take questions off the queue,
+stream the answer to the room (ai_stream frames) and finally persist and
+broadcast it as a normal chat message from the AI Assistant. If no answer can
+be produced nothing is persisted: a final ai_stream frame with done and error
+clears the room's drafts, and only the asker gets an error frame saying why.
+
+The bot's context is a rolling summary of the room kept in room_summaries.
+Every BOT_SUMMARY_EVERY messages the messages since the last summary are folded
+into it with one completion, so a prompt carries the summary plus the few
+messages after it instead of the full history, and stays bounded however long
+the room gets.
+"""
+
+import asyncio
+import datetime
+import os
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app import models
+from app.ai_helper import AINotConfigured, complete, stream_answer
+from app.persistence import message_writer
+from app.room_cache import room_cache
+
+BOT_USERNAME = "AI Assistant"
+BOT_TRIGGER = "@bot"
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "2"))
+BOT_QUEUE_SIZE = int(os.getenv("BOT_QUEUE_SIZE", "100"))
+BOT_SUMMARY_EVERY = int(os.getenv("BOT_SUMMARY_EVERY", "30"))  # Messages between summary updates
+# Most unsummarized messages folded in per update; older ones in a backlog are skipped
+BOT_SUMMARY_MAX_MESSAGES = int(os.getenv("BOT_SUMMARY_MAX_MESSAGES", "100"))
+BOT_SUMMARY_MAX_WORDS = int(os.getenv("BOT_SUMMARY_MAX_WORDS", "250"))
+BOT_CONTEXT_MESSAGES = int(os.getenv("BOT_CONTEXT_MESSAGES", "20"))  # Recent messages sent after the summary
+BOT_MESSAGE_CHARS = 500  # Each message is cut to this many characters in prompts
+AI_STREAM_INTERVAL_MS = int(os.getenv("AI_STREAM_INTERVAL_MS", "50"))  # Batch tokens into one frame per interval
+
+USAGE_HINT = (
+    "Hi! I'm your AI Study Assistant. Ask me anything academic like:\n"
+    "• @bot explain photosynthesis\n• @bot summarize this discussion\n• @bot help with calculus"
+)
+SUMMARY_PROMPT = (
+    "You maintain a running summary of a student study-group chat. Update the summary with "
+    "the new messages: keep the topics discussed, questions asked, answers agreed on and open "
+    "questions. Reply with the updated summary only, at most {words} words."
+)
+
+# broadcast(message, room_id)
+Broadcast = Callable[[dict, str], Awaitable[None]]
+# notify(message): send to the socket that asked
+Notify = Callable[[dict], Awaitable[None]]
+
+
+def bot_question(content: str) -> Optional[str]:
+    """The question in an @bot message ("" if none was asked), or None if it isn't one."""
+    text = content.strip()
+    if not text.lower().startswith(BOT_TRIGGER):
+        return None
+    rest = text[len(BOT_TRIGGER):]
+    if rest and not rest[0].isspace() and rest[0] not in ",:":
+        return None  # "@bots", "@botany" are not for us
+    return rest.lstrip(" ,:\t\n")
+
+
+def format_messages(rows) -> str:
+    return "\n".join(f"{username or 'Unknown'}: {(content or '')[:BOT_MESSAGE_CHARS]}" for username, content in rows)
+
+
+class BotWorker:
+    def __init__(self):
+        self.queue: Optional[asyncio.Queue] = None
+        self.broadcast: Optional[Broadcast] = None
+        self._tasks: List[asyncio.Task] = []
+        self._since_summary: Dict[str, int] = {}
+        self._summary_locks: Dict[str, asyncio.Lock] = {}
+        self._summaries_queued: Set[str] = set()
+
+    async def start(self, broadcast: Broadcast):
+        self.broadcast = broadcast
+        self.queue = asyncio.Queue(BOT_QUEUE_SIZE)
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(BOT_WORKERS)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+
+    def ask(self, room_id: str, asked_by: str, question: str, request_id: str, notify: Optional[Notify] = None) -> bool:
+        """Queue a question. Returns False if the bot is too busy to take it."""
+        try:
+            self.queue.put_nowait(("answer", room_id, asked_by, question, request_id, notify))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def note_message(self, room_id: str):
+        """Count a new room message; queue a summary update every BOT_SUMMARY_EVERY messages."""
+        count = self._since_summary.get(room_id, 0) + 1
+        self._since_summary[room_id] = count
+        if count >= BOT_SUMMARY_EVERY and room_id not in self._summaries_queued:
+            try:
+                self.queue.put_nowait(("summarize", room_id))
+                self._summaries_queued.add(room_id)
+            except (asyncio.QueueFull, AttributeError):
+                pass  # Caught up on the next trigger or question
+
+    async def _run(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job[0] == "answer":
+                    await self._answer(*job[1:])
+                else:
+                    self._summaries_queued.discard(job[1])
+                    await self.update_summary(job[1])
+            except Exception as e:
+                print(f"Error running bot job {job[0]}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def _load_room(self, db, room_id: str):
+        room = await room_cache.get(room_id)
+        if room is None:
+            return None, None
+        summary = await db.get(models.RoomSummary, room.id)
+        return room, summary
+
+    async def _messages_after(self, db, room_pk: int, after_id: int, limit: int):
+        """(username, content) of the newest `limit` visible messages after after_id, oldest first."""
+        rows = (await db.execute(
+            select(models.Message.id, models.User.username, models.Message.content).outerjoin(
+                models.User, models.Message.user_id == models.User.id
+            ).where(
+                models.Message.room_id == room_pk,
+                models.Message.is_deleted == 0,
+                models.Message.id > after_id
+            ).order_by(models.Message.id.desc()).limit(limit)
+        )).all()
+        rows.reverse()
+        return rows
+
+    async def update_summary(self, room_id: str):
+        """Fold the messages since the last summary into it."""
+        lock = self._summary_locks.setdefault(room_id, asyncio.Lock())
+        async with lock:
+            self._since_summary[room_id] = 0
+            await message_writer.flush()
+            async with AsyncSessionLocal() as db:
+                room, summary = await self._load_room(db, room_id)
+                if room is None:
+                    return
+                after_id = summary.last_message_id if summary else 0
+                rows = await self._messages_after(db, room.id, after_id, BOT_SUMMARY_MAX_MESSAGES)
+                if not rows:
+                    return
+                previous = summary.summary if summary else ""
+                updated = await complete([
+                    {"role": "system", "content": SUMMARY_PROMPT.format(words=BOT_SUMMARY_MAX_WORDS)},
+                    {"role": "user", "content": (
+                        f"Current summary:\n{previous or '(none yet)'}\n\n"
+                        f"New messages:\n{format_messages((username, content) for _, username, content in rows)}"
+                    )}
+                ], max_tokens=BOT_SUMMARY_MAX_WORDS * 2)
+                if summary is None:
+                    summary = models.RoomSummary(room_id=room.id)
+                    db.add(summary)
+                summary.summary = updated.strip()
+                summary.last_message_id = rows[-1][0]
+                summary.updated_at = datetime.datetime.utcnow()
+                await db.commit()
+                print(f"📝 Updated summary of room {room_id} through message {rows[-1][0]}")
+
+    async def room_context(self, room_id: str) -> Tuple[str, str]:
+        """
+        The prompt context for a question: rolling summary plus the messages after it.
+
+        Returns (context, key). Exchanges with the bot itself are left out, so
+        the question being answered (and anyone asking the same at the same
+        time) doesn't change the context; the key names the summary and last
+        message it was built from, for the answer cache.
+        """
+        await message_writer.flush()
+        async with AsyncSessionLocal() as db:
+            room, summary = await self._load_room(db, room_id)
+            if room is None:
+                return "", ""
+            summarized_id = summary.last_message_id if summary else 0
+            recent = [
+                (message_id, username, content)
+                for message_id, username, content in await self._messages_after(db, room.id, summarized_id, BOT_CONTEXT_MESSAGES)
+                if username != BOT_USERNAME and bot_question(content or "") is None
+            ]
+        parts = []
+        if summary and summary.summary:
+            parts.append(f"Summary of the discussion so far:\n{summary.summary}")
+        if recent:
+            parts.append(f"Latest messages:\n{format_messages((username, content) for _, username, content in recent)}")
+        return "\n\n".join(parts), f"{room.id}:{summarized_id}:{recent[-1][0] if recent else 0}"
+
+    async def _answer(self, room_id: str, asked_by: str, question: str, request_id: str, notify: Optional[Notify] = None):
+        """Stream the answer to the room, then persist and broadcast it as a chat message."""
+        frame = {"type": "ai_stream", "request_id": request_id, "username": BOT_USERNAME, "asked_by": asked_by, "question": question}
+        reply: List[str] = []
+        pending: List[str] = []
+        loop = asyncio.get_running_loop()
+        last_sent = loop.time()
+        try:
+            if "summar" in question.lower() and self._since_summary.get(room_id, 0):
+                # Asked for a summary: bring it up to date first
+                await self.update_summary(room_id)
+            context, context_key = await self.room_context(room_id)
+            async for delta in stream_answer(question, context=context, context_key=context_key):
+                reply.append(delta)
+                pending.append(delta)
+                if (loop.time() - last_sent) * 1000 >= AI_STREAM_INTERVAL_MS:
+                    await self.broadcast({**frame, "delta": "".join(pending), "done": False}, room_id)
+                    pending.clear()
+                    last_sent = loop.time()
+            content = "".join(reply)
+        except AINotConfigured:
+            await self._fail(room_id, frame, notify, "AI service not configured. Please set OPENROUTER_API_KEY environment variable.")
+            return
+        except Exception as e:
+            print(f"AI Helper Error: {str(e)}")
+            await self._fail(room_id, frame, notify, "Sorry, I'm having trouble right now. Please try again later.")
+            return
+
+        message_id = await message_writer.allocate_id()
+        await message_writer.submit({
+            "id": message_id,
+            "room": room_id,
+            "username": BOT_USERNAME,
+            "content": content
+        })
+        self.note_message(room_id)
+        # Same shape as any chat message, plus request_id so clients replace the streamed draft
+        await self.broadcast({
+            "type": "chat",
+            "id": message_id,
+            "message_id": message_id,
+            "username": BOT_USERNAME,
+            "message": content,
+            "timestamp": datetime.datetime.now().isoformat(),
+            "mentions": [],
+            "is_bot": True,
+            "request_id": request_id,
+            "asked_by": asked_by
+        }, room_id)
+
+    async def _fail(self, room_id: str, frame: dict, notify: Optional[Notify], reason: str):
+        """No answer: end the room's drafts and tell only the asker why. Nothing is stored."""
+        await self.broadcast({**frame, "delta": "", "done": True, "error": True}, room_id)
+        if notify:
+            await notify({"type": "error", "code": "ai_unavailable", "message": reason, "request_id": frame["request_id"]})
+
+
+bot_worker = BotWorker()
@@ -0,0 +1,134 @@
+# app/broadcast.py
+"""
+Per-connection outbound queues for room fan-out.
+
+Every WebSocket gets its own bounded queue and a writer task, so a broadcast
+only serializes the event once and enqueues the same frame for each member.
+A slow client can then only fall behind on its own queue; what happens when
+that queue fills up is decided by the slow-consumer policy:
+
+- "coalesce": drop stale ephemeral frames (typing, presence) first, keeping
+  only the newest frame for each coalesce key, and disconnect the client only
+  if the queue is still full of real chat traffic
+- "drop": disconnect the slow client as soon as its queue is full
+"""
+
+import asyncio
+import os
+from collections import deque
+from typing import Callable, Optional
+
+from fastapi import WebSocket
+
+SEND_QUEUE_SIZE = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))
+SEND_TIMEOUT_SECONDS = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "coalesce")
+
+# Close code sent to clients that could not keep up (1013 = "try again later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# Event types that only describe current state, so an older pending frame
+# can safely be replaced by a newer one
+COALESCABLE_TYPES = {"typing", "stop_typing", "typing_state", "online_users", "user_joined", "user_left"}
+
+
+def coalesce_key(message: dict) -> Optional[str]:
+    """Return the key under which a frame may replace older pending frames."""
+    message_type = message.get("type")
+    if message_type in ("typing", "stop_typing"):
+        return f"typing:{message.get('username')}"
+    if message_type == "typing_state":
+        return "typing_state"
+    if message_type in ("online_users", "user_joined", "user_left"):
+        # Every presence frame carries the full online list, so only the latest matters
+        return "presence"
+    return None
+
+
+class ConnectionWriter:
+    """Bounded outbound queue plus the task that drains it into one WebSocket."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        on_dead: Callable[["ConnectionWriter"], None],
+        max_queue: int = SEND_QUEUE_SIZE,
+        policy: str = SLOW_CONSUMER_POLICY,
+    ):
+        self.websocket = websocket
+        self.on_dead = on_dead
+        self.max_queue = max_queue
+        self.policy = policy
+        self.queue: deque = deque()  # (frame, coalesce_key) tuples
+        self.closed = False
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, frame: str, key: Optional[str] = None) -> bool:
+        """Queue an already-serialized frame. Returns False if the client was dropped."""
+        if self.closed:
+            return False
+
+        if len(self.queue) >= self.max_queue and not self._make_room(key):
+            print(f"🐢 Dropping slow consumer ({len(self.queue)} frames pending)")
+            self._drop()
+            return False
+
+        self.queue.append((frame, key))
+        self._wakeup.set()
+        return True
+
+    def _make_room(self, key: Optional[str]) -> bool:
+        """Try to free a slot according to the slow-consumer policy."""
+        if self.policy != "coalesce":
+            return False
+
+        # Prefer replacing an older frame with the same key
+        if key is not None:
+            for index, (_, pending_key) in enumerate(self.queue):
+                if pending_key == key:
+                    del self.queue[index]
+                    return True
+
+        # Otherwise give up the oldest ephemeral frame
+        for index, (_, pending_key) in enumerate(self.queue):
+            if pending_key is not None:
+                del self.queue[index]
+                return True
+
+        return False
+
+    async def _run(self):
+        try:
+            while True:
+                while not self.queue:
+                    self._wakeup.clear()
+                    await self._wakeup.wait()
+                frame, _ = self.queue.popleft()
+                await asyncio.wait_for(self.websocket.send_text(frame), SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            print(f"Error sending to websocket: {e}")
+            self._drop()
+
+    def _drop(self):
+        """Stop writing and hand the connection back to the manager for cleanup."""
+        if self.closed:
+            return
+        self.close()
+        self.on_dead(self)
+        asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        try:
+            await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE)
+        except Exception:
+            pass
+
+    def close(self):
+        """Stop the writer task and discard anything still queued."""
+        self.closed = True
+        self.queue.clear()
+        if self._task is not asyncio.current_task():
+            self._task.cancel()
@@ -1,180 +1,538 @@
 # app/chat.py
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import Dict, List
-import json
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Depends, HTTPException, Query, Response
+from sqlalchemy import select, delete
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Dict, List, Optional, Set, Tuple, Union
 import datetime
 import asyncio
-import re
-from app.database import get_db
+import os
+from app.database import AsyncReadSessionLocal, AsyncSessionLocal, get_read_db
 from app import models
+from app.archive import read_page as read_archive_page
+from app.broadcast import ConnectionWriter, coalesce_key
+from app.codec import JSONDecodeError, decode_frame, encode_frame, extract_mentions, loads
+from app.persistence import message_writer
+from app.files import adjust_blob_refs, preview_for_url
+from app.room_cache import room_cache
+from app.rate_limit import RATE_LIMIT_MAX_PAUSE_SECONDS, rate_limiter, user_key
+from app.presence import TypingAggregator
+from app.heartbeat import HeartbeatMonitor
+from app.history_buffer import HistoryBuffer
+from app.backplane import Backplane, create_backplane
+from app.bot import BOT_USERNAME, USAGE_HINT, bot_question, bot_worker
 
 router = APIRouter(prefix="/chat", tags=["Chat"])
 
-def extract_mentions(message: str) -> List[str]:
-    """Extract @mentions from message text."""
-    pattern = r'@(\w+)'
-    mentions = re.findall(pattern, message)
-    return list(set(mentions))  # Return unique mentions
+HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_PAGE_SIZE", "50"))
+MAX_HISTORY_PAGE_SIZE = int(os.getenv("CHAT_HISTORY_MAX_PAGE_SIZE", "200"))
+JOIN_HISTORY_LIMIT = int(os.getenv("CHAT_JOIN_HISTORY_LIMIT", "200"))  # Most messages replayed on join
+HISTORY_CHUNK_SIZE = int(os.getenv("CHAT_HISTORY_CHUNK_SIZE", "50"))  # Messages per history frame
 
-def save_message_to_db(db: Session, message_data: dict, room_id: str):
-    """Save message to database."""
-    try:
-        # Get or create user
-        user = db.query(models.User).filter(models.User.username == message_data.get("username")).first()
-        if not user:
-            # Create user if doesn't exist
-            user = models.User(username=message_data.get("username"), password_hash="", is_admin=0)
-            db.add(user)
-            db.commit()
-            db.refresh(user)
-        
-        # Get or create room
-        room = db.query(models.Room).filter(models.Room.name == room_id).first()
-        if not room:
-            room = models.Room(name=room_id, admin_username=None)
-            db.add(room)
-            db.commit()
-            db.refresh(room)
-        
-        # Create message
-        msg = models.Message(
-            room_id=room.id,
-            user_id=user.id,
-            content=message_data.get("message", ""),
-            file_url=message_data.get("file_url"),
-            filename=message_data.get("filename"),
-            file_type=message_data.get("file_type"),
-            file_size=message_data.get("file_size"),
-            mentioned_users=",".join(message_data.get("mentions", [])) if message_data.get("mentions") else None
-        )
-        db.add(msg)
-        db.commit()
-        return msg
-    except Exception as e:
-        print(f"Error saving message: {e}")
-        db.rollback()
-        return None
-
-def get_or_create_room(db: Session, room_name: str, first_username: str = None):
+async def get_or_create_room(db: AsyncSession, room_name: str, first_username: str = None):
     """Get or create room, set first user as admin."""
-    room = db.query(models.Room).filter(models.Room.name == room_name).first()
+    room = await db.scalar(select(models.Room).where(models.Room.name == room_name))
     if not room:
         # Create room and set first user as admin
         room = models.Room(name=room_name, admin_username=first_username if first_username else None)
         db.add(room)
-        db.commit()
-        db.refresh(room)
+        await db.commit()
     return room
 
-def is_user_muted(db: Session, room_id: int, username: str):
+async def is_user_muted(room_name: str, username: str):
     """Check if user is muted in the room."""
-    muted = db.query(models.MutedUser).filter(
-        models.MutedUser.room_id == room_id,
-        models.MutedUser.username == username
-    ).first()
-    return muted is not None
+    room = await room_cache.get(room_name)
+    return room is not None and username in room.muted
 
-def is_room_admin(db: Session, room_name: str, username: str):
+async def is_room_admin(room_name: str, username: str):
     """Check if user is admin of the room."""
-    room = db.query(models.Room).filter(models.Room.name == room_name).first()
-    if not room:
+    room = await room_cache.get(room_name)
+    if not room or not room.admin_username:
         return False
     return room.admin_username == username
 
-def get_chat_history_sync(room_name: str, db: Session):
-    """Synchronous version of get_chat_history for use in executor."""
+def serialize_message(msg: models.Message, username: str) -> dict:
+    """Build the chat payload for a stored message."""
+    return {
+        "id": msg.id,
+        "username": username or "Unknown",
+        "message": msg.content,
+        "timestamp": msg.timestamp.isoformat() if msg.timestamp else None,
+        "file_url": msg.file_url,
+        "filename": msg.filename,
+        "file_type": msg.file_type,
+        "file_size": msg.file_size,
+        "thumbnail_url": msg.thumbnail_url,
+        "width": msg.width,
+        "height": msg.height,
+        "mentions": msg.mentioned_users.split(",") if msg.mentioned_users else [],
+        "is_bot": username == BOT_USERNAME,
+        "type": "chat"
+    }
+
+def serialize_record(record: dict) -> dict:
+    """serialize_message() of a message still on its way to the database (a writer record)."""
+    return {
+        "id": record["id"],
+        "username": record.get("username") or "Unknown",
+        "message": record.get("content"),
+        "timestamp": record["timestamp"].isoformat(),
+        "file_url": record.get("file_url"),
+        "filename": record.get("filename"),
+        "file_type": record.get("file_type"),
+        "file_size": record.get("file_size"),
+        "thumbnail_url": record.get("thumbnail_url"),
+        "width": record.get("width"),
+        "height": record.get("height"),
+        "mentions": record["mentioned_users"].split(",") if record.get("mentioned_users") else [],
+        "is_bot": record.get("username") == BOT_USERNAME,
+        "type": "chat"
+    }
+
+async def fetch_history_page(db: AsyncSession, room_name: str, before_id: Optional[int] = None, limit: int = HISTORY_PAGE_SIZE):
+    """
+    Fetch one page of a room's history, newest page first.
+
+    Uses keyset pagination on messages.id (served by ix_messages_room_deleted_id),
+    so every page costs the same no matter how deep into the room it is.
+    Messages in the page are returned oldest first; pass next_before_id back as
+    before_id to get the previous page. Past the oldest message in the table,
+    pages continue from the room's archive.
+    """
+    limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+    room_pk = await db.scalar(select(models.Room.id).where(models.Room.name == room_name))
+    if room_pk is None:
+        return {"messages": [], "has_more": False, "next_before_id": None}
+
+    query = select(models.Message, models.User.username).outerjoin(
+        models.User, models.Message.user_id == models.User.id
+    ).where(
+        models.Message.room_id == room_pk,
+        models.Message.is_deleted == 0
+    )
+    if before_id is not None:
+        query = query.where(models.Message.id < before_id)
+
+    # Fetch one extra row to know whether an older page exists
+    rows = (await db.execute(query.order_by(models.Message.id.desc()).limit(limit + 1))).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    messages = [serialize_message(msg, username) for msg, username in rows]
+    if not has_more:
+        # The table has nothing older; the rest of the page may have been archived
+        archived, has_more = await read_archive_page(db, room_pk, rows[0][0].id if rows else before_id, limit - len(rows))
+        messages = archived + messages
+
+    return {
+        "messages": messages,
+        "has_more": has_more,
+        "next_before_id": messages[0]["id"] if has_more and messages else None
+    }
+
+async def fetch_history_since(db: AsyncSession, room_name: str, since_id: int, limit: int = JOIN_HISTORY_LIMIT):
+    """
+    Fetch the messages a reconnecting client missed (id > since_id), oldest first.
+
+    At most the newest `limit` messages are returned. If the gap was larger than
+    that, truncated is True and the client should replace its view with this
+    page instead of appending to it.
+    """
+    room_pk = await db.scalar(select(models.Room.id).where(models.Room.name == room_name))
+    if room_pk is None:
+        return {"messages": [], "truncated": False, "next_before_id": None}
+
+    rows = (await db.execute(
+        select(models.Message, models.User.username).outerjoin(
+            models.User, models.Message.user_id == models.User.id
+        ).where(
+            models.Message.room_id == room_pk,
+            models.Message.is_deleted == 0,
+            models.Message.id > since_id
+        ).order_by(models.Message.id.desc()).limit(limit + 1)
+    )).all()
+    truncated = len(rows) > limit
+    rows = rows[:limit]
+    rows.reverse()
+    messages = [serialize_message(msg, username) for msg, username in rows]
+    if not truncated:
+        # Part of the gap may have been archived while the client was away
+        archived, truncated = await read_archive_page(
+            db, room_pk, rows[0][0].id if rows else None, limit - len(rows), after_id=since_id
+        )
+        messages = archived + messages
+
+    return {
+        "messages": messages,
+        "truncated": truncated,
+        "next_before_id": messages[0]["id"] if truncated and messages else None
+    }
+
+async def get_chat_history_page(room_name: str, db: AsyncSession, before_id: Optional[int] = None, limit: int = HISTORY_PAGE_SIZE):
+    """One page of history, or an empty page if the query fails."""
     try:
-        room = db.query(models.Room).filter(models.Room.name == room_name).first()
-        if not room:
-            return {"messages": []}
-        
-        messages = db.query(models.Message).filter(
-            models.Message.room_id == room.id,
-            models.Message.is_deleted == 0
-        ).order_by(models.Message.timestamp.asc()).all()
-        
-        result = []
-        for msg in messages:
-            result.append({
-                "id": msg.id,
-                "username": msg.user.username if msg.user else "Unknown",
-                "message": msg.content,
-                "timestamp": msg.timestamp.isoformat() if msg.timestamp else None,
-                "file_url": msg.file_url,
-                "filename": msg.filename,
-                "file_type": msg.file_type,
-                "file_size": msg.file_size,
-                "mentions": msg.mentioned_users.split(",") if msg.mentioned_users else [],
-                "type": "chat"
-            })
-        
-        return {"messages": result}
+        # Messages still in the write-behind queue must be visible to readers
+        await message_writer.flush()
+        return await fetch_history_page(db, room_name, before_id, limit)
     except Exception as e:
         print(f"Error fetching history: {e}")
-        return {"messages": []}
+        return {"messages": [], "has_more": False, "next_before_id": None}
+
+async def get_join_history(room_name: str, db: AsyncSession, since_id: Optional[int] = None):
+    """
+    History to send on WebSocket join: the delta after since_id when the client
+    has a cursor, otherwise the newest JOIN_HISTORY_LIMIT messages.
+
+    Messages come back encoded ("frames"). They are served from the room's
+    history buffer when it covers them; a database read of the newest page
+    seeds the buffer for the next join.
+    """
+    history = manager.history
+    if since_id is not None:
+        hot = history.since(room_name, since_id, JOIN_HISTORY_LIMIT)
+        if hot is not None:
+            frames, truncated, next_before_id = hot
+            return {"frames": frames, "mode": "replace" if truncated else "append", "has_more": truncated, "next_before_id": next_before_id}
+    else:
+        hot = history.page(room_name, None, JOIN_HISTORY_LIMIT)
+        if hot is not None:
+            frames, has_more, next_before_id = hot
+            return {"frames": frames, "mode": "replace", "has_more": has_more, "next_before_id": next_before_id}
+
+    try:
+        await message_writer.flush()
+        if since_id is not None:
+            delta = await fetch_history_since(db, room_name, since_id)
+            frames = [encode_frame(message) for message in delta["messages"]]
+            if not delta["truncated"]:
+                return {"frames": frames, "mode": "append", "has_more": False, "next_before_id": None}
+            return {"frames": frames, "mode": "replace", "has_more": True, "next_before_id": delta["next_before_id"]}
+
+        page = await fetch_history_page(db, room_name, limit=JOIN_HISTORY_LIMIT)
+        frames = [encode_frame(message) for message in page["messages"]]
+        history.seed(room_name, [(message["id"], frame) for message, frame in zip(page["messages"], frames)], page["has_more"])
+        return {"frames": frames, "mode": "replace", "has_more": page["has_more"], "next_before_id": page["next_before_id"]}
+    except Exception as e:
+        print(f"Error fetching history: {e}")
+        return None
+
+def history_frame(header: dict, frames: List[str]) -> str:
+    """Encode header with a "messages" list made of already-encoded messages."""
+    return f'{encode_frame(header)[:-1]},"messages":[{",".join(frames)}]}}'
+
+# Events that change cached room metadata; other workers drop their cached copy
+ROOM_METADATA_EVENTS = {"user_muted", "user_unmuted"}
+
+# Close code for connections reaped by the heartbeat (1001 = "going away")
+HEARTBEAT_CLOSE_CODE = 1001
+
+# A user who disconnects and comes back within this window (page reload, flaky
+# network) is never announced as having left and rejoined
+PRESENCE_GRACE_SECONDS = float(os.getenv("PRESENCE_GRACE_SECONDS", "5"))
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
-        self.room_users: Dict[str, List[str]] = {}  # Track users in each room
+    def __init__(self, backplane: Backplane = None):
+        self.active_connections: Dict[str, Set[WebSocket]] = {}
+        # Presence on this worker: room -> username -> that user's sockets in the room.
+        # A user stays listed (with no sockets) during the leave grace window.
+        self.room_presence: Dict[str, Dict[str, Set[WebSocket]]] = {}
+        self.user_rooms: Dict[str, Set[str]] = {}  # username -> rooms they are present in
+        self.writers: Dict[WebSocket, ConnectionWriter] = {}  # Outbound queue per socket
+        self.backplane = backplane or create_backplane()  # Carries events to other workers
+        self.typing = TypingAggregator()
+        self._pending_leaves: Dict[Tuple[str, str], asyncio.TimerHandle] = {}
+        self._tasks: Set[asyncio.Task] = set()  # Background cleanups, kept referenced until done
+        self.quiet_rejoins = 0  # Reconnects within the grace window that weren't announced
+        self.connection_info: Dict[WebSocket, Tuple[str, Optional[str]]] = {}  # socket -> (room, username)
+        self.heartbeat = HeartbeatMonitor()
+        self.history = HistoryBuffer()  # Recent messages per room, for joins and history pages
+        self.dropped = 0  # Sockets given up on by their writer (slow or failed sends)
+
+    async def start(self):
+        await self.backplane.start(self._deliver_remote)
+        await self.typing.start(self._deliver_event)
+        await self.heartbeat.start(self._ping, self._reap)
+        message_writer.on_submit = self._remember_message
+        message_writer.on_dropped = self._retract_message
 
-    async def connect(self, websocket: WebSocket, room_id: str, username: str = None):
+    async def stop(self):
+        for handle in self._pending_leaves.values():
+            handle.cancel()
+        self._pending_leaves.clear()
+        await self.heartbeat.stop()
+        await self.typing.stop()
+        await self.backplane.stop()
+
+    async def connect(self, websocket: WebSocket, room_id: str, username: str = None) -> bool:
+        """Register a socket. Returns True if the user's arrival was announced to the room."""
         await websocket.accept()
-        if room_id not in self.active_connections:
-            self.active_connections[room_id] = []
-            self.room_users[room_id] = []
-        
-        self.active_connections[room_id].append(websocket)
+        self.active_connections.setdefault(room_id, set()).add(websocket)
+        self.writers[websocket] = ConnectionWriter(
+            websocket,
+            on_dead=lambda writer: self._writer_dead(websocket)
+        )
+        self.connection_info[websocket] = (room_id, username)
+        self.heartbeat.track(websocket)
         
-        # Add user to room if username provided and not Anonymous
-        if username and username != "Anonymous" and username not in self.room_users[room_id]:
-            self.room_users[room_id].append(username)
-            print(f"👤 Added user {username} to room {room_id}. Online users: {self.room_users[room_id]}")
+        pending_leave = self._pending_leaves.pop((room_id, username), None)
+        if pending_leave:
+            # Back within the grace window: the room never saw them leave
+            pending_leave.cancel()
+            self.quiet_rejoins += 1
+
+        if not username or username == "Anonymous":
+            return False
+
+        # Add user to room unless they are already here (another tab, or a reconnect)
+        users = self.room_presence.setdefault(room_id, {})
+        if username not in users:
+            users[username] = {websocket}
+            self.user_rooms.setdefault(username, set()).add(room_id)
+            await self.backplane.sync_presence(room_id, list(users))
+            online_users = await self.backplane.room_users(room_id, list(users))
+            print(f"👤 Added user {username} to room {room_id}. Online users: {online_users}")
             # Broadcast user joined
             await self.broadcast_to_room({
                 "type": "user_joined",
                 "username": username,
-                "online_users": self.room_users[room_id],
+                "online_users": online_users,
                 "timestamp": datetime.datetime.now().isoformat()
             }, room_id)
-        elif username and username != "Anonymous":
-            print(f"👤 User {username} already in room {room_id}. Online users: {self.room_users[room_id]}")
-            # Still send current online users to the new connection
-            await websocket.send_text(json.dumps({
-                "type": "online_users",
-                "online_users": self.room_users[room_id],
-                "timestamp": datetime.datetime.now().isoformat()
-            }))
+            return True
 
-    def disconnect(self, websocket: WebSocket, room_id: str, username: str = None):
-        if room_id in self.active_connections:
-            self.active_connections[room_id].remove(websocket)
-            
-            # Remove user from room if username provided and not Anonymous
-            if username and username != "Anonymous" and username in self.room_users[room_id]:
-                self.room_users[room_id].remove(username)
-                print(f"👤 Removed user {username} from room {room_id}. Online users: {self.room_users[room_id]}")
-                # Broadcast user left
-                asyncio.create_task(self.broadcast_to_room({
-                    "type": "user_left",
-                    "username": username,
-                    "online_users": self.room_users[room_id],
-                    "timestamp": datetime.datetime.now().isoformat()
-                }, room_id))
+        users[username].add(websocket)
+        online_users = await self.backplane.room_users(room_id, list(users))
+        print(f"👤 User {username} already in room {room_id}. Online users: {online_users}")
+        # Still send current online users to the new connection
+        await self.send_personal({
+            "type": "online_users",
+            "online_users": online_users,
+            "timestamp": datetime.datetime.now().isoformat()
+        }, websocket)
+        typing_users = self.typing.typing_users(room_id)
+        if typing_users:
+            await self.send_personal({"type": "typing_state", "users": typing_users}, websocket)
+        return False
+
+    async def disconnect(self, websocket: WebSocket, room_id: str, username: str = None):
+        """Forget a socket and take its user out of the room. Safe to call more than once."""
+        if self.connection_info.pop(websocket, None) is None:
+            return  # Already cleaned up (reaped or dropped)
+        self.heartbeat.untrack(websocket)
+        self._remove_connection(websocket, room_id)
+
+        sockets = self.room_presence.get(room_id, {}).get(username)
+        if sockets is None:
+            return  # Anonymous
+        sockets.discard(websocket)
+        if sockets:
+            return  # Still here in another tab
+        await self.set_typing(room_id, username, False)
+        if PRESENCE_GRACE_SECONDS <= 0:
+            await self._leave(room_id, username)
+        elif (room_id, username) not in self._pending_leaves:
+            # Announce the leave only if they don't come back in time
+            self._pending_leaves[(room_id, username)] = asyncio.get_running_loop().call_later(
+                PRESENCE_GRACE_SECONDS, self._leave_later, room_id, username
+            )
+
+    def _leave_later(self, room_id: str, username: str):
+        self._spawn(self._leave(room_id, username))
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
 
+    def _writer_dead(self, websocket: WebSocket):
+        """The socket's writer gave up on it (and closes it): clean up the room too."""
+        info = self.connection_info.get(websocket)
+        if info:
+            self.dropped += 1
+            self._remove_connection(websocket, info[0])
+            self._spawn(self.disconnect(websocket, *info))
+
+    async def _ping(self, websocket: WebSocket):
+        await self.send_personal({"type": "ping"}, websocket)
+
+    async def _reap(self, websocket: WebSocket):
+        """Heartbeat timeout: the peer is gone without closing. Clean up and close our end."""
+        info = self.connection_info.get(websocket)
+        if info is None:
+            return
+        print(f"💀 Reaping silent connection of {info[1]} in room {info[0]}")
+        await self.disconnect(websocket, *info)
+        self._spawn(self._close_socket(websocket))
+
+    async def _close_socket(self, websocket: WebSocket):
+        try:
+            await websocket.close(code=HEARTBEAT_CLOSE_CODE)
+        except Exception:
+            pass
+
+    async def _leave(self, room_id: str, username: str):
+        self._pending_leaves.pop((room_id, username), None)
+        users = self.room_presence.get(room_id, {})
+        if users.get(username, True):
+            return  # Not here, or came back
+        del users[username]
+        if not users:
+            del self.room_presence[room_id]
+        rooms = self.user_rooms.get(username)
+        if rooms is not None:
+            rooms.discard(room_id)
+            if not rooms:
+                del self.user_rooms[username]
+        await self.backplane.sync_presence(room_id, list(users))
+        online_users = await self.backplane.room_users(room_id, list(users))
+        print(f"👤 Removed user {username} from room {room_id}. Online users: {online_users}")
+        # Broadcast user left
+        await self.broadcast_to_room({
+            "type": "user_left",
+            "username": username,
+            "online_users": online_users,
+            "timestamp": datetime.datetime.now().isoformat()
+        }, room_id)
+        await self.broadcast_to_room({
+            "type": "system",
+            "message": f"❌ {username} left room {room_id}",
+            "timestamp": datetime.datetime.now().isoformat()
+        }, room_id)
+
+    async def set_typing(self, room_id: str, username: str, typing: bool):
+        """Record a typing change; rooms get it in the aggregator's next typing_state frame."""
+        if not self.typing.set_typing(room_id, username, typing):
+            return
+        await self.backplane.publish(
+            room_id, "typing", None, encode_frame({"type": "typing", "username": username, "typing": typing})
+        )
+
+    def _remove_connection(self, websocket: WebSocket, room_id: str):
+        """Forget a socket and stop its writer. Safe to call more than once."""
+        connections = self.active_connections.get(room_id)
+        if connections is not None:
+            connections.discard(websocket)
+            if not connections:
+                del self.active_connections[room_id]
+        writer = self.writers.pop(websocket, None)
+        if writer:
+            writer.close()
+
+    def _remember_message(self, record: dict):
+        """Every message this worker writes goes into its room's history buffer."""
+        if record.get("room"):
+            self.history.remember(record["room"], record["id"], encode_frame(serialize_record(record)))
+
+    def _retract_message(self, record: dict):
+        """A message the database rejected was already shown: take it back from the room."""
+        if record.get("room"):
+            self._spawn(self.broadcast_to_room({"type": "message_deleted", "message_id": record["id"]}, record["room"]))
+
+    def send_frame(self, frame: str, websocket: WebSocket):
+        """Queue an already-encoded frame for a single socket."""
+        writer = self.writers.get(websocket)
+        if writer:
+            writer.enqueue(frame)
+
+    async def send_personal(self, message: dict, websocket: WebSocket):
+        """Queue a message for a single socket, behind anything already queued for it."""
+        writer = self.writers.get(websocket)
+        if writer:
+            writer.enqueue(encode_frame(message), coalesce_key(message))
 
     async def broadcast_to_room(self, message: dict, room_id: str):
-        if room_id in self.active_connections:
-            for connection in self.active_connections[room_id]:
-                try:
-                    await connection.send_text(json.dumps(message))
-                except:
-                    # Remove broken connections
-                    self.active_connections[room_id].remove(connection)
+        """Serialize once, queue on every local connection, and publish to other workers."""
+        frame = encode_frame(message)
+        key = coalesce_key(message)
+        if message.get("type") == "message_deleted":
+            self.history.remove(room_id, message.get("message_id"))
+        self._deliver_local(room_id, frame, key)
+        await self.backplane.publish(room_id, message.get("type"), key, frame)
+
+    def _deliver_event(self, room_id: str, message: dict):
+        """Send an event to this worker's sockets in the room only."""
+        self._deliver_local(room_id, encode_frame(message), coalesce_key(message))
+
+    def _deliver_local(self, room_id: str, frame: str, key: Optional[str]):
+        connections = self.active_connections.get(room_id)
+        if not connections:
+            return
+        # Copy: a full queue may drop its connection while we iterate
+        for connection in list(connections):
+            writer = self.writers.get(connection)
+            if writer:
+                writer.enqueue(frame, key)
+
+    async def _deliver_remote(self, room_id: str, message_type: Optional[str], key: Optional[str], frame: str):
+        """Handle an event another worker published."""
+        if message_type == "typing":
+            event = loads(frame)
+            self.typing.set_typing(room_id, event["username"], event["typing"])
+            return
+        if message_type == "chat":
+            # Our buffer can't tell where another worker's message belongs; reseed on next join
+            self.history.drop(room_id)
+        elif message_type == "message_deleted":
+            self.history.remove(room_id, loads(frame).get("message_id"))
+        if message_type in ROOM_METADATA_EVENTS:
+            room_cache.invalidate(room_id)
+        self._deliver_local(room_id, frame, key)
 
 manager = ConnectionManager()
 
+async def send_history_frames(websocket: WebSocket, history_data: dict):
+    """
+    Send join history in HISTORY_CHUNK_SIZE frames instead of one large frame.
+
+    The first frame carries the mode ("replace" the client's view or "append"
+    to it); the rest always append. The last frame is marked final.
+    """
+    frames = history_data["frames"]
+    chunks = [frames[i:i + HISTORY_CHUNK_SIZE] for i in range(0, len(frames), HISTORY_CHUNK_SIZE)] or [[]]
+    for index, chunk in enumerate(chunks):
+        header = {
+            "type": "history",
+            "mode": history_data["mode"] if index == 0 else "append",
+            "final": index == len(chunks) - 1
+        }
+        if index == 0:
+            header["has_more"] = history_data["has_more"]
+            header["next_before_id"] = history_data["next_before_id"]
+        manager.send_frame(history_frame(header, chunk), websocket)
+
+async def receive_frame(websocket: WebSocket) -> Union[str, bytes]:
+    """
+    Next client frame as received, text or binary, without converting it:
+    the codec parses bytes directly.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    text = message.get("text")
+    return text if text is not None else message.get("bytes") or b""
+
+async def throttle(websocket: WebSocket, kind: str, room_id: str, username: str) -> bool:
+    """
+    Apply the connection, user and room rate limits to a client frame. Anonymous
+    sockets all share one name, so they get no user bucket.
+
+    Returns True if the frame must be dropped. The client is told so (typing
+    frames are dropped quietly) and its socket isn't read again until a token
+    is back, which pushes back on a flooding client through TCP flow control.
+    """
+    wait = rate_limiter.check(kind, connection=id(websocket), user=user_key(username), room=room_id)
+    if not wait:
+        return False
+    if kind != "typing":
+        await manager.send_personal({
+            "type": "error",
+            "code": "rate_limited",
+            "message": "You're sending messages too fast. Please slow down.",
+            "retry_after": round(wait, 2)
+        }, websocket)
+    await asyncio.sleep(min(wait, RATE_LIMIT_MAX_PAUSE_SECONDS))
+    return True
+
 @router.websocket("/ws/{room_id}")
 async def websocket_endpoint(websocket: WebSocket, room_id: str):
     # Get username from query parameters
@@ -182,233 +540,311 @@ async def websocket_endpoint(websocket: WebSocket, room_id: str):
     print(f"🔌 WebSocket connection: room={room_id}, username={username}")
     
     # Check if this is the first user in the room
-    db = next(get_db())
     is_first_user = False
     is_admin = False
     
     if username and username != "Anonymous":
-        room = get_or_create_room(db, room_id, username)
-        is_first_user = room.admin_username is None
-        is_admin = is_room_admin(db, room_id, username)
-        
-        # If first user, make them admin
-        if is_first_user:
-            room.admin_username = username
-            db.commit()
-            print(f"👑 {username} is now the admin of room {room_id}")
-    db.close()
+        room_info = await room_cache.get(room_id)
+        if room_info is None or room_info.admin_username is None:
+            async with AsyncSessionLocal() as db:
+                room = await get_or_create_room(db, room_id, username)
+                is_first_user = room.admin_username is None
+                
+                # If first user, make them admin
+                if is_first_user:
+                    room.admin_username = username
+                    await db.commit()
+                    print(f"👑 {username} is now the admin of room {room_id}")
+                room_cache.set_admin(room_id, room.admin_username)
+                is_admin = room.admin_username == username
+        else:
+            is_admin = room_info.admin_username == username
     
-    await manager.connect(websocket, room_id, username)
+    joined = await manager.connect(websocket, room_id, username)
     
-    # Send chat history to newly connected user
+    # Send chat history to newly connected user: only what they missed if they
+    # reconnected with a cursor, otherwise the newest page
     if username and username != "Anonymous":
-        db = next(get_db())
+        since_id = websocket.query_params.get("since_id")
+        since_id = int(since_id) if since_id and since_id.isdigit() else None
         try:
-            history_data = await asyncio.get_event_loop().run_in_executor(
-                None, 
-                get_chat_history_sync, 
-                room_id, 
-                db
-            )
-            if history_data and history_data.get("messages"):
-                await websocket.send_text(json.dumps({
-                    "type": "history",
-                    "messages": history_data["messages"]
-                }))
+            async with AsyncReadSessionLocal() as db:
+                history_data = await get_join_history(room_id, db, since_id)
+            if history_data:
+                await send_history_frames(websocket, history_data)
         except Exception as e:
             print(f"Error sending history: {e}")
-        db.close()
         
         # Send admin status
         if is_admin:
-            await websocket.send_text(json.dumps({
+            await manager.send_personal({
                 "type": "admin_status",
                 "is_admin": True
-            }))
+            }, websocket)
         
-        # Only send welcome message if not reloading history
-        await manager.broadcast_to_room({
-            "type": "system",
-            "message": f"📢 {username} joined room {room_id}",
-            "timestamp": datetime.datetime.now().isoformat()
-        }, room_id)
+        # Only send welcome message if not reloading history or reconnecting
+        if joined:
+            await manager.broadcast_to_room({
+                "type": "system",
+                "message": f"📢 {username} joined room {room_id}",
+                "timestamp": datetime.datetime.now().isoformat()
+            }, room_id)
 
     try:
         while True:
-            data = await websocket.receive_text()
+            data = await receive_frame(websocket)
+            manager.heartbeat.touch(websocket)
             
             # Parse JSON message with username
             try:
-                message_data = json.loads(data)
-                message_type = message_data.get("type", "chat")
-                message_username = message_data.get("username", username)
+                frame = decode_frame(data, username)
+                message_type = frame.type
+                message_username = frame.username
+
+                if message_type == "pong":
+                    continue  # Heartbeat reply; receiving it was the point
+                if message_type == "ping":
+                    await manager.send_personal({"type": "pong"}, websocket)
+                    continue
+
+                limit_kind = "typing" if message_type in ("typing", "stop_typing") else "chat"
+                # The user scope is the name the socket connected with: frames can claim any name
+                if await throttle(websocket, limit_kind, room_id, username):
+                    continue
                 
                 if message_type == "typing":
-                    # Broadcast typing indicator
-                    await manager.broadcast_to_room({
-                        "type": "typing",
-                        "username": message_username
-                    }, room_id)
+                    # Reaches the room in the next typing_state frame
+                    await manager.set_typing(room_id, message_username, True)
                 elif message_type == "stop_typing":
-                    # Broadcast stop typing indicator
-                    await manager.broadcast_to_room({
-                        "type": "stop_typing",
-                        "username": message_username
-                    }, room_id)
+                    await manager.set_typing(room_id, message_username, False)
                 elif message_type == "mute_user":
                     # Mute user (admin only)
-                    db = next(get_db())
-                    if is_room_admin(db, room_id, message_username):
-                        target_user = message_data.get("target_username")
-                        room = db.query(models.Room).filter(models.Room.name == room_id).first()
-                        if room and target_user:
-                            # Check if already muted
-                            muted = db.query(models.MutedUser).filter(
-                                models.MutedUser.room_id == room.id,
-                                models.MutedUser.username == target_user
-                            ).first()
-                            if not muted:
-                                muted_user = models.MutedUser(
-                                    room_id=room.id,
+                    target_user = frame.target_username
+                    room_info = await room_cache.get(room_id)
+                    if target_user and await is_room_admin(room_id, message_username):
+                        # Check if already muted
+                        if target_user not in room_info.muted:
+                            async with AsyncSessionLocal() as db:
+                                db.add(models.MutedUser(
+                                    room_id=room_info.id,
                                     username=target_user,
                                     muted_by=message_username
-                                )
-                                db.add(muted_user)
-                                db.commit()
-                                await manager.broadcast_to_room({
-                                    "type": "user_muted",
-                                    "target_username": target_user,
-                                    "muted_by": message_username
-                                }, room_id)
-                    db.close()
+                                ))
+                                await db.commit()
+                            room_cache.mark_muted(room_id, target_user)
+                            await manager.broadcast_to_room({
+                                "type": "user_muted",
+                                "target_username": target_user,
+                                "muted_by": message_username
+                            }, room_id)
                 elif message_type == "unmute_user":
                     # Unmute user (admin only)
-                    db = next(get_db())
-                    if is_room_admin(db, room_id, message_username):
-                        target_user = message_data.get("target_username")
-                        room = db.query(models.Room).filter(models.Room.name == room_id).first()
-                        if room and target_user:
-                            muted = db.query(models.MutedUser).filter(
-                                models.MutedUser.room_id == room.id,
-                                models.MutedUser.username == target_user
-                            ).first()
-                            if muted:
-                                db.delete(muted)
-                                db.commit()
-                                await manager.broadcast_to_room({
-                                    "type": "user_unmuted",
-                                    "target_username": target_user,
-                                    "unmuted_by": message_username
-                                }, room_id)
-                    db.close()
+                    target_user = frame.target_username
+                    room_info = await room_cache.get(room_id)
+                    if target_user and await is_room_admin(room_id, message_username):
+                        if target_user in room_info.muted:
+                            async with AsyncSessionLocal() as db:
+                                await db.execute(delete(models.MutedUser).where(
+                                    models.MutedUser.room_id == room_info.id,
+                                    models.MutedUser.username == target_user
+                                ))
+                                await db.commit()
+                            room_cache.mark_unmuted(room_id, target_user)
+                            await manager.broadcast_to_room({
+                                "type": "user_unmuted",
+                                "target_username": target_user,
+                                "unmuted_by": message_username
+                            }, room_id)
                 elif message_type == "delete_message":
                     # Delete message (room admin only)
-                    db = next(get_db())
-                    if is_room_admin(db, room_id, message_username):
-                        message_id = message_data.get("message_id")
-                        msg = db.query(models.Message).filter(models.Message.id == message_id).first()
+                    if await is_room_admin(room_id, message_username):
+                        message_id = frame.message_id
+                        if message_writer.is_pending(message_id):
+                            await message_writer.flush()
+                        async with AsyncSessionLocal() as db:
+                            msg = await db.get(models.Message, message_id)
+                            if msg:
+                                if not msg.is_deleted and msg.file_url:
+                                    # Release the shared file so GC can reclaim it
+                                    await adjust_blob_refs(db, [msg.file_url], -1)
+                                msg.is_deleted = 1
+                                msg.deleted_by = message_username
+                                await db.commit()
                         if msg:
-                            msg.is_deleted = 1
-                            msg.deleted_by = message_username
-                            db.commit()
                             await manager.broadcast_to_room({
                                 "type": "message_deleted",
                                 "message_id": message_id,
                                 "deleted_by": message_username
                             }, room_id)
-                    db.close()
                 else:
                     # Regular chat message - check if user is muted
-                    db = next(get_db())
-                    room = db.query(models.Room).filter(models.Room.name == room_id).first()
-                    is_muted = False
-                    if room:
-                        is_muted = is_user_muted(db, room.id, message_username)
-                    
-                    if is_muted:
+                    if await is_user_muted(room_id, message_username):
                         # User is muted, don't send message
-                        await websocket.send_text(json.dumps({
+                        await manager.send_personal({
                             "type": "error",
                             "message": "You are muted and cannot send messages"
-                        }))
-                        db.close()
-                    else:
-                        message_content = message_data.get("message", "")
-                        
-                        # Extract mentions
-                        mentions = extract_mentions(message_content)
-                        
-                        message_payload = {
+                        }, websocket)
+                        continue
+                    
+                    message_content = frame.message
+                    
+                    # Extract mentions
+                    mentions = extract_mentions(message_content)
+                    
+                    message_payload = {
+                        "type": "chat",
+                        "username": message_username,
+                        "message": message_content,
+                        "timestamp": datetime.datetime.now().isoformat(),
+                        "mentions": mentions
+                    }
+                    
+                    # Include file metadata if present
+                    if frame.has_file:
+                        message_payload["file_url"] = frame.file_url
+                        message_payload["filename"] = frame.filename
+                        message_payload["file_type"] = frame.file_type
+                        message_payload["file_size"] = frame.file_size
+                        # Thumbnail and dimensions come from the stored blob, not the client
+                        message_payload.update(await preview_for_url(frame.file_url))
+                    
+                    # Assign the id now and let the write-behind queue persist it
+                    message_id = await message_writer.allocate_id()
+                    message_payload["id"] = message_id
+                    message_payload["message_id"] = message_id
+                    await message_writer.submit({
+                        "id": message_id,
+                        "room": room_id,
+                        "username": message_username,
+                        "content": message_content,
+                        "file_url": message_payload.get("file_url"),
+                        "filename": message_payload.get("filename"),
+                        "file_type": message_payload.get("file_type"),
+                        "file_size": message_payload.get("file_size"),
+                        "thumbnail_url": message_payload.get("thumbnail_url"),
+                        "width": message_payload.get("width"),
+                        "height": message_payload.get("height"),
+                        "mentioned_users": ",".join(mentions) if mentions else None
+                    })
+                    
+                    await manager.broadcast_to_room(message_payload, room_id)
+                    await manager.set_typing(room_id, message_username, False)
+                    bot_worker.note_message(room_id)
+
+                    # @bot questions are answered by the bot worker with the room as context
+                    question = bot_question(message_content)
+                    if question == "":
+                        await manager.send_personal({
                             "type": "chat",
-                            "username": message_username,
-                            "message": message_content,
+                            "username": BOT_USERNAME,
+                            "message": USAGE_HINT,
                             "timestamp": datetime.datetime.now().isoformat(),
-                            "mentions": mentions
-                        }
-                        
-                        # Include file metadata if present
-                        if "file_url" in message_data:
-                            message_payload["file_url"] = message_data["file_url"]
-                            message_payload["filename"] = message_data.get("filename")
-                            message_payload["file_type"] = message_data.get("file_type")
-                            message_payload["file_size"] = message_data.get("file_size")
-                        
-                        # Save to database
-                        db_msg = save_message_to_db(db, {**message_payload, "username": message_username}, room_id)
-                        if db_msg:
-                            message_payload["id"] = db_msg.id
-                            message_payload["message_id"] = db_msg.id
-                        db.close()
-                        
-                        await manager.broadcast_to_room(message_payload, room_id)
+                            "is_bot": True
+                        }, websocket)
+                    elif question:
+                        request_id = frame.request_id or f"bot-{message_id}"
+                        ai_wait = rate_limiter.check("ai", client=websocket.client.host if websocket.client else "unknown", user=user_key(username))
+                        if ai_wait:
+                            await manager.send_personal({
+                                "type": "error",
+                                "code": "rate_limited",
+                                "message": "You're asking the AI assistant too often. Please wait a moment.",
+                                "retry_after": round(ai_wait, 2)
+                            }, websocket)
+                        elif bot_worker.ask(
+                            room_id, message_username, question, request_id,
+                            notify=lambda message, websocket=websocket: manager.send_personal(message, websocket)
+                        ):
+                            # Lets every client show a "thinking" placeholder until tokens arrive
+                            await manager.broadcast_to_room({
+                                "type": "ai_stream",
+                                "request_id": request_id,
+                                "username": BOT_USERNAME,
+                                "asked_by": message_username,
+                                "question": question,
+                                "delta": "",
+                                "done": False,
+                                "queued": True
+                            }, room_id)
+                        else:
+                            await manager.send_personal({
+                                "type": "error",
+                                "message": "The AI assistant is busy right now. Please try again in a moment."
+                            }, websocket)
                 
-            except json.JSONDecodeError:
+            except JSONDecodeError:
+                if await throttle(websocket, "chat", room_id, username):
+                    continue
                 # If plain text, use as anonymous message
                 await manager.broadcast_to_room({
                     "type": "chat",
                     "username": username,
-                    "message": data,
+                    "message": data if isinstance(data, str) else data.decode("utf-8", "replace"),
                     "timestamp": datetime.datetime.now().isoformat()
                 }, room_id)
+            except (SQLAlchemyError, OSError) as e:
+                # The database failed this frame (id allocation, a flush, a lookup); keep the connection
+                print(f"❌ Error handling message in room {room_id}: {e}")
+                await manager.send_personal({
+                    "type": "error",
+                    "message": "Your message could not be processed. Please try again."
+                }, websocket)
                 
     except WebSocketDisconnect:
-        manager.disconnect(websocket, room_id, username)
-        # Only send leave message if username is not Anonymous
-        if username and username != "Anonymous":
-            await manager.broadcast_to_room({
-                "type": "system",
-                "message": f"❌ {username} left room {room_id}",
-                "timestamp": datetime.datetime.now().isoformat()
-            }, room_id)
+        pass
+    finally:
+        rate_limiter.forget("connection", id(websocket))
+        await manager.disconnect(websocket, room_id, username)
 
 @router.get("/history/{room_id}")
-def get_chat_history(room_id: str, db: Session = Depends(get_db)):
-    """Get chat history for a room."""
-    try:
-        room = db.query(models.Room).filter(models.Room.name == room_id).first()
-        if not room:
-            return {"messages": []}
-        
-        messages = db.query(models.Message).filter(
-            models.Message.room_id == room.id,
-            models.Message.is_deleted == 0
-        ).order_by(models.Message.timestamp.asc()).all()
-        
-        result = []
-        for msg in messages:
-            result.append({
-                "id": msg.id,
-                "username": msg.user.username if msg.user else "Unknown",
-                "message": msg.content,
-                "timestamp": msg.timestamp.isoformat() if msg.timestamp else None,
-                "file_url": msg.file_url,
-                "filename": msg.filename,
-                "file_type": msg.file_type,
-                "file_size": msg.file_size,
-                "mentions": msg.mentioned_users.split(",") if msg.mentioned_users else []
-            })
-        
-        return {"messages": result}
-    except Exception as e:
-        print(f"Error fetching history: {e}")
-        return {"messages": []}
\ No newline at end of file
+async def get_chat_history(
+    room_id: str,
+    before_id: Optional[int] = Query(None, description="Return messages older than this id"),
+    limit: int = Query(HISTORY_PAGE_SIZE, ge=1, le=MAX_HISTORY_PAGE_SIZE),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Get one page of chat history for a room (newest page unless before_id is given)."""
+    hot = manager.history.page(room_id, before_id, limit)
+    if hot is not None:
+        frames, has_more, next_before_id = hot
+        return Response(
+            history_frame({"has_more": has_more, "next_before_id": next_before_id}, frames),
+            media_type="application/json"
+        )
+    return await get_chat_history_page(room_id, db, before_id, limit)
+
+@router.get("/metrics")
+async def get_chat_metrics():
+    """Counters for the chat server: connections, presence, heartbeats, history buffer, rate limiting, backplane and writes."""
+    return {
+        "rooms": len(manager.active_connections),
+        "connections": len(manager.writers),
+        "presence": {"pending_leaves": len(manager._pending_leaves), "quiet_rejoins": manager.quiet_rejoins},
+        "heartbeat": {**manager.heartbeat.stats(), "dropped_slow": manager.dropped},
+        "typing": manager.typing.stats(),
+        "history_buffer": manager.history.stats(),
+        "rate_limits": rate_limiter.stats(),
+        "backplane": manager.backplane.stats(),
+        "writer": {"pending": len(message_writer.pending), "dead_lettered": message_writer.dead_lettered}
+    }
+
+@router.get("/presence")
+async def get_presence(users: Optional[str] = None, room: Optional[str] = None):
+    """
+    Who is online. users=alice,bob gives the rooms each is in (with their open
+    connection count); room=math gives that room's online users across all
+    workers. Without either, just the totals.
+    """
+    result = {"online_users": len(manager.user_rooms), "rooms": len(manager.room_presence)}
+    if users:
+        result["users"] = {}
+        for username in dict.fromkeys(name.strip() for name in users.split(",") if name.strip()):
+            rooms = manager.user_rooms.get(username, ())
+            result["users"][username] = {
+                "online": bool(rooms),
+                "rooms": {name: len(manager.room_presence[name][username]) for name in rooms}
+            }
+    if room:
+        result["room"] = room
+        result["online_users_in_room"] = await manager.backplane.room_users(room, list(manager.room_presence.get(room, {})))
+    return result
@@ -0,0 +1,90 @@
+# app/codec.py
+"""
+Wire codec for the chat WebSocket.
+
+Inbound frames are decoded straight from whatever the socket received (text or
+binary) into an InboundFrame: a __slots__ class holding exactly the fields the
+chat handler reads, so the handler does attribute lookups instead of repeated
+dict.get() calls with defaults. Outbound events are encoded once with
+encode_frame() and that one string is queued for every recipient.
+
+orjson does the JSON work when it is installed; it parses and serializes chat
+frames several times faster than the json module. Without it the standard
+library is used and everything behaves the same.
+
+Run the microbenchmark with: python -m app.bench_codec
+"""
+
+import json
+import re
+from typing import List, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+MENTION_PATTERN = re.compile(r"@(\w+)")
+
+# orjson.JSONDecodeError subclasses this, so one except clause covers both
+JSONDecodeError = json.JSONDecodeError
+
+
+if orjson is not None:
+    def loads(data: Union[str, bytes]):
+        return orjson.loads(data)
+
+    def encode_frame(message: dict) -> str:
+        """Serialize an outbound event to the text sent on the socket."""
+        return orjson.dumps(message).decode()
+else:
+    def loads(data: Union[str, bytes]):
+        return json.loads(data)
+
+    def encode_frame(message: dict) -> str:
+        """Serialize an outbound event to the text sent on the socket."""
+        return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def _text(value) -> Optional[str]:
+    return value if isinstance(value, str) else None
+
+
+class InboundFrame:
+    """One decoded client frame. Fields the client didn't send are None."""
+
+    __slots__ = (
+        "type", "username", "message", "message_id", "target_username", "request_id",
+        "has_file", "file_url", "filename", "file_type", "file_size"
+    )
+
+    def __init__(self, data: dict, default_username: str):
+        get = data.get
+        self.type = _text(get("type")) or "chat"
+        self.username = _text(get("username")) or default_username
+        self.message = _text(get("message")) or ""
+        self.message_id = get("message_id")
+        self.target_username = _text(get("target_username"))
+        self.request_id = _text(get("request_id"))
+        self.has_file = "file_url" in data
+        self.file_url = _text(get("file_url"))
+        self.filename = _text(get("filename"))
+        self.file_type = _text(get("file_type"))
+        size = get("file_size")
+        self.file_size = size if isinstance(size, int) and not isinstance(size, bool) else None
+
+
+def decode_frame(data: Union[str, bytes], default_username: str) -> InboundFrame:
+    """
+    Decode a client frame. Raises JSONDecodeError if it isn't a JSON object
+    (the chat handler treats such frames as plain text).
+    """
+    value = loads(data)
+    if not isinstance(value, dict):
+        raise JSONDecodeError("Expected a JSON object", data if isinstance(data, str) else "", 0)
+    return InboundFrame(value, default_username)
+
+
+def extract_mentions(message: str) -> List[str]:
+    """Unique @mentions in message text, in order of first appearance."""
+    return list(dict.fromkeys(MENTION_PATTERN.findall(message)))
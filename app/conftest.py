@@ -0,0 +1,3 @@
+# app/conftest.py
+# Point the app at scratch storage before any test module imports it (see app/testing.py)
+import app.testing  # noqa: F401
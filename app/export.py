@@ -0,0 +1,163 @@
+# app/export.py
+"""
+Room transcript export.
+
+GET /chat/export/{room}?format=ndjson|csv|md streams a room's whole visible
+history, archived messages first, as a download. Nothing is materialized: the
+history is walked by message id, a page of DB_STREAM_BATCH_SIZE table rows or
+one archive segment at a time, and each batch is formatted into one chunk and
+sent before the next is read, so a worker's memory use doesn't depend on the
+size of the room. Each page gets its own short read session, released before
+the chunk is sent, so a slow download doesn't hold a pooled connection (or a
+snapshot) for its whole length. With gzip=true the chunks go through a
+streaming compressor and the download is a .gz file.
+
+NDJSON lines are the same message objects /chat/history returns; archived
+ones are copied through from their segment without being decoded.
+"""
+
+import asyncio
+import csv
+import io
+import re
+import zlib
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+from app.database import STREAM_BATCH_SIZE, AsyncReadSessionLocal
+from app import models
+from app.archive import read_segment
+from app.chat import serialize_message
+from app.codec import encode_frame, loads
+from app.persistence import message_writer
+from app.rate_limit import rate_limit
+
+router = APIRouter(prefix="/chat", tags=["Export"])
+
+CSV_COLUMNS = ["id", "timestamp", "username", "message", "file_url", "filename", "file_type", "file_size"]
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv; charset=utf-8", "md": "text/markdown; charset=utf-8"}
+
+
+def format_csv(messages: Iterable[dict]) -> str:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for message in messages:
+        writer.writerow([message.get(column) for column in CSV_COLUMNS])
+    return buffer.getvalue()
+
+
+def format_markdown(messages: Iterable[dict]) -> str:
+    lines = []
+    for message in messages:
+        text = (message.get("message") or "").replace("\n", "  \n")
+        if message.get("file_url"):
+            text = f"{text} [{message.get('filename') or 'attachment'}]({message['file_url']})".strip()
+        lines.append(f"**{message['username']}** ({message['timestamp']}): {text}\n\n")
+    return "".join(lines)
+
+
+# Each formats a batch of messages into one chunk
+FORMATTERS: Dict[str, Callable[[List[dict]], str]] = {
+    "ndjson": lambda messages: "".join(encode_frame(message) + "\n" for message in messages),
+    "csv": format_csv,
+    "md": format_markdown,
+}
+
+
+async def _next_page(room_pk: int, after_id: int) -> Tuple[Optional[tuple], List[dict]]:
+    """
+    What comes after after_id: ((path, first_id, last_id), []) if an archive
+    segment does, else (None, the next page of table rows); (None, []) at the end.
+    """
+    async with AsyncReadSessionLocal() as db:
+        segment = (await db.execute(
+            select(models.ArchiveSegment.path, models.ArchiveSegment.first_id, models.ArchiveSegment.last_id).where(
+                models.ArchiveSegment.room_id == room_pk,
+                models.ArchiveSegment.last_id > after_id
+            ).order_by(models.ArchiveSegment.first_id).limit(1)
+        )).first()
+        rows = (await db.execute(
+            select(models.Message, models.User.username).outerjoin(
+                models.User, models.Message.user_id == models.User.id
+            ).where(
+                models.Message.room_id == room_pk,
+                models.Message.is_deleted == 0,
+                models.Message.id > after_id
+            ).order_by(models.Message.id).limit(STREAM_BATCH_SIZE)
+        )).all()
+        if segment and (not rows or segment.first_id < rows[0][0].id):
+            return tuple(segment), []
+        return None, [serialize_message(msg, username) for msg, username in rows]
+
+
+async def transcript_chunks(room_pk: int, room_name: str, fmt: str) -> AsyncIterator[str]:
+    """The room's messages, oldest first, as chunks of at most STREAM_BATCH_SIZE messages."""
+    formatter = FORMATTERS[fmt]
+    if fmt == "csv":
+        yield ",".join(CSV_COLUMNS) + "\r\n"
+    elif fmt == "md":
+        yield f"# {room_name}\n\n"
+
+    # Keyset walk over archive and table together: messages archived while the
+    # export runs are found in their new segment instead of being skipped
+    after_id = 0
+    while True:
+        segment, messages = await _next_page(room_pk, after_id)
+        if segment:
+            path, _, last_id = segment
+            # One segment (at most RETENTION_BATCH_SIZE messages) in memory at a time
+            ids, lines = await asyncio.to_thread(read_segment, path)
+            lines = [line for message_id, line in zip(ids, lines) if message_id > after_id]
+            after_id = last_id
+            for start in range(0, len(lines), STREAM_BATCH_SIZE):
+                batch = lines[start:start + STREAM_BATCH_SIZE]
+                if fmt == "ndjson":
+                    yield "".join(line + "\n" for line in batch)
+                else:
+                    yield formatter([loads(line) for line in batch])
+        elif messages:
+            after_id = messages[-1]["id"]
+            yield formatter(messages)
+        else:
+            return
+
+
+async def gzip_chunks(chunks: AsyncIterator[str]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@router.get("/export/{room_id}", dependencies=[Depends(rate_limit("export"))])
+async def export_room(
+    room_id: str,
+    fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv|md)$"),
+    gzip: bool = Query(False, description="Compress the download (.gz)")
+):
+    """Stream a room's full transcript as NDJSON, CSV or Markdown."""
+    async with AsyncReadSessionLocal() as db:
+        room_pk = await db.scalar(select(models.Room.id).where(models.Room.name == room_id))
+    if room_pk is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    # The transcript should include messages still in the write-behind queue
+    await message_writer.flush()
+
+    filename = f"{re.sub(r'[^A-Za-z0-9_.-]', '_', room_id)}-transcript.{fmt}"
+    chunks = transcript_chunks(room_pk, room_id, fmt)
+    if gzip:
+        return StreamingResponse(
+            gzip_chunks(chunks),
+            media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'}
+        )
+    return StreamingResponse(
+        (chunk.encode() async for chunk in chunks),
+        media_type=MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
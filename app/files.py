@@ -0,0 +1,607 @@
+# app/files.py
+"""
+File uploads.
+
+Uploads are streamed to disk in chunks, with the writes offloaded to a thread
+so the event loop never blocks on file I/O, and hashed (SHA-256) on the fly.
+Besides the one-shot multipart POST /upload there is a resumable protocol for
+big files (lecture recordings) that must survive dropped connections:
+
+1. POST /upload/sessions              -> upload_id
+2. PUT  /upload/sessions/{id}?offset= -> append raw bytes at offset
+   GET  /upload/sessions/{id}         -> how many bytes the server has (resume point)
+3. POST /upload/sessions/{id}/finalize -> file_url
+
+Session state lives next to the partial file on disk, so an upload can also be
+resumed after a server restart.
+
+Finished uploads are stored by content: the file name is the SHA-256 of the
+bytes (plus the original extension), so re-sharing the same slides stores one
+copy. Clients that already know the hash can skip the upload entirely with
+GET /upload/blobs/{sha256} or by passing sha256 when starting a session. Each
+blob counts the chat messages whose file_url points at it; a periodic GC pass
+deletes blobs nobody references once UPLOAD_GC_GRACE_SECONDS have passed since
+they were last uploaded.
+
+Images and PDFs get a thumbnail (see app/thumbnails.py) stored next to the
+blob; its URL and the original's dimensions are returned with the upload and
+attached to chat messages that share the file.
+
+GET /uploads/{name} serves stored files with Range support (video seeking) and
+conditional requests. Content-addressed names never change content, so they get
+the hash as a strong ETag and an immutable Cache-Control; a CDN or reverse proxy
+configured as UPLOAD_PUBLIC_BASE_URL can then serve them without asking us.
+"""
+
+import asyncio
+import datetime
+import hashlib
+import json
+import os
+import re
+import stat
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+from typing import AsyncIterator, Dict, Iterable, Optional
+
+from fastapi import APIRouter, File, Form, HTTPException, Query, Request, Response, UploadFile
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal
+from app.rate_limit import check_request
+from app.thumbnails import THUMBNAIL_NAME_PATTERN, generate_preview, thumbnail_glob, thumbnail_name
+from app import models
+
+router = APIRouter(tags=["Files"])
+
+# Use absolute path to avoid issues with working directory
+BASE_DIR = Path(__file__).parent
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", BASE_DIR / "uploads"))
+# Outside UPLOAD_DIR so partial files are never served
+PARTIAL_DIR = Path(os.getenv("UPLOAD_PARTIAL_DIR", BASE_DIR / "uploads_partial"))
+UPLOAD_DIR.mkdir(exist_ok=True, parents=True)
+PARTIAL_DIR.mkdir(exist_ok=True, parents=True)
+
+MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", str(500 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+UPLOAD_GC_INTERVAL_SECONDS = int(os.getenv("UPLOAD_GC_INTERVAL_SECONDS", "3600"))
+# Unreferenced blobs younger than this are kept: the message sharing them may not be sent yet
+UPLOAD_GC_GRACE_SECONDS = int(os.getenv("UPLOAD_GC_GRACE_SECONDS", "3600"))
+# Where clients fetch uploads from: this server by default, or a CDN/proxy in front of it
+UPLOAD_PUBLIC_BASE_URL = os.getenv("UPLOAD_PUBLIC_BASE_URL", "http://localhost:8000/uploads").rstrip("/")
+# Cache lifetime for files stored before content addressing (their names are not hashes)
+UPLOAD_CACHE_MAX_AGE = int(os.getenv("UPLOAD_CACHE_MAX_AGE", "3600"))
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# How long an upload response waits for its thumbnail; generation carries on in the background after that
+THUMBNAIL_WAIT_SECONDS = float(os.getenv("THUMBNAIL_WAIT_SECONDS", "5"))
+
+SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+EXTENSION_PATTERN = re.compile(r"^\.[A-Za-z0-9]{1,10}$")
+BLOB_NAME_PATTERN = re.compile(r"^([0-9a-f]{64})(\.[A-Za-z0-9]{1,10})?$")
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def write_stream(chunks: AsyncIterator[bytes], path: Path, mode: str, limit: int, hasher=None) -> int:
+    """
+    Write an async stream of chunks to path, off the event loop.
+
+    Raises UploadTooLarge as soon as more than `limit` bytes arrive, after
+    writing the bytes that still fit. Returns the number of bytes written.
+    """
+    written = 0
+    handle = await asyncio.to_thread(open, path, mode)
+    try:
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            if written + len(chunk) > limit:
+                await asyncio.to_thread(handle.write, chunk[:limit - written])
+                raise UploadTooLarge()
+            written += len(chunk)
+            if hasher is not None:
+                hasher.update(chunk)
+            await asyncio.to_thread(handle.write, chunk)
+    finally:
+        await asyncio.to_thread(handle.close)
+    return written
+
+
+async def read_upload_file(file: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return
+        yield chunk
+
+
+def hash_file(path: Path) -> str:
+    """SHA-256 of a file on disk (blocking; run it in a thread)."""
+    hasher = hashlib.sha256()
+    with open(path, "rb") as handle:
+        for chunk in iter(lambda: handle.read(UPLOAD_CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def blob_name(sha256: str, filename: Optional[str]) -> str:
+    """Content-addressed file name: the hash plus the original extension (if sane)."""
+    file_extension = os.path.splitext(filename or "")[1].lower()
+    if not EXTENSION_PATTERN.match(file_extension):
+        file_extension = ""
+    return f"{sha256}{file_extension}"
+
+
+def file_url_for(name: str) -> str:
+    return f"{UPLOAD_PUBLIC_BASE_URL}/{name}"
+
+
+def blob_name_from_url(file_url: Optional[str]) -> Optional[str]:
+    """Stored file name behind a file_url, if it names a content-addressed blob."""
+    if not file_url:
+        return None
+    name = file_url.split("?", 1)[0].rsplit("/", 1)[-1]
+    return name if BLOB_NAME_PATTERN.match(name) else None
+
+
+# Content-addressed blob store
+
+async def store_blob(temp_path: Path, sha256: str, filename: Optional[str]) -> str:
+    """
+    Move a finished upload into the store and return its stored name.
+
+    If the same content is already stored, the temp file is discarded and the
+    existing name is returned.
+    """
+    now = datetime.datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        blob = await db.get(models.FileBlob, sha256)
+        if blob and await asyncio.to_thread((UPLOAD_DIR / blob.stored_name).exists):
+            blob.last_uploaded_at = now  # Restart the GC grace period
+            await db.commit()
+            await asyncio.to_thread(temp_path.unlink, True)
+            return blob.stored_name
+
+        name = blob_name(sha256, filename)
+        size = (await asyncio.to_thread(temp_path.stat)).st_size
+        await asyncio.to_thread(os.replace, temp_path, UPLOAD_DIR / name)
+        if blob:
+            # Row survived but the file was lost; the upload restores it
+            blob.stored_name = name
+            blob.last_uploaded_at = now
+        else:
+            db.add(models.FileBlob(sha256=sha256, stored_name=name, size=size, ref_count=0, last_uploaded_at=now))
+        try:
+            await db.commit()
+            return name
+        except IntegrityError:
+            # The same content was stored concurrently; use that copy
+            await db.rollback()
+
+    async with AsyncSessionLocal() as db:
+        existing = await db.scalar(select(models.FileBlob.stored_name).where(models.FileBlob.sha256 == sha256))
+    if existing != name:
+        await asyncio.to_thread((UPLOAD_DIR / name).unlink, True)
+    return existing
+
+
+async def find_blob(sha256: str) -> Optional[models.FileBlob]:
+    """The stored blob with this hash, renewing its GC grace period, or None."""
+    async with AsyncSessionLocal() as db:
+        blob = await db.get(models.FileBlob, sha256)
+        if not blob or not await asyncio.to_thread((UPLOAD_DIR / blob.stored_name).exists):
+            return None
+        blob.last_uploaded_at = datetime.datetime.utcnow()
+        await db.commit()
+        return blob
+
+
+def preview_fields(blob: Optional[models.FileBlob]) -> dict:
+    """thumbnail_url and original dimensions of a blob, for upload responses and chat messages."""
+    if blob is None or not blob.thumbnail_name:
+        return {}
+    return {"thumbnail_url": file_url_for(blob.thumbnail_name), "width": blob.width, "height": blob.height}
+
+
+async def _make_preview(sha256: str, stored_name: str) -> dict:
+    preview = await generate_preview(UPLOAD_DIR / stored_name)
+    if not preview:
+        return {}
+    async with AsyncSessionLocal() as db:
+        blob = await db.get(models.FileBlob, sha256)
+        if blob is None or blob.stored_name != stored_name:
+            # Collected while we were rendering
+            await asyncio.to_thread((UPLOAD_DIR / preview["thumbnail_name"]).unlink, True)
+            return {}
+        blob.thumbnail_name = preview["thumbnail_name"]
+        blob.width = preview["width"]
+        blob.height = preview["height"]
+        await db.commit()
+        return preview_fields(blob)
+
+
+_preview_tasks: Dict[str, asyncio.Task] = {}
+
+
+async def ensure_preview(sha256: str) -> dict:
+    """
+    Make sure the blob has a thumbnail and return its preview_fields.
+
+    Waits up to THUMBNAIL_WAIT_SECONDS; after that the thumbnail is still
+    generated, just not reported to this caller.
+    """
+    async with AsyncSessionLocal() as db:
+        blob = await db.get(models.FileBlob, sha256)
+    if blob is None:
+        return {}
+    current = blob.thumbnail_name == thumbnail_name(blob.stored_name)  # Else rendered at another THUMBNAIL_MAX_SIZE
+    if current and await asyncio.to_thread((UPLOAD_DIR / blob.thumbnail_name).exists):
+        return preview_fields(blob)
+
+    task = _preview_tasks.get(sha256)
+    if task is None:
+        # One render per blob, however many people upload it at once
+        task = asyncio.create_task(_make_preview(sha256, blob.stored_name))
+        _preview_tasks[sha256] = task
+        task.add_done_callback(lambda _: _preview_tasks.pop(sha256, None))
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), THUMBNAIL_WAIT_SECONDS)
+    except asyncio.TimeoutError:
+        return {}
+
+
+async def preview_for_url(file_url: Optional[str]) -> dict:
+    """preview_fields for the blob a chat message's file_url points at."""
+    name = blob_name_from_url(file_url)
+    if not name:
+        return {}
+    async with AsyncSessionLocal() as db:
+        blob = await db.scalar(select(models.FileBlob).where(models.FileBlob.stored_name == name))
+    return preview_fields(blob)
+
+
+async def adjust_blob_refs(db: AsyncSession, file_urls: Iterable[Optional[str]], delta: int):
+    """
+    Add delta references to the blobs behind these file URLs, inside the caller's
+    transaction. URLs that are not content-addressed blobs are ignored.
+    """
+    counts = Counter(name for name in map(blob_name_from_url, file_urls) if name)
+    for name, count in counts.items():
+        await db.execute(
+            update(models.FileBlob)
+            .where(models.FileBlob.stored_name == name)
+            .values(ref_count=models.FileBlob.ref_count + delta * count)
+        )
+
+
+def remove_stored_files(stored_name: str):
+    """Delete an upload and its thumbnails (older messages may point at one of another size)."""
+    (UPLOAD_DIR / stored_name).unlink(missing_ok=True)
+    for thumbnail in UPLOAD_DIR.glob(thumbnail_glob(stored_name)):
+        thumbnail.unlink(missing_ok=True)
+
+
+async def collect_garbage() -> int:
+    """Delete blobs no message references anymore. Returns how many were removed."""
+    cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=UPLOAD_GC_GRACE_SECONDS)
+    async with AsyncSessionLocal() as db:
+        candidates = (await db.execute(
+            select(models.FileBlob.sha256, models.FileBlob.stored_name).where(
+                models.FileBlob.ref_count <= 0,
+                models.FileBlob.last_uploaded_at < cutoff
+            )
+        )).all()
+
+    removed = 0
+    for sha256, name in candidates:
+        async with AsyncSessionLocal() as db:
+            # Re-check in the DELETE itself: a message or upload may have claimed it meanwhile
+            result = await db.execute(
+                delete(models.FileBlob).where(
+                    models.FileBlob.sha256 == sha256,
+                    models.FileBlob.ref_count <= 0,
+                    models.FileBlob.last_uploaded_at < cutoff
+                )
+            )
+            await db.commit()
+        if result.rowcount:
+            await asyncio.to_thread(remove_stored_files, name)
+            removed += 1
+    if removed:
+        print(f"🧹 Removed {removed} unreferenced upload(s)")
+    return removed
+
+
+async def blob_gc_loop():
+    """Background task: run collect_garbage every UPLOAD_GC_INTERVAL_SECONDS."""
+    while True:
+        await asyncio.sleep(UPLOAD_GC_INTERVAL_SECONDS)
+        try:
+            await collect_garbage()
+        except Exception as e:
+            print(f"Error collecting unreferenced uploads: {e}")
+
+
+@router.post("/upload")
+async def upload_file(
+    request: Request,
+    file: UploadFile = File(...),
+    room: str = Form(...),
+    username: str = Form(...)
+):
+    """
+    Upload a file and save it to the uploads directory.
+    Returns the file URL that can be used to access the file.
+    """
+    check_request("upload", request, username)
+    if file.size is not None and file.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File is larger than {MAX_UPLOAD_SIZE} bytes")
+
+    temp_path = PARTIAL_DIR / f"{uuid.uuid4().hex}.upload"
+    hasher = hashlib.sha256()
+    try:
+        size = await write_stream(read_upload_file(file), temp_path, "wb", MAX_UPLOAD_SIZE, hasher)
+        stored_name = await store_blob(temp_path, hasher.hexdigest(), file.filename)
+        preview = await ensure_preview(hasher.hexdigest())
+    except UploadTooLarge:
+        await asyncio.to_thread(temp_path.unlink, True)
+        raise HTTPException(status_code=413, detail=f"File is larger than {MAX_UPLOAD_SIZE} bytes")
+    except Exception as e:
+        await asyncio.to_thread(temp_path.unlink, True)
+        return {"error": str(e), "message": "File upload failed"}
+
+    return {
+        "file_url": file_url_for(stored_name),
+        "filename": file.filename,
+        "size": size,
+        "sha256": hasher.hexdigest(),
+        **preview,
+        "message": "File uploaded successfully"
+    }
+
+
+# Serving
+
+class UploadResponse(FileResponse):
+    """FileResponse whose 416 names the range unit: "bytes */size", where Starlette sends "*/size"."""
+
+    async def __call__(self, scope, receive, send):
+        async def send_with_range_unit(message):
+            if message["type"] == "http.response.start" and message["status"] == 416:
+                message["headers"] = [
+                    (name, b"bytes " + value if name == b"content-range" and value.startswith(b"*/") else value)
+                    for name, value in message["headers"]
+                ]
+            await send(message)
+        await super().__call__(scope, receive, send_with_range_unit)
+
+
+@router.api_route("/uploads/{name}", methods=["GET", "HEAD"])
+async def serve_upload(name: str, request: Request):
+    """
+    Serve a stored file. Range and If-Range are handled by FileResponse; we add
+    the caching headers and answer If-None-Match ourselves.
+    """
+    if name.startswith(".") or "/" in name or "\\" in name:
+        raise HTTPException(status_code=404, detail="Not found")
+    path = UPLOAD_DIR / name
+    try:
+        stat_result = await asyncio.to_thread(path.stat)
+    except (FileNotFoundError, NotADirectoryError):
+        raise HTTPException(status_code=404, detail="Not found")
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    blob = BLOB_NAME_PATTERN.match(name)
+    thumbnail = THUMBNAIL_NAME_PATTERN.match(name)
+    if blob:
+        # The name is the content hash: the ETag is strong and the response never goes stale
+        etag = f'"{blob.group(1)}"'
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    elif thumbnail:
+        # Derived from the blob at the size in its name, so just as immutable
+        etag = f'"{thumbnail.group(1)}-thumb{thumbnail.group(2) or ""}"'
+        cache_control = IMMUTABLE_CACHE_CONTROL
+    else:
+        etag = f'"{int(stat_result.st_mtime)}-{stat_result.st_size}"'
+        cache_control = f"public, max-age={UPLOAD_CACHE_MAX_AGE}"
+    headers = {"ETag": etag, "Cache-Control": cache_control, "X-Content-Type-Options": "nosniff"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and (if_none_match.strip() == "*" or etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]):
+        return Response(status_code=304, headers=headers)
+
+    return UploadResponse(path, headers=headers, stat_result=stat_result)
+
+
+# Resumable uploads
+
+class UploadSessionRequest(BaseModel):
+    filename: str
+    size: int
+    room: str
+    username: str
+    sha256: Optional[str] = None  # If already stored, no upload is needed
+
+
+@router.get("/upload/blobs/{sha256}")
+async def get_blob(sha256: str):
+    """Look up already-stored content by hash, so a client can skip uploading it again."""
+    blob = await find_blob(sha256.lower()) if SHA256_PATTERN.match(sha256.lower()) else None
+    if not blob:
+        raise HTTPException(status_code=404, detail="Not stored")
+    return {"file_url": file_url_for(blob.stored_name), "sha256": blob.sha256, "size": blob.size, **preview_fields(blob)}
+
+
+# In-memory SHA-256 state per session. Only valid while it has seen every byte
+# of the partial file; otherwise finalize re-hashes the file from disk.
+_session_hashers: Dict[str, dict] = {}
+_session_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _state_path(upload_id: str) -> Path:
+    return PARTIAL_DIR / f"{upload_id}.json"
+
+
+def _part_path(upload_id: str) -> Path:
+    return PARTIAL_DIR / f"{upload_id}.part"
+
+
+def _load_session(upload_id: str) -> dict:
+    # Ids are uuid4 hex; anything else must not reach the filesystem
+    if len(upload_id) != 32 or not all(c in "0123456789abcdef" for c in upload_id):
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    try:
+        state = json.loads(_state_path(upload_id).read_text())
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Upload session not found")
+    part = _part_path(upload_id)
+    state["received"] = part.stat().st_size if part.exists() else 0
+    return state
+
+
+async def _session_lock(upload_id: str) -> asyncio.Lock:
+    """The session's lock. Unknown ids get a 404 instead of a lock that would never be freed."""
+    lock = _session_locks.get(upload_id)
+    if lock is None:
+        await asyncio.to_thread(_load_session, upload_id)
+        lock = _session_locks.setdefault(upload_id, asyncio.Lock())
+    return lock
+
+
+async def _load_locked_session(upload_id: str) -> dict:
+    """_load_session for a lock holder; drops the session's memory if it is gone (expired or finalized)."""
+    try:
+        return await asyncio.to_thread(_load_session, upload_id)
+    except HTTPException:
+        _forget_session(upload_id)
+        raise
+
+
+def _forget_session(upload_id: str):
+    _session_hashers.pop(upload_id, None)
+    _session_locks.pop(upload_id, None)
+
+
+def _purge_stale_sessions():
+    """Remove partial uploads nobody has touched for UPLOAD_SESSION_TTL_SECONDS."""
+    cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+    for state_file in PARTIAL_DIR.glob("*.json"):
+        upload_id = state_file.stem
+        part = _part_path(upload_id)
+        last_touched = max(state_file.stat().st_mtime, part.stat().st_mtime if part.exists() else 0)
+        if last_touched < cutoff:
+            state_file.unlink(missing_ok=True)
+            part.unlink(missing_ok=True)
+            _forget_session(upload_id)
+
+
+@router.post("/upload/sessions")
+async def create_upload_session(request: UploadSessionRequest, http_request: Request):
+    """Start a resumable upload. Send the bytes with PUT /upload/sessions/{upload_id}."""
+    check_request("upload", http_request, request.username)
+    if request.size < 0 or request.size > MAX_UPLOAD_SIZE:
+        raise HTTPException(status_code=413, detail=f"File is larger than {MAX_UPLOAD_SIZE} bytes")
+
+    if request.sha256 and SHA256_PATTERN.match(request.sha256.lower()):
+        blob = await find_blob(request.sha256.lower())
+        if blob and blob.size == request.size:
+            # Already stored: hand back the existing file instantly
+            return {
+                "upload_id": None,
+                "file_url": file_url_for(blob.stored_name),
+                "filename": request.filename,
+                "size": blob.size,
+                "sha256": blob.sha256,
+                **preview_fields(blob),
+                "deduplicated": True
+            }
+
+    await asyncio.to_thread(_purge_stale_sessions)
+    upload_id = uuid.uuid4().hex
+    state = request.model_dump()
+    await asyncio.to_thread(_state_path(upload_id).write_text, json.dumps(state))
+    await asyncio.to_thread(_part_path(upload_id).touch)
+    _session_hashers[upload_id] = {"hasher": hashlib.sha256(), "hashed": 0}
+
+    return {"upload_id": upload_id, "received": 0, "size": request.size, "chunk_size": UPLOAD_CHUNK_SIZE}
+
+
+@router.get("/upload/sessions/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """How many bytes the server has; resume the upload from there."""
+    state = await asyncio.to_thread(_load_session, upload_id)
+    return {"upload_id": upload_id, "received": state["received"], "size": state["size"]}
+
+
+@router.put("/upload/sessions/{upload_id}")
+async def put_upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    """Append the raw request body to the upload, starting at `offset`."""
+    async with await _session_lock(upload_id):
+        state = await _load_locked_session(upload_id)
+        if offset != state["received"]:
+            # Client and server disagree on the resume point; tell the client where to continue
+            raise HTTPException(status_code=409, detail={"message": "Offset mismatch", "received": state["received"]})
+
+        tracker = _session_hashers.get(upload_id)
+        hasher = tracker["hasher"] if tracker and tracker["hashed"] == offset else None
+        remaining = state["size"] - offset
+        try:
+            written = await write_stream(request.stream(), _part_path(upload_id), "ab", remaining, hasher)
+        except UploadTooLarge:
+            # Bytes up to the declared size were kept; GET the session to see how many
+            _session_hashers.pop(upload_id, None)
+            raise HTTPException(status_code=413, detail="Chunk goes past the declared file size")
+        except Exception:
+            # Connection dropped mid-chunk: whatever reached the disk counts, the hash must be redone
+            _session_hashers.pop(upload_id, None)
+            raise
+
+        if hasher is not None:
+            tracker["hashed"] += written
+        else:
+            _session_hashers.pop(upload_id, None)
+        received = offset + written
+
+    return {"upload_id": upload_id, "received": received, "size": state["size"]}
+
+
+@router.post("/upload/sessions/{upload_id}/finalize")
+async def finalize_upload_session(upload_id: str):
+    """Check the upload is complete and move it into the uploads directory."""
+    async with await _session_lock(upload_id):
+        state = await _load_locked_session(upload_id)
+        if state["received"] != state["size"]:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Upload incomplete", "received": state["received"], "size": state["size"]}
+            )
+
+        tracker = _session_hashers.pop(upload_id, None)
+        if tracker and tracker["hashed"] == state["size"]:
+            sha256 = tracker["hasher"].hexdigest()
+        else:
+            sha256 = await asyncio.to_thread(hash_file, _part_path(upload_id))
+
+        stored_name = await store_blob(_part_path(upload_id), sha256, state["filename"])
+        await asyncio.to_thread(_state_path(upload_id).unlink, True)
+    _session_locks.pop(upload_id, None)
+    preview = await ensure_preview(sha256)
+
+    return {
+        "file_url": file_url_for(stored_name),
+        "filename": state["filename"],
+        "size": state["size"],
+        "sha256": sha256,
+        **preview,
+        "message": "File uploaded successfully"
+    }
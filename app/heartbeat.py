@@ -0,0 +1,154 @@
+# app/heartbeat.py
+"""
+Heartbeats and idle eviction for WebSocket connections.
+
+A connection whose peer vanished without a FIN (laptop lid closed, Wi-Fi
+dropped, NAT entry expired) never shows up as a failed receive; it just goes
+quiet while broadcasts keep being queued for it. So every frame a client sends
+marks it alive, a connection quiet for HEARTBEAT_INTERVAL_SECONDS is sent a
+{"type": "ping"} (clients answer with {"type": "pong"}), and one quiet for
+HEARTBEAT_TIMEOUT_SECONDS is reaped.
+
+Deadlines live in a timer wheel: one slot per tick, a connection sits in the
+slot of its next deadline. Marking a connection alive is just a timestamp
+update; when its slot comes round it is re-filed by its latest activity, so
+each tick only touches the connections actually due and the cost doesn't grow
+with the number of idle-but-healthy sockets in other slots.
+"""
+
+import asyncio
+import math
+import os
+import time
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Set
+
+HEARTBEAT_INTERVAL_SECONDS = float(os.getenv("HEARTBEAT_INTERVAL_SECONDS", "25"))
+HEARTBEAT_TIMEOUT_SECONDS = float(os.getenv("HEARTBEAT_TIMEOUT_SECONDS", "60"))
+HEARTBEAT_TICK_SECONDS = float(os.getenv("HEARTBEAT_TICK_SECONDS", "1"))
+
+
+class TimerWheel:
+    """Hashed timer wheel with tick resolution; delays longer than a revolution are capped."""
+
+    def __init__(self, tick: float, slots: int):
+        self.tick = tick
+        self.slots: List[Set[Hashable]] = [set() for _ in range(slots)]
+        self.cursor = 0
+        self._slot_of: Dict[Hashable, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._slot_of)
+
+    def schedule(self, item: Hashable, delay: float):
+        self.cancel(item)
+        ticks = min(max(1, math.ceil(delay / self.tick)), len(self.slots) - 1)
+        slot = (self.cursor + ticks) % len(self.slots)
+        self.slots[slot].add(item)
+        self._slot_of[item] = slot
+
+    def cancel(self, item: Hashable):
+        slot = self._slot_of.pop(item, None)
+        if slot is not None:
+            self.slots[slot].discard(item)
+
+    def advance(self) -> List[Hashable]:
+        """Move to the next tick and return the items that are due."""
+        self.cursor = (self.cursor + 1) % len(self.slots)
+        due = self.slots[self.cursor]
+        self.slots[self.cursor] = set()
+        for item in due:
+            del self._slot_of[item]
+        return list(due)
+
+
+class Heartbeat:
+    __slots__ = ("last_seen", "pinged")
+
+    def __init__(self, now: float):
+        self.last_seen = now
+        self.pinged = False
+
+
+class HeartbeatMonitor:
+    def __init__(
+        self,
+        interval: float = HEARTBEAT_INTERVAL_SECONDS,
+        timeout: float = HEARTBEAT_TIMEOUT_SECONDS,
+        tick: float = HEARTBEAT_TICK_SECONDS
+    ):
+        self.interval = interval
+        self.timeout = timeout
+        self.tick = tick
+        self.wheel = TimerWheel(tick, math.ceil(max(interval, timeout) / tick) + 2)
+        self._connections: Dict[Hashable, Heartbeat] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.ping: Optional[Callable[[Hashable], Awaitable[None]]] = None
+        self.reap: Optional[Callable[[Hashable], Awaitable[None]]] = None
+        self.pings_sent = 0
+        self.reaped = 0
+
+    async def start(self, ping: Callable[[Hashable], Awaitable[None]], reap: Callable[[Hashable], Awaitable[None]]):
+        self.ping = ping
+        self.reap = reap
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def track(self, connection: Hashable):
+        self._connections[connection] = Heartbeat(time.monotonic())
+        self.wheel.schedule(connection, self.interval)
+
+    def untrack(self, connection: Hashable):
+        self._connections.pop(connection, None)
+        self.wheel.cancel(connection)
+
+    def touch(self, connection: Hashable):
+        """The client sent something: it's alive. O(1), the wheel isn't touched."""
+        heartbeat = self._connections.get(connection)
+        if heartbeat:
+            heartbeat.last_seen = time.monotonic()
+            heartbeat.pinged = False
+
+    async def check_due(self):
+        """Ping or reap the connections whose slot came up; re-file the ones that were active."""
+        now = time.monotonic()
+        for connection in self.wheel.advance():
+            heartbeat = self._connections.get(connection)
+            if heartbeat is None:
+                continue
+            idle = now - heartbeat.last_seen
+            try:
+                if idle >= self.timeout:
+                    self.untrack(connection)
+                    self.reaped += 1
+                    await self.reap(connection)
+                elif idle >= self.interval and not heartbeat.pinged:
+                    heartbeat.pinged = True
+                    self.pings_sent += 1
+                    self.wheel.schedule(connection, self.timeout - idle)
+                    await self.ping(connection)
+                elif heartbeat.pinged:
+                    self.wheel.schedule(connection, self.timeout - idle)
+                else:
+                    self.wheel.schedule(connection, self.interval - idle)
+            except Exception as e:
+                print(f"Error checking connection heartbeat: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            await self.check_due()
+
+    def stats(self) -> dict:
+        return {
+            "tracked": len(self._connections),
+            "pings_sent": self.pings_sent,
+            "reaped_idle": self.reaped
+        }
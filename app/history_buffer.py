@@ -0,0 +1,190 @@
+# app/history_buffer.py
+"""
+In-memory ring buffer of each room's recent messages.
+
+Every join replays the room's newest messages, and in an active room those were
+just broadcast by this very process. So each room keeps its newest
+HISTORY_BUFFER_ROOM_SIZE messages here, already encoded as JSON, and joins and
+/chat/history pages inside that window are answered by joining strings instead
+of querying and serializing rows. Older pages still come from the database.
+
+A room's buffer becomes usable once it has been seeded from one database read
+(the first join's history query); from then on new messages and deletions keep
+it current. It covers every visible message from its oldest entry onward;
+has_older says whether the room has messages before that.
+
+All rooms share HISTORY_BUFFER_MEMORY_MB; when it runs out the least recently
+used rooms are dropped and get seeded again on their next join.
+"""
+
+import os
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from typing import Iterable, List, Optional, Set, Tuple
+
+HISTORY_BUFFER_ROOM_SIZE = int(os.getenv("HISTORY_BUFFER_ROOM_SIZE", "200"))
+HISTORY_BUFFER_MEMORY_MB = float(os.getenv("HISTORY_BUFFER_MEMORY_MB", "64"))
+ENTRY_OVERHEAD_BYTES = 100  # Rough per-message cost of the id, list slots and str header
+
+# (encoded messages oldest first, more older messages exist, cursor for the next older page)
+HistorySlice = Tuple[List[str], bool, Optional[int]]
+
+
+class RoomHistory:
+    __slots__ = ("ids", "frames", "size", "seeded", "has_older", "deleted")
+
+    def __init__(self):
+        self.ids: List[int] = []
+        self.frames: List[str] = []
+        self.size = 0
+        self.seeded = False
+        self.has_older = False
+        self.deleted: Set[int] = set()  # Deleted before seeding; the seed read may still include them
+
+
+class HistoryBuffer:
+    def __init__(self, room_size: int = HISTORY_BUFFER_ROOM_SIZE, memory_mb: float = HISTORY_BUFFER_MEMORY_MB):
+        self.room_size = room_size
+        self.budget = int(memory_mb * 1024 * 1024)
+        self.rooms: "OrderedDict[str, RoomHistory]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _room(self, room_id: str) -> RoomHistory:
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = RoomHistory()
+        else:
+            self.rooms.move_to_end(room_id)
+        return room
+
+    def _insert(self, room: RoomHistory, message_id: int, frame: str):
+        index = bisect_left(room.ids, message_id)
+        if index < len(room.ids) and room.ids[index] == message_id:
+            return
+        room.ids.insert(index, message_id)
+        room.frames.insert(index, frame)
+        room.size += len(frame) + ENTRY_OVERHEAD_BYTES
+        self.bytes += len(frame) + ENTRY_OVERHEAD_BYTES
+
+    def _trim(self, room: RoomHistory):
+        excess = len(room.ids) - self.room_size
+        if excess > 0:
+            freed = sum(len(frame) + ENTRY_OVERHEAD_BYTES for frame in room.frames[:excess])
+            del room.ids[:excess]
+            del room.frames[:excess]
+            room.size -= freed
+            self.bytes -= freed
+            room.has_older = True
+
+    def _enforce_budget(self, keep: str):
+        while self.bytes > self.budget and len(self.rooms) > 1:
+            room_id = next(iter(self.rooms))
+            if room_id == keep:
+                self.rooms.move_to_end(room_id)
+                continue
+            self.drop(room_id)
+            self.evictions += 1
+
+    def remember(self, room_id: str, message_id: int, frame: str):
+        """Add a new message of the room."""
+        room = self._room(room_id)
+        if room.seeded and room.has_older and room.ids and message_id < room.ids[0]:
+            return  # Older than the window; the database has it
+        self._insert(room, message_id, frame)
+        self._trim(room)
+        self._enforce_budget(room_id)
+
+    def seed(self, room_id: str, items: Iterable[Tuple[int, str]], has_older: bool):
+        """
+        Fill a room from a database read of its newest messages (oldest first),
+        merging whatever arrived while the read was running.
+        """
+        room = self._room(room_id)
+        items = [(message_id, frame) for message_id, frame in items if message_id not in room.deleted]
+        if has_older and items:
+            # Anything before the read's oldest row isn't known to be complete
+            cutoff = bisect_left(room.ids, items[0][0])
+            freed = sum(len(frame) + ENTRY_OVERHEAD_BYTES for frame in room.frames[:cutoff])
+            del room.ids[:cutoff]
+            del room.frames[:cutoff]
+            room.size -= freed
+            self.bytes -= freed
+        for message_id, frame in items:
+            self._insert(room, message_id, frame)
+        room.seeded = True
+        room.has_older = has_older
+        room.deleted.clear()
+        self._trim(room)
+        self._enforce_budget(room_id)
+
+    def remove(self, room_id: str, message_id: int):
+        """Forget a deleted message."""
+        room = self.rooms.get(room_id)
+        if room is None or not isinstance(message_id, int):
+            return
+        if not room.seeded:
+            room.deleted.add(message_id)
+        index = bisect_left(room.ids, message_id)
+        if index < len(room.ids) and room.ids[index] == message_id:
+            del room.ids[index]
+            freed = len(room.frames.pop(index)) + ENTRY_OVERHEAD_BYTES
+            room.size -= freed
+            self.bytes -= freed
+
+    def drop(self, room_id: str):
+        room = self.rooms.pop(room_id, None)
+        if room is not None:
+            self.bytes -= room.size
+
+    def _seeded(self, room_id: str) -> Optional[RoomHistory]:
+        room = self.rooms.get(room_id)
+        if room is None or not room.seeded:
+            self.misses += 1
+            return None
+        self.rooms.move_to_end(room_id)
+        return room
+
+    def page(self, room_id: str, before_id: Optional[int], limit: int) -> Optional[HistorySlice]:
+        """The `limit` newest messages before before_id (or overall), or None if they aren't all here."""
+        room = self._seeded(room_id)
+        if room is None:
+            return None
+        end = len(room.ids) if before_id is None else bisect_left(room.ids, before_id)
+        if end < limit and room.has_older:
+            self.misses += 1
+            return None
+        start = max(0, end - limit)
+        has_more = start > 0 or room.has_older
+        self.hits += 1
+        return room.frames[start:end], has_more, (room.ids[start] if has_more and end > start else None)
+
+    def since(self, room_id: str, since_id: int, limit: int) -> Optional[HistorySlice]:
+        """
+        Messages after since_id, at most the newest `limit` (then truncated is
+        True), or None if the buffer doesn't reach back to since_id.
+        """
+        room = self._seeded(room_id)
+        if room is None or (room.has_older and (not room.ids or since_id < room.ids[0])):
+            if room is not None:
+                self.misses += 1
+            return None
+        start = bisect_right(room.ids, since_id)
+        truncated = len(room.ids) - start > limit
+        if truncated:
+            start = len(room.ids) - limit
+        self.hits += 1
+        return room.frames[start:], truncated, (room.ids[start] if truncated else None)
+
+    def stats(self) -> dict:
+        return {
+            "rooms": len(self.rooms),
+            "messages": sum(len(room.ids) for room in self.rooms.values()),
+            "bytes": self.bytes,
+            "budget_bytes": self.budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
@@ -1,10 +1,34 @@
 # Initialize the database
+from sqlalchemy import inspect, text
 from app.database import engine, Base
 from app import models
+from app.search import create_fts_index
+from app.mentions import backfill_mentions
 
 # Create all tables
 def init_db():
     Base.metadata.create_all(bind=engine)
+    # create_all doesn't alter existing tables either, so add nullable columns added since
+    existing = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            present = {column["name"] for column in existing.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in present and column.nullable:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+    # create_all skips tables that already exist, so add any indexes they are missing
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    # Full-text index over messages (SQLite FTS5), kept in sync by triggers
+    with engine.begin() as conn:
+        create_fts_index(conn)
+    # Normalized mentions for messages written before message_mentions existed
+    with engine.connect() as conn:
+        backfilled = backfill_mentions(conn)
+        if backfilled:
+            print(f"Backfilled {backfilled} mentions")
     print("Database initialized successfully!")
 
 if __name__ == "__main__":
@@ -1,15 +1,51 @@
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.auth import router as auth_router  # Add "app."
-from app.chat import router as chat_router  # Add "app."
+from app.chat import router as chat_router, manager  # Add "app."
 from app.ai_helper import router as ai_router  # Add AI helper router
-import os
-import shutil
-import uuid
-from pathlib import Path
+from app.files import router as files_router, blob_gc_loop
+from app.search import router as search_router
+from app.mentions import router as mentions_router
+from app.retention import router as retention_router, retention_loop
+from app.export import router as export_router
+from app.persistence import message_writer
+from app.bot import bot_worker
+from app import thumbnails
+from app.init_db import init_db
+from app.database import async_engine, read_engine
+from contextlib import asynccontextmanager
+import asyncio
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Create missing tables, columns and indexes first: the id allocator, mentions,
+    # bot summaries and search all need theirs. Idempotent, so every start runs it.
+    try:
+        await asyncio.to_thread(init_db)
+    except Exception as e:
+        raise RuntimeError(
+            f"Could not set up the database schema ({e}). Check DATABASE_URL, or run python -m app.init_db to see the full error."
+        ) from e
+    await message_writer.start()
+    await manager.start()
+    await bot_worker.start(manager.broadcast_to_room)
+    # Periodically delete uploads no message references anymore
+    gc_task = asyncio.create_task(blob_gc_loop())
+    # Archive old messages and purge deleted ones per the rooms' retention policies
+    retention_task = asyncio.create_task(retention_loop())
+    yield
+    gc_task.cancel()
+    retention_task.cancel()
+    thumbnails.shutdown()
+    await bot_worker.stop()
+    await manager.stop()
+    # Write out any chat messages still waiting in the write-behind queue
+    await message_writer.stop()
+    # Pooled async connections belong to this event loop; close them while it runs
+    await async_engine.dispose()
+    await read_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -20,50 +56,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Create uploads directory if it doesn't exist
-# Use absolute path to avoid issues with working directory
-BASE_DIR = Path(__file__).parent
-UPLOAD_DIR = BASE_DIR / "uploads"
-UPLOAD_DIR.mkdir(exist_ok=True, parents=True)
-
-# Serve static files from uploads directory
-app.mount("/uploads", StaticFiles(directory=str(UPLOAD_DIR)), name="uploads")
-
 app.include_router(auth_router)
 app.include_router(chat_router)
 app.include_router(ai_router)  # Include AI helper router
+app.include_router(files_router)
+app.include_router(search_router)
+app.include_router(mentions_router)
+app.include_router(retention_router)
+app.include_router(export_router)
 
 @app.get("/")
 def root():
     return {"message": "Real-Time Study Room Chat API running!"}
-
-@app.post("/upload")
-async def upload_file(
-    file: UploadFile = File(...),
-    room: str = Form(...),
-    username: str = Form(...)
-):
-    """
-    Upload a file and save it to the uploads directory.
-    Returns the file URL that can be used to access the file.
-    """
-    try:
-        # Generate unique filename
-        file_extension = os.path.splitext(file.filename)[1]
-        unique_filename = f"{uuid.uuid4()}{file_extension}"
-        file_path = UPLOAD_DIR / unique_filename
-        
-        # Save file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        # Generate file URL
-        file_url = f"http://localhost:8000/uploads/{unique_filename}"
-        
-        return {
-            "file_url": file_url,
-            "filename": file.filename,
-            "message": "File uploaded successfully"
-        }
-    except Exception as e:
-        return {"error": str(e), "message": "File upload failed"}
\ No newline at end of file
@@ -0,0 +1,173 @@
+# app/mentions.py
+"""
+Mention inbox.
+
+@mentions are stored one row per (mentioned user, message) in message_mentions,
+written by the message writer in the same transaction as the message itself, so
+"messages mentioning alice" is an index lookup instead of a scan of
+messages.mentioned_users. Each row carries a read flag for the inbox's unread
+counts.
+
+backfill_mentions() fills the table from mentioned_users of messages written
+before it existed; init_db runs it. Backfilled mentions start out read, so
+users don't open the inbox to years of "unread" history.
+"""
+
+import os
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from pydantic import BaseModel
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import get_async_db, get_read_db, insert_ignore
+from app import models
+from app.chat import serialize_message
+from app.persistence import message_writer
+
+router = APIRouter(prefix="/chat", tags=["Mentions"])
+
+MENTIONS_PAGE_SIZE = int(os.getenv("MENTIONS_PAGE_SIZE", "50"))
+MAX_MENTIONS_PAGE_SIZE = int(os.getenv("MENTIONS_MAX_PAGE_SIZE", "200"))
+BACKFILL_BATCH_SIZE = int(os.getenv("MENTIONS_BACKFILL_BATCH_SIZE", "5000"))
+BACKFILL_SEQUENCE = "mentions_backfill"  # id_sequences row: first message id not yet backfilled
+
+
+def backfill_mentions(connection, batch_size: int = BACKFILL_BATCH_SIZE) -> int:
+    """
+    Populate message_mentions from messages.mentioned_users on a sync connection.
+
+    Walks messages in id order, batch_size at a time, recording its progress in
+    id_sequences so a rerun (or one interrupted halfway) continues where the
+    last one stopped. Returns the number of mention rows inserted.
+    """
+    user_ids = dict(connection.execute(select(models.User.username, models.User.id)).all())
+    progress = connection.scalar(
+        select(models.IdSequence.next_value).where(models.IdSequence.name == BACKFILL_SEQUENCE)
+    )
+    if progress is None:
+        connection.execute(insert(models.IdSequence).values(name=BACKFILL_SEQUENCE, next_value=1))
+        progress = 1
+    after_id = progress - 1
+    inserted = 0
+    while True:
+        rows = connection.execute(
+            select(models.Message.id, models.Message.room_id, models.Message.mentioned_users).where(
+                models.Message.id > after_id,
+                models.Message.mentioned_users.isnot(None),
+                models.Message.mentioned_users != ""
+            ).order_by(models.Message.id).limit(batch_size)
+        ).all()
+        if not rows:
+            connection.commit()  # The checkpoint row, if this run created it
+            return inserted
+        values = [
+            {"user_id": user_ids[username], "message_id": message_id, "room_id": room_id, "is_read": 1}
+            for message_id, room_id, mentioned in rows
+            for username in set(mentioned.split(","))
+            if username in user_ids and room_id is not None
+        ]
+        if values:
+            # Messages written since the table existed already have their rows
+            connection.execute(insert_ignore(connection, models.MessageMention), values)
+            inserted += len(values)
+        after_id = rows[-1][0]
+        connection.execute(
+            update(models.IdSequence).where(models.IdSequence.name == BACKFILL_SEQUENCE).values(next_value=after_id + 1)
+        )
+        connection.commit()
+
+
+async def unread_counts(db: AsyncSession, user_id: int) -> dict:
+    rows = await db.execute(
+        select(models.Room.name, func.count()).select_from(models.MessageMention).join(
+            models.Room, models.Room.id == models.MessageMention.room_id
+        ).join(
+            models.Message, models.Message.id == models.MessageMention.message_id
+        ).where(
+            models.MessageMention.user_id == user_id,
+            models.MessageMention.is_read == 0,
+            models.Message.is_deleted == 0
+        ).group_by(models.Room.name)
+    )
+    by_room = dict(rows.all())
+    return {"total": sum(by_room.values()), "by_room": by_room}
+
+
+async def _user_id(db: AsyncSession, username: str) -> int:
+    user_id = await db.scalar(select(models.User.id).where(models.User.username == username))
+    if user_id is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user_id
+
+
+@router.get("/mentions/{username}")
+async def get_mentions(
+    username: str,
+    before_id: Optional[int] = Query(None, ge=1),
+    limit: int = Query(MENTIONS_PAGE_SIZE, ge=1, le=MAX_MENTIONS_PAGE_SIZE),
+    room: Optional[str] = None,
+    unread_only: bool = False,
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Messages mentioning a user, newest first, with unread counts per room.
+
+    Pass next_before_id back as before_id to get the next (older) page.
+    """
+    await message_writer.flush()
+    user_id = await _user_id(db, username)
+
+    query = select(models.Message, models.User.username, models.Room.name, models.MessageMention.is_read).join(
+        models.MessageMention, models.MessageMention.message_id == models.Message.id
+    ).join(
+        models.Room, models.Room.id == models.MessageMention.room_id
+    ).outerjoin(
+        models.User, models.User.id == models.Message.user_id
+    ).where(
+        models.MessageMention.user_id == user_id,
+        models.Message.is_deleted == 0
+    )
+    if before_id is not None:
+        query = query.where(models.MessageMention.message_id < before_id)
+    if room is not None:
+        query = query.where(models.Room.name == room)
+    if unread_only:
+        query = query.where(models.MessageMention.is_read == 0)
+    rows = (await db.execute(query.order_by(models.MessageMention.message_id.desc()).limit(limit + 1))).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return {
+        "mentions": [
+            {**serialize_message(msg, author), "room": room_name, "is_read": bool(is_read)}
+            for msg, author, room_name, is_read in rows
+        ],
+        "unread": await unread_counts(db, user_id),
+        "has_more": has_more,
+        "next_before_id": rows[-1][0].id if has_more else None
+    }
+
+
+class MarkReadRequest(BaseModel):
+    room: Optional[str] = None  # Only this room's mentions
+    up_to_id: Optional[int] = None  # Only mentions in messages up to this id
+
+
+@router.post("/mentions/{username}/read")
+async def mark_mentions_read(username: str, request: MarkReadRequest, db: AsyncSession = Depends(get_async_db)):
+    """Mark a user's mentions as read (all, one room's, or those up to a message id)."""
+    user_id = await _user_id(db, username)
+    statement = update(models.MessageMention).where(
+        models.MessageMention.user_id == user_id,
+        models.MessageMention.is_read == 0
+    )
+    if request.room is not None:
+        room_id = await db.scalar(select(models.Room.id).where(models.Room.name == request.room))
+        statement = statement.where(models.MessageMention.room_id == room_id)
+    if request.up_to_id is not None:
+        statement = statement.where(models.MessageMention.message_id <= request.up_to_id)
+    result = await db.execute(statement.values(is_read=1))
+    await db.commit()
+    return {"marked_read": result.rowcount, "unread": await unread_counts(db, user_id)}
@@ -1,5 +1,5 @@
 # app/models.py
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -30,15 +30,82 @@ class Message(Base):
     file_type = Column(String, nullable=True)
     file_size = Column(Integer, nullable=True)
     mentioned_users = Column(String, nullable=True)  # Comma-separated usernames
+    thumbnail_url = Column(String, nullable=True)
+    width = Column(Integer, nullable=True)  # Of the original image / first PDF page
+    height = Column(Integer, nullable=True)
     is_deleted = Column(Integer, default=0)
     deleted_by = Column(String, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
     user = relationship("User", back_populates="messages")
 
+    __table_args__ = (
+        # Keyset pagination of a room's visible history: WHERE room_id=? AND is_deleted=0 AND id<? ORDER BY id DESC
+        Index("ix_messages_room_deleted_id", "room_id", "is_deleted", "id"),
+    )
+
 class MutedUser(Base):
     __tablename__ = "muted_users"
     id = Column(Integer, primary_key=True, index=True)
     room_id = Column(Integer, ForeignKey("rooms.id"))
     username = Column(String)
     muted_by = Column(String)
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class IdSequence(Base):
+    __tablename__ = "id_sequences"
+    name = Column(String, primary_key=True)
+    next_value = Column(Integer, nullable=False)  # First id of the next block to hand out
+
+class FileBlob(Base):
+    __tablename__ = "file_blobs"
+    sha256 = Column(String, primary_key=True)
+    stored_name = Column(String, unique=True, nullable=False)  # File name in the uploads directory
+    size = Column(Integer, nullable=False)
+    ref_count = Column(Integer, default=0, nullable=False)  # Messages whose file_url points here
+    last_uploaded_at = Column(DateTime, default=datetime.utcnow, index=True)
+    thumbnail_name = Column(String, nullable=True)  # Stored next to the blob, None if not previewable
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+
+class RoomSummary(Base):
+    __tablename__ = "room_summaries"
+    room_id = Column(Integer, ForeignKey("rooms.id"), primary_key=True)
+    summary = Column(String, nullable=False, default="")  # Rolling summary the @bot gets as room context
+    last_message_id = Column(Integer, nullable=False, default=0)  # Newest message folded into the summary
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class MessageMention(Base):
+    __tablename__ = "message_mentions"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)  # The mentioned user
+    message_id = Column(Integer, ForeignKey("messages.id"), primary_key=True)
+    room_id = Column(Integer, ForeignKey("rooms.id"), nullable=False)
+    is_read = Column(Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        # Unread counts per room: WHERE user_id=? AND is_read=0 GROUP BY room_id
+        Index("ix_message_mentions_user_read_room", "user_id", "is_read", "room_id"),
+    )
+
+class RetentionPolicy(Base):
+    __tablename__ = "retention_policies"
+    room_id = Column(Integer, ForeignKey("rooms.id"), primary_key=True)
+    archive_after_days = Column(Integer, nullable=False)  # Older messages move to the archive
+    updated_by = Column(String, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ArchiveSegment(Base):
+    __tablename__ = "archive_segments"
+    id = Column(Integer, primary_key=True)
+    room_id = Column(Integer, ForeignKey("rooms.id"), nullable=False)
+    month = Column(String, nullable=False)  # Partition, "YYYY-MM" of the messages' timestamps
+    path = Column(String, unique=True, nullable=False)  # Relative to ARCHIVE_DIR
+    first_id = Column(Integer, nullable=False)
+    last_id = Column(Integer, nullable=False)
+    message_count = Column(Integer, nullable=False)
+    size = Column(Integer, nullable=False)  # Compressed bytes
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # History pages reaching into the archive: WHERE room_id=? AND last_id>? ORDER BY last_id DESC
+        Index("ix_archive_segments_room_last_id", "room_id", "last_id"),
+    )
@@ -0,0 +1,309 @@
+# app/persistence.py
+"""
+Write-behind persistence for chat messages.
+
+Chat messages get their id up front from the id_sequences table, are
+broadcast right away, and are written to the database in batches by a
+background task. A batch is flushed when MESSAGE_FLUSH_BATCH_SIZE messages are
+pending or MESSAGE_MAX_LOSS_MS after the oldest pending message was accepted,
+whichever comes first. That interval is the most a crash can lose; a clean
+shutdown flushes everything.
+
+While the database is unreachable batches are retried until it comes back. A
+row the database rejects (after the batch failed MAX_BATCH_ATTEMPTS times and
+was written row by row) is appended to MESSAGE_DEAD_LETTER_PATH, logged, and
+reported through on_dropped so the room can take back the broadcast.
+"""
+
+import asyncio
+import datetime
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import insert, select, func, update
+from sqlalchemy.exc import IntegrityError, InterfaceError, OperationalError
+
+from app.backplane import BACKPLANE_URL
+from app.database import AsyncSessionLocal, bulk_insert
+from app.files import adjust_blob_refs
+from app import models
+
+FLUSH_BATCH_SIZE = int(os.getenv("MESSAGE_FLUSH_BATCH_SIZE", "200"))
+MAX_LOSS_MS = int(os.getenv("MESSAGE_MAX_LOSS_MS", "100"))
+MAX_PENDING = int(os.getenv("MESSAGE_MAX_PENDING", "5000"))  # submit() waits beyond this
+# Several workers (a shared backplane, or uvicorn --workers) each holding a block
+# would hand out ids out of send order, and since_id resync, keyset paging and
+# the search catch-up all read ids as send order. They reserve one id at a time.
+MULTI_PROCESS = BACKPLANE_URL != "memory://" or int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+ID_BLOCK_SIZE = int(os.getenv("MESSAGE_ID_BLOCK_SIZE", "1" if MULTI_PROCESS else "100"))
+FLUSH_RETRY_SECONDS = 0.5
+MAX_BATCH_ATTEMPTS = 3  # After this many failures a batch is written row by row
+DEAD_LETTER_PATH = Path(os.getenv("MESSAGE_DEAD_LETTER_PATH", Path(__file__).parent / "dead_letter_messages.ndjson"))
+# The database (or the connection to it) is down: no row is at fault, so keep retrying
+TRANSIENT_ERRORS = (OperationalError, InterfaceError, OSError, asyncio.TimeoutError)
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_SEQUENCE = "messages"
+
+
+class MessageIdAllocator:
+    """
+    Hands out message ids from blocks reserved in the id_sequences table.
+
+    Reserving a block is a single atomic UPDATE, so several processes can share
+    the table without handing out the same id twice. Ids only follow send
+    order across processes with a block size of 1 (the default when more than
+    one process writes); a larger block is one round trip per block instead of
+    per message for a single worker.
+    """
+
+    def __init__(self, block_size: int = ID_BLOCK_SIZE):
+        self.block_size = block_size
+        self._next = 0
+        self._end = 0  # Exclusive end of the current block
+        self._lock = asyncio.Lock()
+
+    async def allocate(self) -> int:
+        if self._next >= self._end:
+            async with self._lock:
+                if self._next >= self._end:
+                    await self._reserve_block()
+        message_id = self._next
+        self._next += 1
+        return message_id
+
+    async def _reserve_block(self):
+        async with AsyncSessionLocal() as db:
+            end = await db.scalar(
+                update(models.IdSequence)
+                .where(models.IdSequence.name == MESSAGE_SEQUENCE)
+                .values(next_value=models.IdSequence.next_value + self.block_size)
+                .returning(models.IdSequence.next_value)
+            )
+            if end is None:
+                # First run: start after whatever is already in the table
+                start = (await db.scalar(select(func.max(models.Message.id))) or 0) + 1
+                end = start + self.block_size
+                db.add(models.IdSequence(name=MESSAGE_SEQUENCE, next_value=end))
+            try:
+                await db.commit()
+            except IntegrityError:
+                # Another process created the row first; take a block from it instead
+                await db.rollback()
+                return await self._reserve_block()
+        self._next = end - self.block_size
+        self._end = end
+
+
+class MessageWriter:
+    """Buffers accepted messages and writes them in batched transactions."""
+
+    def __init__(self):
+        self.allocator = MessageIdAllocator()
+        self.pending: List[dict] = []
+        self._wakeup = asyncio.Event()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._flush_lock = asyncio.Lock()
+        self._failures = 0
+        self._task: Optional[asyncio.Task] = None
+        self.on_submit: Optional[Callable[[dict], None]] = None  # Sees every accepted record
+        self.on_dropped: Optional[Callable[[dict], None]] = None  # Sees every dead-lettered record
+        self.dead_lettered = 0
+
+    async def allocate_id(self) -> int:
+        return await self.allocator.allocate()
+
+    async def submit(self, record: dict):
+        """
+        Queue a message for writing.
+
+        record holds the message columns plus "username" and "room" (room name);
+        "id" must come from allocate_id().
+        """
+        while len(self.pending) >= MAX_PENDING:
+            # The database is falling behind; hold the sender until a batch lands
+            self._space.clear()
+            self._wakeup.set()
+            await self._space.wait()
+
+        record.setdefault("timestamp", datetime.datetime.utcnow())
+        record["accepted_at"] = asyncio.get_running_loop().time()
+        self.pending.append(record)
+        if self.on_submit:
+            self.on_submit(record)
+        # Wake the writer to start the max-loss timer, or because a batch is full
+        if len(self.pending) == 1 or len(self.pending) >= FLUSH_BATCH_SIZE:
+            self._wakeup.set()
+
+    def is_pending(self, message_id: int) -> bool:
+        return any(record["id"] == message_id for record in self.pending)
+
+    async def start(self):
+        if self._task is None:
+            # Events of the running loop: the app may be started again on a new one (tests)
+            self._wakeup = asyncio.Event()
+            self._space = asyncio.Event()
+            self._space.set()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and write out everything still pending."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        print("💾 Message writer stopped, all pending messages flushed")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._wakeup.clear()
+            if not self.pending:
+                await self._wakeup.wait()
+                continue
+
+            # Wait until the batch is full or the oldest message hits the max-loss window
+            timeout = self.pending[0]["accepted_at"] + MAX_LOSS_MS / 1000 - loop.time()
+            if len(self.pending) < FLUSH_BATCH_SIZE and timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Error flushing messages, will retry")
+                await asyncio.sleep(FLUSH_RETRY_SECONDS)
+
+    async def flush(self):
+        """Write every message submitted so far. Returns once they are committed."""
+        # Shielded: a caller cancelled between a batch's commit and its removal from
+        # pending would leave it to be inserted again by the next flush
+        await asyncio.shield(self._flush())
+
+    async def _flush(self):
+        async with self._flush_lock:
+            while self.pending:
+                batch = self.pending[:FLUSH_BATCH_SIZE]
+                try:
+                    await self._write_batch(batch)
+                    self._failures = 0
+                except TRANSIENT_ERRORS:
+                    raise
+                except Exception:
+                    self._failures += 1
+                    if self._failures < MAX_BATCH_ATTEMPTS:
+                        raise
+                    # Keep one bad row from blocking every message behind it
+                    await self._write_rows_individually(batch)
+                    self._failures = 0
+                del self.pending[:len(batch)]
+                self._space.set()
+
+    async def _write_batch(self, batch: List[dict]):
+        async with AsyncSessionLocal() as db:
+            user_ids = await self._get_or_create_ids(
+                db, models.User, models.User.username,
+                {record["username"] for record in batch},
+                lambda name: {"username": name, "password_hash": "", "is_admin": 0}
+            )
+            room_ids = await self._get_or_create_ids(
+                db, models.Room, models.Room.name,
+                {record["room"] for record in batch},
+                lambda name: {"name": name, "admin_username": None}
+            )
+            # One multi-row INSERT (COPY on PostgreSQL) instead of a statement per message
+            await bulk_insert(db, models.Message, [
+                {
+                    "id": record["id"],
+                    "room_id": room_ids[record["room"]],
+                    "user_id": user_ids[record["username"]],
+                    "content": record.get("content", ""),
+                    "file_url": record.get("file_url"),
+                    "filename": record.get("filename"),
+                    "file_type": record.get("file_type"),
+                    "file_size": record.get("file_size"),
+                    "mentioned_users": record.get("mentioned_users"),
+                    "thumbnail_url": record.get("thumbnail_url"),
+                    "width": record.get("width"),
+                    "height": record.get("height"),
+                    "timestamp": record["timestamp"]
+                }
+                for record in batch
+            ])
+            await self._insert_mentions(db, batch, room_ids)
+            # Shared files stay stored while a message points at them
+            await adjust_blob_refs(db, (record.get("file_url") for record in batch), 1)
+            await db.commit()
+
+    async def _write_rows_individually(self, batch: List[dict]):
+        for written, record in enumerate(batch):
+            try:
+                await self._write_batch([record])
+            except TRANSIENT_ERRORS:
+                # The database went away mid-way: what's left stays pending for the retry
+                del self.pending[:written]
+                raise
+            except Exception:
+                logger.exception("Message %s could not be saved, moved to %s", record["id"], DEAD_LETTER_PATH)
+                self._dead_letter(record)
+
+    def _dead_letter(self, record: dict):
+        """Keep a rejected message on disk so it can be inspected and replayed."""
+        line = json.dumps({key: value for key, value in record.items() if key != "accepted_at"}, default=str)
+        try:
+            DEAD_LETTER_PATH.parent.mkdir(parents=True, exist_ok=True)
+            with open(DEAD_LETTER_PATH, "a", encoding="utf-8") as dead_letters:
+                dead_letters.write(line + "\n")
+        except OSError:
+            logger.exception("Could not write message %s to the dead-letter file: %s", record["id"], line)
+        self.dead_lettered += 1
+        if self.on_dropped:
+            self.on_dropped(record)
+
+    @staticmethod
+    async def _insert_mentions(db, batch: List[dict], room_ids: Dict[str, int]):
+        """Index the batch's @mentions of existing users in message_mentions (same transaction)."""
+        mentions = [
+            (record, username)
+            for record in batch if record.get("mentioned_users")
+            for username in record["mentioned_users"].split(",")
+        ]
+        if not mentions:
+            return
+        rows = await db.execute(select(models.User.username, models.User.id).where(
+            models.User.username.in_({username for _, username in mentions})
+        ))
+        user_ids = {name: pk for name, pk in rows}
+        values = [
+            {"user_id": user_ids[username], "message_id": record["id"], "room_id": room_ids[record["room"]], "is_read": 0}
+            for record, username in mentions if username in user_ids
+        ]
+        await bulk_insert(db, models.MessageMention, values)
+
+    @staticmethod
+    async def _get_or_create_ids(db, model, name_column, names: set, defaults) -> Dict[str, int]:
+        """Map names to primary keys, inserting rows for names that don't exist yet."""
+        rows = await db.execute(select(name_column, model.id).where(name_column.in_(names)))
+        ids = {name: pk for name, pk in rows}
+        missing = names - ids.keys()
+        if missing:
+            await db.execute(insert(model), [defaults(name) for name in missing])
+            rows = await db.execute(select(name_column, model.id).where(name_column.in_(missing)))
+            ids.update({name: pk for name, pk in rows})
+        return ids
+
+
+message_writer = MessageWriter()
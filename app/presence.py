@@ -0,0 +1,98 @@
+# app/presence.py
+"""
+Typing-indicator aggregation.
+
+Clients report when they start and stop typing. Instead of relaying every such
+event to the whole room (each of n typists costing n frames), the aggregator
+keeps each room's set of typing users and every TYPING_FLUSH_MS sends one
+typing_state frame with the full list to the room, and only when the list
+changed since the last one. A user who stops reporting (closed laptop, lost
+stop_typing) drops out after TYPING_TTL_SECONDS.
+
+The state is per worker. Typing events from other workers arrive over the
+backplane and are fed in the same way, so every worker sends its own sockets
+the whole room's list.
+"""
+
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+TYPING_FLUSH_MS = int(os.getenv("TYPING_FLUSH_MS", "500"))
+TYPING_TTL_SECONDS = float(os.getenv("TYPING_TTL_SECONDS", "6"))
+
+# deliver(room_id, message) sends a frame to this worker's sockets in the room
+Deliver = Callable[[str, dict], None]
+
+
+class TypingAggregator:
+    def __init__(self, flush_ms: int = TYPING_FLUSH_MS, ttl_seconds: float = TYPING_TTL_SECONDS):
+        self.flush_interval = flush_ms / 1000
+        self.ttl = ttl_seconds
+        self.deliver: Optional[Deliver] = None
+        self._typing: Dict[str, Dict[str, float]] = {}  # room -> username -> expires at
+        self._sent: Dict[str, Tuple[str, ...]] = {}  # room -> users in the last typing_state frame
+        self._task: Optional[asyncio.Task] = None
+        self.events = 0
+        self.frames = 0
+
+    async def start(self, deliver: Deliver):
+        self.deliver = deliver
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def set_typing(self, room_id: str, username: str, typing: bool) -> bool:
+        """Record a start (or refresh) or stop of typing. Returns False if it changed nothing."""
+        self.events += 1
+        if typing:
+            self._typing.setdefault(room_id, {})[username] = time.monotonic() + self.ttl
+            return True
+        users = self._typing.get(room_id)
+        return bool(users) and users.pop(username, None) is not None
+
+    def typing_users(self, room_id: str) -> List[str]:
+        now = time.monotonic()
+        return sorted(user for user, expires in self._typing.get(room_id, {}).items() if expires > now)
+
+    def flush(self):
+        """Send typing_state to every room whose list of typists changed."""
+        now = time.monotonic()
+        for room_id in set(self._typing) | set(self._sent):
+            users = self._typing.get(room_id, {})
+            for user in [user for user, expires in users.items() if expires <= now]:
+                del users[user]
+            if not users:
+                self._typing.pop(room_id, None)
+            current = tuple(sorted(users))
+            if current == self._sent.get(room_id, ()):
+                continue
+            if current:
+                self._sent[room_id] = current
+            else:
+                self._sent.pop(room_id, None)
+            self.frames += 1
+            self.deliver(room_id, {"type": "typing_state", "users": list(current)})
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error sending typing state: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "typing_rooms": len(self._typing),
+            "typing_events": self.events,
+            "typing_state_frames": self.frames
+        }
@@ -0,0 +1,185 @@
+# app/rate_limit.py
+"""
+In-memory token-bucket rate limiting.
+
+Every limited action has a kind ("chat", "typing", "upload", "ai", "export") and is
+checked against one bucket per scope it belongs to: a chat frame against its
+connection's, its user's and its room's bucket, an upload or @bot question
+against its user's and its client address's, other HTTP requests against their
+client address's. A scope whose key is None (an anonymous user) is skipped. A bucket is two floats (tokens left, last refill time) and
+refills continuously at its limit's rate up to its burst, so memory per bucket
+is constant and checks are O(1).
+
+Limits are configured per kind with RATE_LIMIT_<KIND>, a comma separated list
+of scope=rate:burst, rate being tokens per second. For example
+RATE_LIMIT_CHAT="connection=5:10,user=5:10,room=50:100". A scope left out is
+not limited (a rate of 0 is rejected, leave the scope out instead);
+RATE_LIMITING=0 turns limiting off altogether.
+
+Buckets that have refilled completely carry no information, so they are swept
+periodically instead of being kept for every client ever seen.
+"""
+
+import math
+import os
+import time
+from typing import Dict, Hashable, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+RATE_LIMITING = os.getenv("RATE_LIMITING", "1") != "0"
+RATE_LIMIT_SWEEP_EVERY = int(os.getenv("RATE_LIMIT_SWEEP_EVERY", "10000"))  # Checks between sweeps
+# Longest a WebSocket's reads are paused after a refused frame
+RATE_LIMIT_MAX_PAUSE_SECONDS = float(os.getenv("RATE_LIMIT_MAX_PAUSE_SECONDS", "2"))
+
+DEFAULT_LIMITS = {
+    "chat": "connection=5:10,user=5:10,room=50:100",
+    "typing": "connection=4:8",
+    # Uploads and @bot questions are limited per user. A whole classroom behind
+    # one NAT shares a client address, so the client limit is sized for about
+    # 20 active users; it stops one address cycling through made-up names.
+    "upload": "user=1:10,client=5:100",
+    "ai": "user=0.5:5,client=2:40",
+    # Exports (and the HTTP AI helper) carry no username: they are limited per
+    # address only, so users behind one NAT share these buckets.
+    "export": "client=0.1:3",  # Whole-room transcripts
+}
+
+
+class Limit:
+    __slots__ = ("rate", "burst")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+
+
+def parse_limits(spec: str) -> Dict[str, Limit]:
+    """"connection=5:10,room=50:100" -> {"connection": Limit(5, 10), "room": Limit(50, 100)}"""
+    limits = {}
+    for part in spec.split(","):
+        if not part.strip():
+            continue
+        scope, _, value = part.partition("=")
+        rate, _, burst = value.partition(":")
+        limit = Limit(float(rate), float(burst or rate))
+        if limit.rate <= 0 or limit.burst < 1:
+            raise ValueError(f"Invalid rate limit {part.strip()!r}: rate must be > 0 and burst >= 1")
+        limits[scope.strip()] = limit
+    return limits
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated
+
+    def refill(self, limit: Limit, now: float):
+        self.tokens = min(limit.burst, self.tokens + (now - self.updated) * limit.rate)
+        self.updated = now
+
+
+class RateLimiter:
+    def __init__(self, limits: Dict[str, Dict[str, Limit]], enabled: bool = True):
+        self.limits = limits
+        self.enabled = enabled
+        self._buckets: Dict[Tuple[str, str, Hashable], TokenBucket] = {}
+        self._checks = 0
+        self.allowed: Dict[str, int] = {kind: 0 for kind in limits}
+        self.limited: Dict[str, int] = {kind: 0 for kind in limits}
+
+    @classmethod
+    def from_env(cls) -> "RateLimiter":
+        return cls({
+            kind: parse_limits(os.getenv(f"RATE_LIMIT_{kind.upper()}", default))
+            for kind, default in DEFAULT_LIMITS.items()
+        }, RATE_LIMITING)
+
+    def check(self, kind: str, **keys: Hashable) -> float:
+        """
+        Take one token of `kind` from the bucket of every scope given, e.g.
+        check("chat", connection=id(ws), user="alice", room="math").
+
+        Returns 0 if the action is allowed, otherwise the seconds until it
+        would be; a refused action takes no tokens from any bucket.
+        """
+        limits = self.limits.get(kind)
+        if not self.enabled or not limits:
+            return 0.0
+        now = time.monotonic()
+        buckets = []
+        wait = 0.0
+        for scope, key in keys.items():
+            limit = limits.get(scope)
+            if limit is None or key is None:
+                continue
+            bucket_key = (kind, scope, key)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self._buckets[bucket_key] = TokenBucket(limit.burst, now)
+            else:
+                bucket.refill(limit, now)
+            if bucket.tokens < 1:
+                wait = max(wait, (1 - bucket.tokens) / limit.rate)
+            buckets.append(bucket)
+
+        self._checks += 1
+        if self._checks % RATE_LIMIT_SWEEP_EVERY == 0:
+            self.sweep(now)
+        if wait:
+            self.limited[kind] = self.limited.get(kind, 0) + 1
+            return wait
+        for bucket in buckets:
+            bucket.tokens -= 1
+        self.allowed[kind] = self.allowed.get(kind, 0) + 1
+        return 0.0
+
+    def forget(self, scope: str, key: Hashable):
+        """Drop a scope's buckets for every kind (e.g. a closed connection's)."""
+        for kind in self.limits:
+            self._buckets.pop((kind, scope, key), None)
+
+    def sweep(self, now: Optional[float] = None):
+        """Drop buckets that have refilled to their burst: they'd be recreated identical."""
+        now = time.monotonic() if now is None else now
+        for bucket_key, bucket in list(self._buckets.items()):
+            limit = self.limits[bucket_key[0]][bucket_key[1]]
+            if bucket.tokens + (now - bucket.updated) * limit.rate >= limit.burst:
+                del self._buckets[bucket_key]
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "buckets": len(self._buckets),
+            "allowed": dict(self.allowed),
+            "limited": dict(self.limited)
+        }
+
+
+rate_limiter = RateLimiter.from_env()
+
+
+def user_key(username: Optional[str]) -> Optional[str]:
+    """The user-scope key for a name: None for anonymous clients, which all share one name."""
+    return username if username and username != "Anonymous" else None
+
+
+def check_request(kind: str, request: Request, username: Optional[str] = None):
+    """Limit an HTTP request per client address (and user, if named); raises 429 with Retry-After."""
+    client = request.client.host if request.client else "unknown"
+    wait = rate_limiter.check(kind, client=client, user=user_key(username))
+    if wait:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many requests. Please slow down.",
+            headers={"Retry-After": str(math.ceil(wait))}
+        )
+
+
+def rate_limit(kind: str):
+    """FastAPI dependency limiting an endpoint per client address; answers 429 with Retry-After."""
+    async def dependency(request: Request):
+        check_request(kind, request)
+    return dependency
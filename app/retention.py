@@ -0,0 +1,220 @@
+# app/retention.py
+"""
+Message retention: archival of old messages and compaction of deleted ones.
+
+Each room may have a retention policy (PUT /chat/retention/{room}, room admin
+only): its messages older than archive_after_days are moved out of the
+messages table into compressed monthly archive segments (see app/archive.py).
+Rooms without one use RETENTION_ARCHIVE_AFTER_DAYS, 0 meaning they keep
+everything in the table. History pages read through to the archive, so
+clients don't see the difference.
+
+The archiver takes a room's oldest messages RETENTION_BATCH_SIZE at a time. A
+batch is written as one segment file per month, then a single transaction
+lists the segments in archive_segments and deletes exactly those rows (and
+their mention rows). If another worker archived any of them first the delete
+comes up short, and the transaction is rolled back and the files removed, so
+no message is archived twice.
+
+Compaction physically removes soft-deleted messages (is_deleted = 1) once
+they are RETENTION_COMPACT_AFTER_HOURS old. Their shared files were already
+released when they were deleted. Archived messages keep theirs, since the
+archive still links to them.
+
+Archived messages are out of search, the mention inbox and the bot's context,
+and can no longer be deleted. Both jobs run every RETENTION_INTERVAL_SECONDS.
+"""
+
+import asyncio
+import datetime
+import os
+from itertools import groupby
+from typing import List, Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from pydantic import BaseModel, Field
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import AsyncSessionLocal, get_async_db, get_read_db
+from app import models
+from app.archive import archive_stats, remove_segment, write_segment
+from app.chat import is_room_admin, serialize_message
+from app.codec import encode_frame
+
+router = APIRouter(prefix="/chat", tags=["Retention"])
+
+RETENTION_ARCHIVE_AFTER_DAYS = int(os.getenv("RETENTION_ARCHIVE_AFTER_DAYS", "0"))  # Default policy, 0 = never
+RETENTION_COMPACT_AFTER_HOURS = float(os.getenv("RETENTION_COMPACT_AFTER_HOURS", "24"))
+RETENTION_INTERVAL_SECONDS = int(os.getenv("RETENTION_INTERVAL_SECONDS", "3600"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))  # Messages per archive transaction
+
+
+async def archive_batch(room_pk: int, cutoff: datetime.datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """
+    Archive the room's oldest visible messages sent before cutoff, at most
+    batch_size. Returns how many were archived (0 when the room is done).
+    """
+    async with AsyncSessionLocal() as db:
+        # The oldest messages by id, cut at the first one that is recent enough.
+        # Ids follow time closely enough that this reads batch_size rows instead
+        # of scanning the room for old ones; stragglers go in a later run.
+        rows = (await db.execute(
+            select(models.Message, models.User.username).outerjoin(
+                models.User, models.Message.user_id == models.User.id
+            ).where(
+                models.Message.room_id == room_pk,
+                models.Message.is_deleted == 0
+            ).order_by(models.Message.id).limit(batch_size)
+        )).all()
+        old = []
+        for msg, username in rows:
+            if msg.timestamp is None or msg.timestamp >= cutoff:
+                break
+            old.append((msg, username))
+        if not old:
+            return 0
+
+        written: List[str] = []
+        try:
+            for month, group in groupby(old, key=lambda row: row[0].timestamp.strftime("%Y-%m")):
+                group = list(group)
+                lines = [encode_frame(serialize_message(msg, username)) for msg, username in group]
+                first_id, last_id = group[0][0].id, group[-1][0].id
+                path, size = await asyncio.to_thread(write_segment, room_pk, month, lines, first_id, last_id)
+                written.append(path)
+                db.add(models.ArchiveSegment(
+                    room_id=room_pk, month=month, path=path, first_id=first_id, last_id=last_id,
+                    message_count=len(group), size=size
+                ))
+
+            ids = [msg.id for msg, _ in old]
+            await db.execute(delete(models.MessageMention).where(models.MessageMention.message_id.in_(ids)))
+            result = await db.execute(
+                delete(models.Message).where(models.Message.id.in_(ids), models.Message.is_deleted == 0)
+                .execution_options(synchronize_session=False)
+            )
+            if result.rowcount != len(ids):
+                raise RuntimeError(f"{len(ids) - result.rowcount} message(s) changed while archiving")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            for path in written:
+                await asyncio.to_thread(remove_segment, path)
+            raise
+    return len(old)
+
+
+async def compact_room(room_pk: int, cutoff: datetime.datetime, batch_size: int = RETENTION_BATCH_SIZE) -> int:
+    """Physically delete the room's soft-deleted messages sent before cutoff. Returns how many."""
+    removed = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            # Served by ix_messages_room_deleted_id
+            ids = list(await db.scalars(
+                select(models.Message.id).where(
+                    models.Message.room_id == room_pk,
+                    models.Message.is_deleted == 1,
+                    models.Message.timestamp < cutoff
+                ).limit(batch_size)
+            ))
+            if not ids:
+                return removed
+            await db.execute(delete(models.MessageMention).where(models.MessageMention.message_id.in_(ids)))
+            await db.execute(
+                delete(models.Message).where(models.Message.id.in_(ids), models.Message.is_deleted == 1)
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        removed += len(ids)
+
+
+async def run_retention() -> dict:
+    """One pass of both jobs over every room. Returns the number of messages archived and compacted."""
+    now = datetime.datetime.utcnow()
+    async with AsyncSessionLocal() as db:
+        rooms = (await db.execute(
+            select(models.Room.id, models.RetentionPolicy.archive_after_days).outerjoin(
+                models.RetentionPolicy, models.RetentionPolicy.room_id == models.Room.id
+            )
+        )).all()
+
+    archived = compacted = 0
+    for room_pk, days in rooms:
+        days = days if days is not None else RETENTION_ARCHIVE_AFTER_DAYS
+        try:
+            if days > 0:
+                cutoff = now - datetime.timedelta(days=days)
+                while True:
+                    count = await archive_batch(room_pk, cutoff)
+                    archived += count
+                    if count < RETENTION_BATCH_SIZE:
+                        break
+            compacted += await compact_room(room_pk, now - datetime.timedelta(hours=RETENTION_COMPACT_AFTER_HOURS))
+        except Exception as e:
+            print(f"Error applying retention to room {room_pk}: {e}")
+    if archived or compacted:
+        print(f"🗄️ Archived {archived} message(s), compacted {compacted} deleted message(s)")
+    return {"archived": archived, "compacted": compacted}
+
+
+async def retention_loop():
+    """Background task: run_retention every RETENTION_INTERVAL_SECONDS."""
+    while True:
+        await asyncio.sleep(RETENTION_INTERVAL_SECONDS)
+        try:
+            await run_retention()
+        except Exception as e:
+            print(f"Error running retention: {e}")
+
+
+class RetentionRequest(BaseModel):
+    username: str  # Must be the room's admin
+    archive_after_days: Optional[int] = Field(None, ge=1)  # None: back to the server default
+
+
+async def _room_pk(db: AsyncSession, room_name: str) -> int:
+    room_pk = await db.scalar(select(models.Room.id).where(models.Room.name == room_name))
+    if room_pk is None:
+        raise HTTPException(status_code=404, detail="Room not found")
+    return room_pk
+
+
+async def _policy(db: AsyncSession, room_name: str, room_pk: int) -> dict:
+    days = await db.scalar(
+        select(models.RetentionPolicy.archive_after_days).where(models.RetentionPolicy.room_id == room_pk)
+    )
+    return {
+        "room": room_name,
+        "archive_after_days": days if days is not None else (RETENTION_ARCHIVE_AFTER_DAYS or None),
+        "is_default": days is None,
+        "archive": await archive_stats(db, room_pk)
+    }
+
+
+@router.get("/retention/{room_id}")
+async def get_retention(room_id: str, db: AsyncSession = Depends(get_read_db)):
+    """A room's retention policy and how much of it is archived."""
+    return await _policy(db, room_id, await _room_pk(db, room_id))
+
+
+@router.put("/retention/{room_id}")
+async def set_retention(room_id: str, request: RetentionRequest, db: AsyncSession = Depends(get_async_db)):
+    """Set (or with archive_after_days null, clear) a room's retention policy. Room admin only."""
+    room_pk = await _room_pk(db, room_id)
+    if not await is_room_admin(room_id, request.username):
+        raise HTTPException(status_code=403, detail="Only the room admin can change retention")
+    policy = await db.get(models.RetentionPolicy, room_pk)
+    if request.archive_after_days is None:
+        if policy:
+            await db.delete(policy)
+    elif policy:
+        policy.archive_after_days = request.archive_after_days
+        policy.updated_by = request.username
+        policy.updated_at = datetime.datetime.utcnow()
+    else:
+        db.add(models.RetentionPolicy(
+            room_id=room_pk, archive_after_days=request.archive_after_days, updated_by=request.username
+        ))
+    await db.commit()
+    return await _policy(db, room_id, room_pk)
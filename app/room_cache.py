@@ -0,0 +1,117 @@
+# app/room_cache.py
+"""
+Process-local cache of room metadata: room id, admin username and muted users.
+
+Every chat frame and admin action needs these, and they almost never change,
+so they are loaded once per room and then kept up to date write-through by the
+code paths that change them (admin assignment, mute, unmute). The cache holds at
+most ROOM_CACHE_SIZE rooms and evicts the least recently used one.
+
+A load reads the database across awaits, so a change made meanwhile would be
+missed by the write-through (nothing is cached yet) and then overwritten by
+what the load read. Changes to a room with a load in flight are counted, and a
+load that saw any is read again instead of being installed.
+"""
+
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app import models
+
+ROOM_CACHE_SIZE = int(os.getenv("ROOM_CACHE_SIZE", "1024"))
+
+
+class RoomInfo:
+    __slots__ = ("id", "name", "admin_username", "muted")
+
+    def __init__(self, id: int, name: str, admin_username: Optional[str], muted: Set[str]):
+        self.id = id
+        self.name = name
+        self.admin_username = admin_username
+        self.muted = muted
+
+
+class RoomCache:
+    def __init__(self, max_rooms: int = ROOM_CACHE_SIZE):
+        self.max_rooms = max_rooms
+        self._rooms: "OrderedDict[str, RoomInfo]" = OrderedDict()
+        self._loads: Dict[str, List[int]] = {}  # room name -> [changes seen, loads in flight]
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, room_name: str) -> Optional[RoomInfo]:
+        """Return the room's metadata, loading it on a miss. None if the room doesn't exist."""
+        info = self._rooms.get(room_name)
+        if info is not None:
+            self._rooms.move_to_end(room_name)
+            self.hits += 1
+            return info
+
+        self.misses += 1
+        while True:
+            state = self._loads.setdefault(room_name, [0, 0])
+            changes = state[0]
+            state[1] += 1
+            try:
+                info = await self._load(room_name)
+            finally:
+                state[1] -= 1
+                if not state[1]:
+                    del self._loads[room_name]
+            if state[0] == changes:
+                break
+            # Muted or reassigned while we were reading: what we read may predate it
+        if info is None:
+            # Not cached: the room may be created at any moment
+            return None
+
+        if info.admin_username is None:
+            # Not cached: the first user to join on any worker may claim the room
+            return info
+
+        self._rooms[room_name] = info
+        if len(self._rooms) > self.max_rooms:
+            self._rooms.popitem(last=False)
+        return info
+
+    async def _load(self, room_name: str) -> Optional[RoomInfo]:
+        async with AsyncSessionLocal() as db:
+            room = await db.scalar(select(models.Room).where(models.Room.name == room_name))
+            if room is None:
+                return None
+            muted = await db.scalars(select(models.MutedUser.username).where(models.MutedUser.room_id == room.id))
+            return RoomInfo(room.id, room.name, room.admin_username, set(muted))
+
+    def _changed(self, room_name: str):
+        state = self._loads.get(room_name)
+        if state is not None:
+            state[0] += 1
+
+    def set_admin(self, room_name: str, username: Optional[str]):
+        self._changed(room_name)
+        info = self._rooms.get(room_name)
+        if info is not None:
+            info.admin_username = username
+
+    def mark_muted(self, room_name: str, username: str):
+        self._changed(room_name)
+        info = self._rooms.get(room_name)
+        if info is not None:
+            info.muted.add(username)
+
+    def mark_unmuted(self, room_name: str, username: str):
+        self._changed(room_name)
+        info = self._rooms.get(room_name)
+        if info is not None:
+            info.muted.discard(username)
+
+    def invalidate(self, room_name: str):
+        self._changed(room_name)
+        self._rooms.pop(room_name, None)
+
+
+room_cache = RoomCache()
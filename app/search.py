@@ -0,0 +1,326 @@
+# app/search.py
+"""
+Full-text search over chat messages.
+
+On SQLite the index is an FTS5 table, messages_fts, over messages.content
+(external content, so the text is not stored twice). Triggers keep it in sync
+with inserts, edits and soft-deletes: a message is in the index exactly while
+is_deleted = 0. init_db creates the table and triggers and indexes existing
+messages. Results are ranked with BM25 and come with a highlighted snippet.
+
+Without FTS5 (other databases, or an SQLite build lacking it) searches fall back
+to InvertedIndex, an in-process index built per room on first search and caught
+up with newer messages on every search after that. Message ids are handed out
+before the write, so a message can commit after higher ids were indexed; each
+catch-up re-reads the last SEARCH_CATCHUP_WINDOW ids below the newest indexed
+one to pick those up.
+
+Snippets mark matched terms with SNIPPET_OPEN / SNIPPET_CLOSE (STX/ETX control
+characters) so clients can highlight them without parsing HTML.
+"""
+
+import asyncio
+import math
+import os
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.database import STREAM_BATCH_SIZE, get_read_db
+from app import models
+from app.chat import serialize_message
+from app.persistence import message_writer
+
+router = APIRouter(prefix="/chat", tags=["Search"])
+
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+MAX_SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_MAX_PAGE_SIZE", "100"))
+SEARCH_INDEX_ROOMS = int(os.getenv("SEARCH_INDEX_ROOMS", "64"))  # Rooms kept by the fallback index
+# Ids below the newest indexed one re-read on each catch-up, for messages committed late
+SEARCH_CATCHUP_WINDOW = int(os.getenv("SEARCH_CATCHUP_WINDOW", "1000"))
+SNIPPET_TOKENS = 12
+SNIPPET_OPEN = "\x02"
+SNIPPET_CLOSE = "\x03"
+SNIPPET_ELLIPSIS = "…"
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+FTS_SCHEMA = [
+    # room_id is indexed too, so a search only ever scores the room's own matches
+    """CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+        content, room_id, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+    WHEN COALESCE(new.is_deleted, 0) = 0 BEGIN
+        INSERT INTO messages_fts(rowid, content, room_id) VALUES (new.id, new.content, new.room_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+    WHEN COALESCE(old.is_deleted, 0) = 0 BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content, room_id) VALUES ('delete', old.id, old.content, old.room_id);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content, room_id, is_deleted ON messages BEGIN
+        INSERT INTO messages_fts(messages_fts, rowid, content, room_id)
+            SELECT 'delete', old.id, old.content, old.room_id WHERE COALESCE(old.is_deleted, 0) = 0;
+        INSERT INTO messages_fts(rowid, content, room_id)
+            SELECT new.id, new.content, new.room_id WHERE COALESCE(new.is_deleted, 0) = 0;
+    END""",
+]
+
+
+def create_fts_index(connection) -> bool:
+    """
+    Create the FTS5 table and triggers on a sync connection, indexing existing
+    messages the first time. Returns False if the database can't do FTS5.
+    """
+    if connection.dialect.name != "sqlite":
+        return False
+    exists = connection.execute(text(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+    )).first()
+    try:
+        for statement in FTS_SCHEMA:
+            connection.execute(text(statement))
+    except Exception as e:
+        print(f"⚠️ FTS5 unavailable, search will use the in-process index: {e}")
+        return False
+    if not exists:
+        connection.execute(text(
+            "INSERT INTO messages_fts(rowid, content, room_id) "
+            "SELECT id, content, room_id FROM messages WHERE COALESCE(is_deleted, 0) = 0"
+        ))
+    return True
+
+
+def tokenize(value: str) -> List[str]:
+    """Lowercased, accent-stripped word tokens (close to FTS5's unicode61 tokenizer)."""
+    folded = unicodedata.normalize("NFKD", value.lower())
+    folded = "".join(ch for ch in folded if not unicodedata.combining(ch))
+    return TOKEN_PATTERN.findall(folded)
+
+
+def fts_query(room_pk: int, terms: List[str]) -> str:
+    """All terms must match; the last one as a prefix, so results show up while typing."""
+    quoted = ['"' + term.replace('"', '""') + '"' for term in terms]
+    quoted[-1] += "*"
+    return f'room_id : "{int(room_pk)}" AND content : ({" ".join(quoted)})'
+
+
+class RoomIndex:
+    __slots__ = ("postings", "lengths", "total_length", "max_id")
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {}  # token -> {message id: term frequency}
+        self.lengths: Dict[int, int] = {}  # message id -> number of tokens
+        self.total_length = 0
+        self.max_id = 0  # Highest message id indexed so far
+
+    def add(self, message_id: int, content: str):
+        tokens = tokenize(content or "")
+        for token in tokens:
+            frequencies = self.postings.setdefault(token, {})
+            frequencies[message_id] = frequencies.get(message_id, 0) + 1
+        self.lengths[message_id] = len(tokens)
+        self.total_length += len(tokens)
+        self.max_id = max(self.max_id, message_id)
+
+    def remove(self, message_id: int):
+        # Postings are left behind; lookups skip ids without a length
+        self.total_length -= self.lengths.pop(message_id, 0)
+
+
+class InvertedIndex:
+    """
+    In-process BM25 index, for databases without FTS5.
+
+    Each room is indexed on its first search and then only reads messages from
+    SEARCH_CATCHUP_WINDOW ids below the newest one it saw. Deleted messages are dropped when a search runs
+    into them. At most SEARCH_INDEX_ROOMS rooms are kept (least recently
+    searched evicted).
+    """
+
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, max_rooms: int = SEARCH_INDEX_ROOMS, catchup_window: int = SEARCH_CATCHUP_WINDOW):
+        self.max_rooms = max_rooms
+        self.catchup_window = catchup_window
+        self._rooms: "OrderedDict[int, RoomIndex]" = OrderedDict()
+        self._locks: Dict[int, asyncio.Lock] = {}
+
+    async def room(self, db: AsyncSession, room_pk: int) -> RoomIndex:
+        async with self._locks.setdefault(room_pk, asyncio.Lock()):
+            index = self._rooms.get(room_pk)
+            if index is None:
+                index = RoomIndex()
+                self._rooms[room_pk] = index
+                if len(self._rooms) > self.max_rooms:
+                    self._rooms.popitem(last=False)
+            self._rooms.move_to_end(room_pk)
+            # A write-behind batch may commit after a later id was indexed: look back a window
+            after_id = index.max_id - self.catchup_window if index.max_id else 0
+            # Streamed through a server-side cursor: a room's first indexing may read all of it
+            rows = await db.stream(
+                select(models.Message.id, models.Message.content).where(
+                    models.Message.room_id == room_pk,
+                    models.Message.is_deleted == 0,
+                    models.Message.id > after_id
+                ).order_by(models.Message.id).execution_options(yield_per=STREAM_BATCH_SIZE)
+            )
+            async for message_id, content in rows:
+                if message_id not in index.lengths:
+                    index.add(message_id, content)
+            return index
+
+    def rank(self, index: RoomIndex, terms: List[str]) -> List[Tuple[int, float]]:
+        """(message id, score) of messages containing every term, best first."""
+        documents = len(index.lengths)
+        if not documents:
+            return []
+        average_length = index.total_length / documents
+        scores: Optional[Dict[int, float]] = None
+        for position, term in enumerate(terms):
+            if position == len(terms) - 1:
+                # Prefix match for the last term, like the FTS query
+                tokens = [token for token in index.postings if token.startswith(term)]
+            else:
+                tokens = [term] if term in index.postings else []
+            term_scores: Dict[int, float] = {}
+            for token in tokens:
+                frequencies = index.postings[token]
+                idf = math.log(1 + (documents - len(frequencies) + 0.5) / (len(frequencies) + 0.5))
+                for message_id, frequency in frequencies.items():
+                    length = index.lengths.get(message_id)
+                    if length is None:
+                        continue
+                    norm = frequency + self.K1 * (1 - self.B + self.B * length / average_length)
+                    term_scores[message_id] = term_scores.get(message_id, 0.0) + idf * frequency * (self.K1 + 1) / norm
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {message_id: score + term_scores[message_id] for message_id, score in scores.items() if message_id in term_scores}
+            if not scores:
+                return []
+        return sorted(scores.items(), key=lambda item: (-item[1], -item[0]))
+
+
+def make_snippet(content: str, terms: List[str], width: int = SNIPPET_TOKENS) -> str:
+    """Python version of FTS5 snippet(): a window of words around the first match, matches marked."""
+    words = (content or "").split()
+    if not words:
+        return ""
+
+    def matches(word: str) -> bool:
+        tokens = tokenize(word)
+        return any(token == term or (i == len(terms) - 1 and token.startswith(term))
+                   for token in tokens for i, term in enumerate(terms))
+
+    first = next((i for i, word in enumerate(words) if matches(word)), 0)
+    start = max(0, min(first - width // 3, len(words) - width))
+    window = words[start:start + width]
+    marked = [f"{SNIPPET_OPEN}{word}{SNIPPET_CLOSE}" if matches(word) else word for word in window]
+    return (SNIPPET_ELLIPSIS if start > 0 else "") + " ".join(marked) + (SNIPPET_ELLIPSIS if start + width < len(words) else "")
+
+
+inverted_index = InvertedIndex()
+_fts_available: Optional[bool] = None
+
+
+async def fts_available(db: AsyncSession) -> bool:
+    global _fts_available
+    if _fts_available is None:
+        connection = await db.connection()
+        _fts_available = connection.dialect.name == "sqlite" and (await db.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ))).first() is not None
+        if not _fts_available:
+            print("⚠️ No messages_fts table, searching with the in-process index")
+    return _fts_available
+
+
+async def search_fts(db: AsyncSession, room_pk: int, terms: List[str], limit: int, offset: int) -> List[Tuple[int, float, str]]:
+    rows = await db.execute(text(
+        "SELECT m.id, bm25(messages_fts, 1.0, 0.0) AS score, "
+        "snippet(messages_fts, 0, :open, :close, :ellipsis, :tokens) AS snippet "
+        "FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid "
+        "WHERE messages_fts MATCH :query AND m.is_deleted = 0 "
+        "ORDER BY score LIMIT :limit OFFSET :offset"
+    ), {
+        "open": SNIPPET_OPEN, "close": SNIPPET_CLOSE, "ellipsis": SNIPPET_ELLIPSIS,
+        "tokens": SNIPPET_TOKENS, "query": fts_query(room_pk, terms),
+        "limit": limit, "offset": offset
+    })
+    # bm25() is lower-is-better; report higher-is-better like the fallback
+    return [(message_id, -score, snippet) for message_id, score, snippet in rows]
+
+
+async def search_fallback(db: AsyncSession, room_pk: int, terms: List[str], limit: int, offset: int) -> List[Tuple[int, float, str]]:
+    index = await inverted_index.room(db, room_pk)
+    ranked = inverted_index.rank(index, terms)[offset:offset + limit]
+    if not ranked:
+        return []
+    contents = dict((await db.execute(
+        select(models.Message.id, models.Message.content).where(
+            models.Message.id.in_([message_id for message_id, _ in ranked]),
+            models.Message.is_deleted == 0
+        )
+    )).all())
+    hits = []
+    for message_id, score in ranked:
+        if message_id not in contents:
+            index.remove(message_id)  # Deleted since it was indexed
+            continue
+        hits.append((message_id, score, make_snippet(contents[message_id], terms)))
+    return hits
+
+
+@router.get("/search/{room_id}")
+async def search_messages(
+    room_id: str,
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=MAX_SEARCH_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """
+    Search a room's messages, best match first.
+
+    Every word of q must appear; the last may be a prefix. Pass next_offset
+    back as offset for the next page (None when there are no more results).
+    """
+    started = time.perf_counter()
+    terms = tokenize(q)
+    if not terms:
+        raise HTTPException(status_code=400, detail="Search query has no words")
+
+    room_pk = await db.scalar(select(models.Room.id).where(models.Room.name == room_id))
+    if room_pk is None:
+        return {"results": [], "next_offset": None, "took_ms": 0}
+
+    # Messages still in the write-behind queue must be searchable
+    await message_writer.flush()
+    search = search_fts if await fts_available(db) else search_fallback
+    hits = await search(db, room_pk, terms, limit + 1, offset)
+    has_more = len(hits) > limit
+    hits = hits[:limit]
+
+    rows = (await db.execute(
+        select(models.Message, models.User.username).outerjoin(
+            models.User, models.Message.user_id == models.User.id
+        ).where(models.Message.id.in_([message_id for message_id, _, _ in hits]))
+    )).all()
+    messages = {msg.id: serialize_message(msg, username) for msg, username in rows}
+
+    return {
+        "results": [
+            {**messages[message_id], "score": round(score, 4), "snippet": snippet}
+            for message_id, score, snippet in hits if message_id in messages
+        ],
+        "next_offset": offset + limit if has_more else None,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
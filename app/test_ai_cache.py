@@ -0,0 +1,167 @@
+# app/test_ai_cache.py
+"""
+Test the AI helper's streaming, caching and request coalescing against a local
+stand-in for an OpenAI-compatible server.
+
+The stand-in answers /v1/chat/completions with a slow server-sent-event stream
+(or a plain JSON completion when stream is off) and counts how many completions
+it was asked for. No API key or network access is needed.
+
+Run with: python -m app.test_ai_cache
+"""
+
+from app.testing import run, unique_name
+
+import asyncio
+import json
+
+from openai import AsyncOpenAI
+
+from app import ai_helper
+from app.bot import bot_worker
+from app.persistence import message_writer
+
+ANSWER_TOKENS = ["Photo", "synthesis ", "turns ", "light ", "into ", "sugar."]
+
+
+class StandInOpenAIServer:
+    """Tiny streaming chat-completions server for tests."""
+
+    def __init__(self, token_delay: float = 0.02):
+        self.token_delay = token_delay
+        self.completions = 0
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader, writer):
+        try:
+            head = await reader.readuntil(b"\r\n\r\n")
+            headers = dict(
+                line.split(": ", 1) for line in head.decode().split("\r\n")[1:] if ": " in line
+            )
+            length = int({k.lower(): v for k, v in headers.items()}.get("content-length", 0))
+            body = json.loads(await reader.readexactly(length))
+            self.completions += 1
+
+            if not body.get("stream"):
+                reply = json.dumps({
+                    "id": "chatcmpl-test",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(ANSWER_TOKENS)},
+                        "finish_reason": "stop",
+                    }],
+                }).encode()
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                    b"Content-Length: %d\r\nConnection: close\r\n\r\n%s" % (len(reply), reply)
+                )
+                await writer.drain()
+                return
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+                b"Connection: close\r\n\r\n"
+            )
+            for token in ANSWER_TOKENS:
+                chunk = {
+                    "id": "chatcmpl-test",
+                    "object": "chat.completion.chunk",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                }
+                writer.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                await writer.drain()
+                await asyncio.sleep(self.token_delay)
+            writer.write(b"data: [DONE]\n\n")
+            await writer.drain()
+        finally:
+            writer.close()
+
+
+async def run_ai_cache_check():
+    server = StandInOpenAIServer()
+    port = await server.start()
+    ai_helper.client = AsyncOpenAI(base_url=f"http://127.0.0.1:{port}/v1", api_key="test")
+    ai_helper.response_cache = ai_helper.ResponseCache()
+    try:
+        # Tokens arrive one by one
+        deltas = [delta async for delta in ai_helper.stream_answer("Explain photosynthesis")]
+        assert deltas == ANSWER_TOKENS
+        assert server.completions == 1
+
+        # The same question, differently typed, is served from the cache
+        assert await ai_helper.answer("  explain   PHOTOSYNTHESIS? ") == "".join(ANSWER_TOKENS)
+        assert server.completions == 1
+
+        # Twenty students asking a new question at once share one upstream call
+        answers = await asyncio.gather(*[ai_helper.answer("@bot what is osmosis") for _ in range(20)])
+        assert all(reply == "".join(ANSWER_TOKENS) for reply in answers)
+        assert server.completions == 2
+        assert not ai_helper._inflight
+    finally:
+        await ai_helper.client.close()
+        ai_helper.client = None
+        await server.stop()
+
+
+async def say(room: str, username: str, content: str):
+    await message_writer.submit({
+        "id": await message_writer.allocate_id(), "username": username, "room": room, "content": content
+    })
+
+
+async def run_room_context_check():
+    room = unique_name("biology")
+    await say(room, "alice", "Osmosis moves water across a membrane")
+    await say(room, "bob", "@bot what is osmosis")
+    context, key = await bot_worker.room_context(room)
+    assert "membrane" in context and "@bot" not in context
+
+    # Another student asking the same (and the bot's reply) leave the cache key alone
+    await say(room, "carol", "@bot what is osmosis")
+    await say(room, "AI Assistant", "Osmosis is ...")
+    assert await bot_worker.room_context(room) == (context, key)
+
+    # New discussion is new context
+    await say(room, "alice", "And diffusion?")
+    assert (await bot_worker.room_context(room))[1] != key
+
+    server = StandInOpenAIServer(token_delay=0)
+    port = await server.start()
+    ai_helper.client = AsyncOpenAI(base_url=f"http://127.0.0.1:{port}/v1", api_key="test")
+    try:
+        # The key, not the context text, decides what is shared
+        await ai_helper.answer("what is osmosis", context=context, context_key=key)
+        await ai_helper.answer("what is osmosis", context=context + "\nmore", context_key=key)
+        assert server.completions == 1
+    finally:
+        await ai_helper.client.close()
+        ai_helper.client = None
+        await server.stop()
+
+
+def test_ai_cache():
+    asyncio.run(run_ai_cache_check())
+
+
+def test_room_context_key():
+    run(run_room_context_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing AI helper streaming and caching against a stand-in server...")
+    test_ai_cache()
+    test_room_context_key()
+    print("✅ AI helper test passed")
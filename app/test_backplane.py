@@ -0,0 +1,237 @@
+# app/test_backplane.py
+"""
+Test the Redis-protocol backplane against a local stand-in server.
+
+The stand-in speaks just enough RESP (PUBLISH/SUBSCRIBE, hashes, SET EX, MGET,
+DEL) for two RedisBackplane instances - standing in for two uvicorn workers -
+to exchange room events and presence. No real Redis is needed. Publishing
+only queues: events arrive in order, and a hung server never holds up a
+broadcast.
+
+Run with: python -m app.test_backplane
+"""
+
+import asyncio
+import socket
+
+from app import backplane
+from app.backplane import RedisBackplane, RespConnection
+
+
+class StandInRespServer:
+    """Tiny in-memory Redis-protocol server for tests."""
+
+    def __init__(self):
+        self.strings = {}
+        self.hashes = {}
+        self.subscribers = {}  # channel -> set of writers
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    @staticmethod
+    def _encode(value) -> bytes:
+        if value is None:
+            return b"$-1\r\n"
+        if isinstance(value, int):
+            return b":%d\r\n" % value
+        if isinstance(value, list):
+            return b"*%d\r\n" % len(value) + b"".join(StandInRespServer._encode(v) for v in value)
+        data = value.encode()
+        return b"$%d\r\n%s\r\n" % (len(data), data)
+
+    async def _handle(self, reader, writer):
+        parser = RespConnection("", 0)
+        parser.reader = reader
+        try:
+            while True:
+                command, *args = await parser.read_reply()
+                reply = self._execute(command.upper(), args, writer)
+                if reply is not None:
+                    writer.write(reply)
+                    await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for writers in self.subscribers.values():
+                writers.discard(writer)
+            writer.close()
+
+    def _execute(self, command, args, writer):
+        if command in ("AUTH", "SELECT", "PING"):
+            return b"+OK\r\n"
+        if command == "SET":
+            self.strings[args[0]] = args[1]
+            return b"+OK\r\n"
+        if command == "MGET":
+            return self._encode([self.strings.get(key) for key in args])
+        if command == "DEL":
+            removed = sum(1 for key in args if self.strings.pop(key, None) is not None or self.hashes.pop(key, None) is not None)
+            return self._encode(removed)
+        if command == "HSET":
+            self.hashes.setdefault(args[0], {})[args[1]] = args[2]
+            return self._encode(1)
+        if command == "HDEL":
+            return self._encode(1 if self.hashes.get(args[0], {}).pop(args[1], None) is not None else 0)
+        if command == "HGETALL":
+            flat = []
+            for field, value in self.hashes.get(args[0], {}).items():
+                flat += [field, value]
+            return self._encode(flat)
+        if command == "SUBSCRIBE":
+            self.subscribers.setdefault(args[0], set()).add(writer)
+            return self._encode(["subscribe", args[0], 1])
+        if command == "PUBLISH":
+            writers = self.subscribers.get(args[0], set())
+            for subscriber in writers:
+                subscriber.write(self._encode(["message", args[0], args[1]]))
+            return self._encode(len(writers))
+        return b"-ERR unknown command\r\n"
+
+
+async def run_backplane_check():
+    server = StandInRespServer()
+    port = await server.start()
+    url = f"redis://127.0.0.1:{port}/0"
+
+    received = {"a": [], "b": []}
+
+    def collector(name):
+        async def deliver(room_id, message_type, key, frame):
+            received[name].append((room_id, message_type, frame))
+        return deliver
+
+    worker_a, worker_b = RedisBackplane(url), RedisBackplane(url)
+    await worker_a.start(collector("a"))
+    await worker_b.start(collector("b"))
+    try:
+        # Events cross workers, and a worker does not receive its own events
+        await worker_a.publish("physics", "chat", None, '{"type": "chat", "message": "hi"}')
+        await asyncio.sleep(0.1)
+        assert received["b"] == [("physics", "chat", '{"type": "chat", "message": "hi"}')]
+        assert received["a"] == []
+
+        # Presence is the union of live workers
+        await worker_a.sync_presence("physics", ["alice"])
+        await worker_b.sync_presence("physics", ["bob"])
+        assert await worker_a.room_users("physics", ["alice"]) == ["alice", "bob"]
+        assert await worker_b.room_users("physics", ["bob"]) == ["bob", "alice"]
+
+        # A worker whose heartbeat expired no longer counts
+        del server.strings[RedisBackplane.worker_key(worker_b.worker_id)]
+        assert await worker_a.room_users("physics", ["alice"]) == ["alice"]
+    finally:
+        await worker_a.stop()
+        await worker_b.stop()
+        await server.stop()
+
+    # A stopped worker removes its presence right away
+    assert worker_a.worker_id not in server.hashes.get(RedisBackplane.presence_key("physics"), {})
+
+
+async def run_unreachable_check():
+    """A hung or missing server costs a broadcast one timeout, then nothing until the backoff ends."""
+    async def never_reply(reader, writer):
+        await reader.read()
+    hung = await asyncio.start_server(never_reply, "127.0.0.1", 0)
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        closed_port = probe.getsockname()[1]  # Nothing listens here once the probe is closed
+
+    timeout, backoff = backplane.BACKPLANE_TIMEOUT_SECONDS, backplane.BACKPLANE_BACKOFF_SECONDS
+    backplane.BACKPLANE_TIMEOUT_SECONDS, backplane.BACKPLANE_BACKOFF_SECONDS = 0.2, 60
+    loop = asyncio.get_running_loop()
+    try:
+        for port in (hung.sockets[0].getsockname()[1], closed_port):
+            worker = RedisBackplane(f"redis://127.0.0.1:{port}/0")
+            started = loop.time()
+            await worker.start(lambda *args: None)  # Must not raise
+            assert loop.time() - started < 1
+            try:
+                started = loop.time()
+                for _ in range(20):
+                    await worker.publish("physics", "chat", None, "{}")
+                    await worker.sync_presence("physics", ["alice"])
+                assert await worker.room_users("physics", ["alice"]) == ["alice"]
+                assert loop.time() - started < 0.5
+            finally:
+                await worker.stop()
+    finally:
+        backplane.BACKPLANE_TIMEOUT_SECONDS, backplane.BACKPLANE_BACKOFF_SECONDS = timeout, backoff
+        hung.close()
+
+
+async def run_publish_queue_check():
+    server = StandInRespServer()
+    port = await server.start()
+    url = f"redis://127.0.0.1:{port}/0"
+    received = []
+
+    async def deliver(room_id, message_type, key, frame):
+        received.append(frame)
+
+    sender, listener = RedisBackplane(url), RedisBackplane(url)
+    await sender.start(lambda *args: None)
+    await listener.start(deliver)
+    try:
+        # A burst goes out in order, pipelined instead of one round trip each
+        for number in range(300):
+            await sender.publish("physics", "chat", None, str(number))
+        for _ in range(100):
+            if len(received) == 300 and sender.published == 300:
+                break
+            await asyncio.sleep(0.02)
+        assert received == [str(number) for number in range(300)]
+        assert sender.stats() == {"publish_queue": 0, "published": 300, "publish_dropped": 0}
+    finally:
+        await listener.stop()
+        await sender.stop()
+        await server.stop()
+
+    # A server that accepts but never answers: publish still returns at once (it only
+    # queues), and a full outbox drops its oldest events
+    async def never_reply(reader, writer):
+        await reader.read()
+    hung = await asyncio.start_server(never_reply, "127.0.0.1", 0)
+    timeout, queue_size = backplane.BACKPLANE_TIMEOUT_SECONDS, backplane.PUBLISH_QUEUE_SIZE
+    backplane.BACKPLANE_TIMEOUT_SECONDS, backplane.PUBLISH_QUEUE_SIZE = 0.3, 50
+    loop = asyncio.get_running_loop()
+    worker = RedisBackplane(f"redis://127.0.0.1:{hung.sockets[0].getsockname()[1]}/0")
+    try:
+        await worker.start(lambda *args: None)
+        started = loop.time()
+        for number in range(80):
+            await worker.publish("physics", "chat", None, str(number))
+        assert loop.time() - started < 0.05
+        assert worker.stats()["publish_queue"] == 50 and worker.publish_dropped == 30
+    finally:
+        await worker.stop()
+        backplane.BACKPLANE_TIMEOUT_SECONDS, backplane.PUBLISH_QUEUE_SIZE = timeout, queue_size
+        hung.close()
+    assert worker.stats()["publish_queue"] == 0  # Handed over (and lost, the server being down) on stop
+
+
+def test_redis_backplane():
+    asyncio.run(run_backplane_check())
+
+
+def test_unreachable_backplane():
+    asyncio.run(run_unreachable_check())
+
+
+def test_publish_queue():
+    asyncio.run(run_publish_queue_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing Redis backplane against a stand-in server...")
+    test_redis_backplane()
+    test_unreachable_backplane()
+    test_publish_queue()
+    print("✅ Backplane test passed")
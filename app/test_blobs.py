@@ -0,0 +1,121 @@
+# app/test_blobs.py
+"""
+Test the content-addressed upload store: the same bytes uploaded twice are
+stored once under one URL, a blob's ref_count follows the chat messages that
+point at it as they are sent and deleted, and garbage collection removes only
+unreferenced blobs whose grace period is over.
+
+Run with: python -m app.test_blobs
+"""
+
+from app.testing import run, unique_name
+
+import datetime
+import hashlib
+import os
+import time
+
+from fastapi.testclient import TestClient
+from sqlalchemy import select, update
+
+from app import files, models
+from app.database import SessionLocal
+from app.files import UPLOAD_DIR, collect_garbage
+from app.main import app
+
+
+def upload(client: TestClient, data: bytes, filename: str, username: str) -> dict:
+    response = client.post(
+        "/upload", files={"file": (filename, data, "application/octet-stream")},
+        data={"room": unique_name("physics"), "username": username}
+    )
+    assert response.status_code == 200
+    return response.json()
+
+
+def blob_row(sha256: str):
+    with SessionLocal() as db:
+        return db.get(models.FileBlob, sha256)
+
+
+def wait_until(condition, timeout: float = 3):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.02)
+
+
+def receive_until(websocket, message_type: str) -> dict:
+    while True:
+        message = websocket.receive_json()
+        if message.get("type") == message_type:
+            return message
+
+
+def test_dedup_and_refs():
+    data = os.urandom(2000)
+    sha256 = hashlib.sha256(data).hexdigest()
+    room, alice = unique_name("physics"), unique_name("alice")
+    with TestClient(app) as client:
+        first = upload(client, data, "notes.bin", alice)
+        second = upload(client, data, "copy of notes.bin", unique_name("bob"))
+        # Stored once, under the hash, and both uploads get the same URL
+        assert first["file_url"] == second["file_url"] and first["file_url"].endswith(f"/{sha256}.bin")
+        assert [name for name in os.listdir(UPLOAD_DIR) if name.startswith(sha256)] == [f"{sha256}.bin"]
+        assert blob_row(sha256).ref_count == 0  # Uploaded, not yet sent
+
+        with client.websocket_connect(f"/chat/ws/{room}?username={alice}") as websocket:  # First in: room admin
+            sent = []
+            for text in ("look", "again"):
+                websocket.send_json({
+                    "type": "chat", "username": alice, "message": text,
+                    "file_url": first["file_url"], "filename": "notes.bin", "file_size": len(data)
+                })
+                sent.append(receive_until(websocket, "chat")["id"])
+            wait_until(lambda: blob_row(sha256).ref_count == 2)  # Written with the messages
+
+            websocket.send_json({"type": "delete_message", "username": alice, "message_id": sent[0]})
+            receive_until(websocket, "message_deleted")
+            assert blob_row(sha256).ref_count == 1
+
+
+async def run_gc_check():
+    now = datetime.datetime.utcnow()
+    old = now - datetime.timedelta(seconds=files.UPLOAD_GC_GRACE_SECONDS + 60)
+    blobs = {}
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    with SessionLocal() as db:
+        for case, ref_count, uploaded_at in (("expired", 0, old), ("recent", 0, now), ("referenced", 1, old)):
+            sha256 = hashlib.sha256(os.urandom(32)).hexdigest()
+            name = f"{sha256}.txt"
+            (UPLOAD_DIR / name).write_text(case)
+            db.add(models.FileBlob(sha256=sha256, stored_name=name, size=len(case), ref_count=ref_count, last_uploaded_at=uploaded_at))
+            blobs[case] = (sha256, name)
+        db.commit()
+
+    assert await collect_garbage() >= 1
+    with SessionLocal() as db:
+        remaining = set(db.scalars(select(models.FileBlob.sha256).where(
+            models.FileBlob.sha256.in_([sha256 for sha256, _ in blobs.values()])
+        )))
+    assert remaining == {blobs["recent"][0], blobs["referenced"][0]}
+    assert not (UPLOAD_DIR / blobs["expired"][1]).exists()
+    assert (UPLOAD_DIR / blobs["recent"][1]).exists() and (UPLOAD_DIR / blobs["referenced"][1]).exists()
+
+    # Once the last message lets go and the grace period passes, it goes too
+    with SessionLocal() as db:
+        db.execute(update(models.FileBlob).where(models.FileBlob.sha256 == blobs["referenced"][0]).values(ref_count=0))
+        db.commit()
+    await collect_garbage()
+    assert not (UPLOAD_DIR / blobs["referenced"][1]).exists()
+
+
+def test_garbage_collection():
+    run(run_gc_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing the content-addressed upload store...")
+    test_dedup_and_refs()
+    test_garbage_collection()
+    print("✅ Upload store tests passed")
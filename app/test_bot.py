@@ -0,0 +1,70 @@
+# app/test_bot.py
+"""
+Test the @bot worker's failure path: when no answer can be produced, the room
+gets a final ai_stream frame (done, error) that clears its drafts, only the
+asker gets the reason, and nothing is written as a chat message.
+
+Run with: python -m app.test_bot
+"""
+
+from app.testing import run, unique_name
+
+from sqlalchemy import func, select
+
+from app import bot, models
+from app.ai_helper import AINotConfigured
+from app.bot import BOT_USERNAME, BotWorker
+from app.database import AsyncReadSessionLocal
+from app.persistence import message_writer
+
+
+async def not_configured(question, **options):
+    raise AINotConfigured()
+    yield
+
+
+async def fails_midway(question, **options):
+    yield "Newton's first"
+    raise RuntimeError("Upstream closed the stream")
+
+
+async def run_failure_check():
+    room = unique_name("physics")
+    for stream, reason in ((not_configured, "not configured"), (fails_midway, "trouble")):
+        broadcasts, notified = [], []
+
+        async def broadcast(message, room_id):
+            broadcasts.append((room_id, message))
+
+        async def notify(message):
+            notified.append(message)
+
+        worker = BotWorker()
+        worker.broadcast = broadcast
+        default_stream, bot.stream_answer = bot.stream_answer, stream
+        try:
+            await worker._answer(room, "alice", "what is inertia?", "r1", notify)
+        finally:
+            bot.stream_answer = default_stream
+
+        room_id, last = broadcasts[-1]
+        assert room_id == room and last["type"] == "ai_stream" and last["done"] and last["error"]
+        assert last["request_id"] == "r1"
+        assert all(message["type"] == "ai_stream" for _, message in broadcasts)  # No chat message
+        assert len(notified) == 1 and notified[0]["type"] == "error" and reason in notified[0]["message"]
+
+    assert not any(record["username"] == BOT_USERNAME for record in message_writer.pending)
+    await message_writer.flush()
+    async with AsyncReadSessionLocal() as db:
+        stored = await db.scalar(select(func.count()).select_from(models.Message).join(models.Room).where(models.Room.name == room))
+    assert stored == 0
+
+
+def test_failure_is_not_stored():
+    run(run_failure_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing the @bot worker...")
+    test_failure_is_not_stored()
+    print("✅ Bot tests passed")
@@ -0,0 +1,130 @@
+# app/test_broadcast.py
+"""
+Test per-connection writers with a slow consumer: typing and presence frames
+are coalesced to the newest one per key, a queue full of chat frames gets the
+client disconnected with 1013 instead of losing any of them, and a send that
+never completes drops the client after the timeout.
+
+Run with: python -m app.test_broadcast
+"""
+
+import asyncio
+import json
+
+from app import broadcast
+from app.broadcast import SLOW_CONSUMER_CLOSE_CODE, ConnectionWriter, coalesce_key
+
+
+class SlowSocket:
+    """A WebSocket whose sends wait until the test lets them through."""
+
+    def __init__(self):
+        self.sent = []
+        self.close_codes = []
+        self.ready = asyncio.Event()
+
+    async def send_text(self, frame: str):
+        await self.ready.wait()
+        self.sent.append(json.loads(frame))
+
+    async def close(self, code: int = 1000):
+        self.close_codes.append(code)
+
+
+def enqueue(writer: ConnectionWriter, message: dict) -> bool:
+    return writer.enqueue(json.dumps(message), coalesce_key(message))
+
+
+def chat(number: int) -> dict:
+    return {"type": "message", "id": number, "content": f"note {number}"}
+
+
+def typing(username: str, message_type: str = "typing") -> dict:
+    return {"type": message_type, "username": username}
+
+
+async def settle():
+    for _ in range(20):
+        await asyncio.sleep(0)
+
+
+async def run_coalesce_check():
+    socket, dead = SlowSocket(), []
+    writer = ConnectionWriter(socket, dead.append, max_queue=4, policy="coalesce")
+    enqueue(writer, chat(0))
+    await settle()  # The writer is now stuck sending chat 0
+
+    enqueue(writer, chat(1))
+    for _ in range(5):
+        assert enqueue(writer, typing("alice"))
+    enqueue(writer, typing("bob"))
+    enqueue(writer, chat(2))
+    # Full: alice's newest typing frame replaces her older ones
+    assert enqueue(writer, typing("alice", "stop_typing"))
+    # A chat frame pushes out the oldest ephemeral one rather than another chat frame
+    assert enqueue(writer, chat(3))
+    assert len(writer.queue) == 4 and not dead
+
+    socket.ready.set()
+    while writer.queue:
+        await asyncio.sleep(0.01)
+    await settle()
+    assert socket.sent == [chat(0), chat(1), chat(2), typing("alice", "stop_typing"), chat(3)]
+    assert not dead and not socket.close_codes
+    writer.close()
+
+
+def test_coalesce():
+    asyncio.run(run_coalesce_check())
+
+
+async def run_chat_overflow_check():
+    for policy in ("coalesce", "drop"):
+        socket, dead = SlowSocket(), []
+        writer = ConnectionWriter(socket, dead.append, max_queue=3, policy=policy)
+        for number in range(4):  # One in flight, three queued
+            assert enqueue(writer, chat(number))
+            await settle()
+        # No ephemeral frame to give up: the client is disconnected, not a message lost
+        assert not enqueue(writer, chat(4))
+        await settle()
+        assert dead == [writer] and writer.closed
+        assert socket.close_codes == [SLOW_CONSUMER_CLOSE_CODE]
+        assert not enqueue(writer, chat(5))
+
+    # With "drop" even a typing frame on a full queue disconnects
+    socket, dead = SlowSocket(), []
+    writer = ConnectionWriter(socket, dead.append, max_queue=1, policy="drop")
+    enqueue(writer, typing("alice"))
+    await settle()
+    enqueue(writer, typing("alice"))
+    assert not enqueue(writer, typing("alice"))
+    assert dead == [writer]
+
+
+def test_chat_overflow():
+    asyncio.run(run_chat_overflow_check())
+
+
+async def run_send_timeout_check():
+    default_timeout, broadcast.SEND_TIMEOUT_SECONDS = broadcast.SEND_TIMEOUT_SECONDS, 0.05
+    try:
+        socket, dead = SlowSocket(), []
+        writer = ConnectionWriter(socket, dead.append, max_queue=8)
+        enqueue(writer, chat(0))
+        await asyncio.sleep(0.2)
+        assert dead == [writer] and socket.close_codes == [SLOW_CONSUMER_CLOSE_CODE]
+    finally:
+        broadcast.SEND_TIMEOUT_SECONDS = default_timeout
+
+
+def test_send_timeout():
+    asyncio.run(run_send_timeout_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing connection writers...")
+    test_coalesce()
+    test_chat_overflow()
+    test_send_timeout()
+    print("✅ Broadcast tests passed")
@@ -0,0 +1,61 @@
+# app/test_codec.py
+"""
+Test the chat wire codec: text and binary frames decode the same, missing or
+wrongly typed fields fall back to defaults, non-objects are rejected, and
+mentions and non-ASCII text survive a round trip. The throughput comparison
+lives in app/bench_codec.py.
+
+Run with: python -m app.test_codec
+"""
+
+import json
+
+from app.codec import JSONDecodeError, decode_frame, encode_frame, extract_mentions
+
+SAMPLE_FRAMES = [
+    json.dumps({"type": "chat", "username": "alice", "message": "hey @bob did you finish the lab report?"}),
+    json.dumps({"type": "chat", "username": "bob", "message": "almost, @alice @carol can you check section 3 ✅"}),
+    json.dumps({
+        "type": "chat", "username": "carol", "message": "notes attached",
+        "file_url": "http://localhost:8000/uploads/" + "a" * 64 + ".pdf",
+        "filename": "notes.pdf", "file_type": "application/pdf", "file_size": 183422
+    }),
+    json.dumps({"type": "typing", "username": "dave"}),
+]
+
+
+def test_codec():
+    # Text and binary frames decode the same
+    for raw in SAMPLE_FRAMES:
+        text_frame = decode_frame(raw, "anon")
+        bytes_frame = decode_frame(raw.encode(), "anon")
+        for field in text_frame.__slots__:
+            assert getattr(text_frame, field) == getattr(bytes_frame, field)
+
+    frame = decode_frame(SAMPLE_FRAMES[2], "anon")
+    assert frame.type == "chat" and frame.username == "carol"
+    assert frame.has_file and frame.file_size == 183422
+
+    # Defaults and wrongly typed fields
+    frame = decode_frame(b'{"message": 5, "file_size": "big"}', "anon")
+    assert frame.type == "chat" and frame.username == "anon" and frame.message == ""
+    assert not frame.has_file and frame.file_size is None
+
+    # Anything but a JSON object is plain text to the chat handler
+    for raw in ("hello there", "42", b"[1, 2]", b""):
+        try:
+            decode_frame(raw, "anon")
+            assert False, f"{raw!r} should not decode"
+        except JSONDecodeError:
+            pass
+
+    assert extract_mentions("@bob hi @alice and @bob again") == ["bob", "alice"]
+
+    message = {"type": "chat", "username": "élodie", "message": "ça va? 👋", "mentions": [], "id": 7}
+    assert json.loads(encode_frame(message)) == message
+
+
+if __name__ == "__main__":
+    print("🧪 Testing chat wire codec...")
+    test_codec()
+    print("✅ Codec test passed")
@@ -0,0 +1,83 @@
+# app/test_database.py
+"""
+Test how the database settings are derived from DATABASE_URL: the sync and
+asyncio drivers picked for each URL form, and the pool and read-only options
+per backend. On SQLite, also check that every engine's connections really run
+with the storage profile (WAL, synchronous=NORMAL, busy_timeout) and that the
+read pool refuses writes.
+
+Run with: python -m app.test_database
+"""
+
+from app.testing import run
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+from app.database import (
+    DB_POOL_RECYCLE_SECONDS, SQLITE_PRAGMAS, async_database_url, async_engine, engine, pool_options,
+    read_engine, read_execution_options, sync_database_url
+)
+
+# DATABASE_URL as given -> (sync engine URL, async engine URL)
+URLS = {
+    "sqlite:///./studychat.db": ("sqlite:///./studychat.db", "sqlite+aiosqlite:///./studychat.db"),
+    "sqlite+aiosqlite:///./studychat.db": ("sqlite:///./studychat.db", "sqlite+aiosqlite:///./studychat.db"),
+    "postgres://chat:secret@db/chat": ("postgresql+psycopg://chat:secret@db/chat", "postgresql+asyncpg://chat:secret@db/chat"),
+    "postgresql://chat@db:5433/chat": ("postgresql+psycopg://chat@db:5433/chat", "postgresql+asyncpg://chat@db:5433/chat"),
+    "postgresql+asyncpg://chat@db/chat": ("postgresql+psycopg://chat@db/chat", "postgresql+asyncpg://chat@db/chat"),
+    "postgresql+psycopg_async://chat@db/chat": ("postgresql+psycopg://chat@db/chat", "postgresql+asyncpg://chat@db/chat"),
+    # An explicitly chosen sync driver is kept
+    "postgresql+psycopg2://chat@db/chat": ("postgresql+psycopg2://chat@db/chat", "postgresql+asyncpg://chat@db/chat"),
+}
+
+
+def test_database_urls():
+    for url, (sync_url, async_url) in URLS.items():
+        assert sync_database_url(url) == sync_url, url
+        assert async_database_url(sync_database_url(url)) == async_url, url
+
+
+def test_engine_options():
+    sqlite_options = pool_options(7, "sqlite:///./studychat.db")
+    assert sqlite_options["pool_size"] == 7
+    assert "pool_pre_ping" not in sqlite_options and "pool_recycle" not in sqlite_options
+    postgres_options = pool_options(7, "postgresql+psycopg://chat@db/chat")
+    assert postgres_options["pool_pre_ping"] and postgres_options["pool_recycle"] == DB_POOL_RECYCLE_SECONDS
+
+    assert read_execution_options("sqlite:///./studychat.db") == {}
+    assert read_execution_options("postgresql+psycopg://chat@db/chat") == {"postgresql_readonly": True}
+
+
+def pragmas(connection) -> dict:
+    return {
+        name: connection.execute(text(f"PRAGMA {name}")).scalar()
+        for name in ("journal_mode", "synchronous", "busy_timeout", "query_only")
+    }
+
+
+async def run_storage_profile_check():
+    profile = {"journal_mode": "wal", "synchronous": 1, "busy_timeout": SQLITE_PRAGMAS["busy_timeout"]}
+    with engine.connect() as connection:
+        assert pragmas(connection) == {**profile, "query_only": 0}
+    async with async_engine.connect() as connection:
+        assert await connection.run_sync(pragmas) == {**profile, "query_only": 0}
+    async with read_engine.connect() as connection:
+        assert await connection.run_sync(pragmas) == {**profile, "query_only": 1}
+        with pytest.raises(OperationalError):
+            await connection.execute(text("CREATE TABLE read_pool_write (id INTEGER)"))
+
+
+def test_storage_profile():
+    if engine.dialect.name != "sqlite":
+        pytest.skip("SQLite pragmas only")
+    run(run_storage_profile_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing database settings...")
+    test_database_urls()
+    test_engine_options()
+    test_storage_profile()
+    print("✅ Database settings tests passed")
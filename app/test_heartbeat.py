@@ -0,0 +1,91 @@
+# app/test_heartbeat.py
+"""
+Test heartbeats: a quiet connection is pinged after the interval and reaped
+after the timeout, one that sends anything (or answers the ping) is kept, and
+a reaped chat socket is closed with 1001 and forgotten by the manager.
+
+Run with: python -m app.test_heartbeat
+"""
+
+from app.testing import unique_name
+
+import asyncio
+
+from fastapi.testclient import TestClient
+from starlette.websockets import WebSocketDisconnect
+
+from app.chat import HEARTBEAT_CLOSE_CODE, manager
+from app.heartbeat import HeartbeatMonitor, TimerWheel
+from app.main import app
+
+
+def test_timer_wheel():
+    wheel = TimerWheel(tick=1, slots=5)
+    wheel.schedule("a", 1)
+    wheel.schedule("b", 2.5)  # Rounded up to 3 ticks
+    wheel.schedule("c", 100)  # Capped at a revolution
+    wheel.schedule("d", 1)
+    wheel.cancel("d")
+    assert [wheel.advance() for _ in range(4)] == [["a"], [], ["b"], ["c"]]
+    assert len(wheel) == 0
+
+
+async def run_monitor_check():
+    pinged, reaped = [], []
+
+    async def ping(connection):
+        pinged.append(connection)
+        if connection == "answers":
+            monitor.touch(connection)  # Replies with a pong
+
+    async def reap(connection):
+        reaped.append(connection)
+
+    monitor = HeartbeatMonitor(interval=0.1, timeout=0.25, tick=0.01)
+    await monitor.start(ping, reap)
+    try:
+        for connection in ("quiet", "chatty", "answers", "leaves"):
+            monitor.track(connection)
+        monitor.untrack("leaves")
+        for _ in range(20):
+            monitor.touch("chatty")
+            await asyncio.sleep(0.02)
+    finally:
+        await monitor.stop()
+
+    assert pinged.count("quiet") == 1 and reaped == ["quiet"]
+    assert "chatty" not in pinged
+    assert "answers" in pinged  # Pinged, answered, so never reaped
+    assert "leaves" not in pinged
+    assert monitor.stats()["tracked"] == 2
+
+
+def test_heartbeat_monitor():
+    asyncio.run(run_monitor_check())
+
+
+def test_silent_socket_is_reaped():
+    default_monitor = manager.heartbeat
+    manager.heartbeat = HeartbeatMonitor(interval=0.1, timeout=0.3, tick=0.02)
+    try:
+        with TestClient(app) as client:
+            with client.websocket_connect(f"/chat/ws/{unique_name('physics')}?username=frank") as websocket:
+                frames = []
+                try:
+                    while True:
+                        frames.append(websocket.receive_json())
+                except WebSocketDisconnect as closed:
+                    assert closed.code == HEARTBEAT_CLOSE_CODE
+                assert {"type": "ping"} in frames
+            assert manager.heartbeat.stats()["reaped_idle"] == 1
+            assert not manager.connection_info and not manager.writers
+    finally:
+        manager.heartbeat = default_monitor
+
+
+if __name__ == "__main__":
+    print("🧪 Testing heartbeats...")
+    test_timer_wheel()
+    test_heartbeat_monitor()
+    test_silent_socket_is_reaped()
+    print("✅ Heartbeat tests passed")
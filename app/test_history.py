@@ -0,0 +1,116 @@
+# app/test_history.py
+"""
+Test chat history read from the database rather than the history buffer:
+/chat/history pages backwards through before_id without gaps, repeats or
+deleted messages, and a reconnect's since_id resync gives the same answer on
+either side of where the buffer stops.
+
+Run with: python -m app.test_history
+"""
+
+from app.testing import run, unique_name
+
+import json
+
+from fastapi.testclient import TestClient
+from sqlalchemy import update
+
+from app import models
+from app.chat import JOIN_HISTORY_LIMIT, get_join_history, manager
+from app.database import AsyncReadSessionLocal, SessionLocal
+from app.main import app
+from app.persistence import message_writer
+
+MESSAGES = 260  # More than the buffer keeps for a room
+
+
+async def post_messages(room: str, ids: list, count: int):
+    for number in range(count):
+        message_id = await message_writer.allocate_id()
+        ids.append(message_id)
+        await message_writer.submit({"id": message_id, "username": "bob", "room": room, "content": f"note {number}"})
+    await message_writer.flush()
+
+
+def delete_messages(message_ids: list):
+    with SessionLocal() as db:
+        db.execute(update(models.Message).where(models.Message.id.in_(message_ids)).values(is_deleted=1))
+        db.commit()
+
+
+def page_through(client: TestClient, room: str, limit: int, before_id=None) -> list:
+    """Every page from before_id back to the start of the room, newest page first."""
+    pages = []
+    while True:
+        params = {"limit": limit} if before_id is None else {"limit": limit, "before_id": before_id}
+        page = client.get(f"/chat/history/{room}", params=params).json()
+        ids = [message["id"] for message in page["messages"]]
+        assert ids == sorted(ids)  # Oldest first within a page
+        pages.append(ids)
+        if not page["has_more"]:
+            assert page["next_before_id"] is None
+            return pages
+        assert page["next_before_id"] == ids[0]
+        before_id = page["next_before_id"]
+
+
+def test_keyset_paging():
+    room = unique_name("physics")
+    ids = []
+    run(post_messages(room, ids, MESSAGES))
+    deleted = ids[5:8] + [ids[-1]]
+    delete_messages(deleted)
+    kept = [message_id for message_id in ids if message_id not in deleted]
+
+    with TestClient(app) as client:
+        # Nobody joined, so the buffer isn't seeded and every page is a database read
+        assert manager.history.page(room, None, 30) is None
+        pages = page_through(client, room, 30)
+        assert manager.history.page(room, None, 30) is None
+        assert [len(page) for page in pages] == [30] * 8 + [len(kept) - 240]
+        assert [message_id for page in reversed(pages) for message_id in page] == kept
+
+        # A cursor between pages, on a deleted id, and past the oldest message
+        for before_id, limit in ((ids[100], 50), (ids[6], 4)):
+            older = [message_id for message_id in kept if message_id < before_id]
+            assert page_through(client, room, limit, before_id)[0] == older[-limit:]
+        assert page_through(client, room, 10, before_id=ids[0]) == [[]]
+        assert client.get(f"/chat/history/{unique_name('nowhere')}").json()["messages"] == []
+
+
+async def run_resync_check():
+    room = unique_name("physics")
+    ids = []
+    await post_messages(room, ids, MESSAGES)
+    async with AsyncReadSessionLocal() as db:
+        await get_join_history(room, db)  # Seeds the buffer with the newest messages
+        deleted = [ids[-3], ids[-150]]
+        delete_messages(deleted)
+        for message_id in deleted:
+            manager.history.remove(room, message_id)
+        kept = [message_id for message_id in ids if message_id not in deleted]
+
+        sources = set()
+        for since_id in ids[-215:-185] + ids[-4:]:
+            sources.add("buffer" if manager.history.since(room, since_id, JOIN_HISTORY_LIMIT) else "database")
+            joined = await get_join_history(room, db, since_id)
+            missed = [message_id for message_id in kept if message_id > since_id]
+            frames = [json.loads(frame)["id"] for frame in joined["frames"]]
+            if len(missed) > JOIN_HISTORY_LIMIT:
+                # Too far behind: the client replaces its view and pages back from there
+                expected = (missed[-JOIN_HISTORY_LIMIT:], "replace", True, missed[-JOIN_HISTORY_LIMIT])
+            else:
+                expected = (missed, "append", False, None)
+            assert (frames, joined["mode"], joined["has_more"], joined["next_before_id"]) == expected, since_id
+        assert sources == {"buffer", "database"}  # Both sides of the boundary were exercised
+
+
+def test_since_id_resync():
+    run(run_resync_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing chat history...")
+    test_keyset_paging()
+    test_since_id_resync()
+    print("✅ Chat history tests passed")
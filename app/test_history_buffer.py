@@ -0,0 +1,124 @@
+# app/test_history_buffer.py
+"""
+Test the per-room history buffer: before_id pages and since_id deltas served
+from memory match what the database returns, the buffer declines what it
+doesn't fully hold, and new messages, deletions and the memory budget keep it
+current.
+
+Run with: python -m app.test_history_buffer
+"""
+
+from app.testing import run, unique_name
+
+import json
+
+from app.chat import fetch_history_page, fetch_history_since, get_join_history, manager
+from app.database import AsyncReadSessionLocal
+from app.history_buffer import HistoryBuffer
+from app.persistence import message_writer
+
+
+def frame(message_id: int) -> str:
+    return json.dumps({"id": message_id})
+
+
+def ids_of(frames) -> list:
+    return [json.loads(frame)["id"] for frame in frames]
+
+
+def test_paging():
+    history = HistoryBuffer(room_size=8)
+    assert history.page("physics", None, 3) is None  # Not seeded yet
+    history.seed("physics", [(i, frame(i)) for i in range(1, 11)], has_older=True)
+
+    # Only the newest room_size are kept: 3..10
+    frames, has_more, next_before_id = history.page("physics", None, 3)
+    assert (ids_of(frames), has_more, next_before_id) == ([8, 9, 10], True, 8)
+    frames, has_more, next_before_id = history.page("physics", 8, 3)
+    assert (ids_of(frames), has_more, next_before_id) == ([5, 6, 7], True, 5)
+    assert history.page("physics", 5, 3) is None  # Only 3 and 4 are here; the database has the rest
+
+    frames, truncated, _ = history.since("physics", 6, 10)
+    assert (ids_of(frames), truncated) == ([7, 8, 9, 10], False)
+    frames, truncated, next_before_id = history.since("physics", 6, 2)
+    assert (ids_of(frames), truncated, next_before_id) == ([9, 10], True, 9)
+    assert history.since("physics", 1, 10) is None  # The gap reaches past the buffer
+
+    # New messages slide the window, deletions drop out, old ids are left to the database
+    history.remember("physics", 11, frame(11))
+    history.remember("physics", 2, frame(2))
+    history.remove("physics", 10)
+    frames, _, _ = history.page("physics", None, 3)
+    assert ids_of(frames) == [8, 9, 11]
+    assert ids_of(history.since("physics", 4, 10)[0]) == [5, 6, 7, 8, 9, 11]
+    assert history.since("physics", 3, 10) is None  # 3 was trimmed out of the window
+
+
+def test_whole_room_and_early_deletes():
+    history = HistoryBuffer(room_size=8)
+    # Deleted while the seed read was running: the read may still include it
+    history.remember("biology", 4, frame(4))
+    history.remove("biology", 2)
+    history.seed("biology", [(i, frame(i)) for i in (1, 2, 3)], has_older=False)
+    frames, has_more, next_before_id = history.page("biology", None, 10)
+    assert (ids_of(frames), has_more, next_before_id) == ([1, 3, 4], False, None)
+    # The buffer holds the whole room, so any since_id can be answered
+    assert ids_of(history.since("biology", 0, 10)[0]) == [1, 3, 4]
+    assert history.page("biology", 1, 10)[0] == []
+
+
+def test_memory_budget():
+    history = HistoryBuffer(room_size=100, memory_mb=0.001)  # About 1 KB
+    for room in ("a", "b", "c"):
+        history.seed(room, [(i, frame(i) * 5) for i in range(1, 4)], has_older=False)
+    assert history.stats()["evictions"] > 0
+    assert "c" in history.rooms and "a" not in history.rooms  # Least recently used goes first
+    assert history.bytes <= history.budget
+
+
+async def run_database_agreement_check():
+    room = unique_name("physics")
+    ids = []
+    for number in range(260):  # More than one join's worth, so the buffer is partial
+        message_id = await message_writer.allocate_id()
+        ids.append(message_id)
+        await message_writer.submit({"id": message_id, "username": "bob", "room": room, "content": f"note {number}"})
+    await message_writer.flush()
+
+    async with AsyncReadSessionLocal() as db:
+        joined = await get_join_history(room, db)  # Seeds the buffer from the database
+        assert ids_of(joined["frames"]) == ids[-200:] and joined["has_more"]
+
+        served = 0
+        for before_id in [None] + ids[-200::17]:
+            hot = manager.history.page(room, before_id, 30)
+            if hot is None:
+                continue
+            served += 1
+            page = await fetch_history_page(db, room, before_id, 30)
+            assert (ids_of(hot[0]), hot[1], hot[2]) == (
+                [message["id"] for message in page["messages"]], page["has_more"], page["next_before_id"]
+            ), before_id
+        assert served >= 10
+
+        for since_id, limit in ((ids[-1], 50), (ids[-40], 50), (ids[-40], 10), (ids[-150], 200)):
+            hot = manager.history.since(room, since_id, limit)
+            delta = await fetch_history_since(db, room, since_id, limit)
+            assert (ids_of(hot[0]), hot[1], hot[2]) == (
+                [message["id"] for message in delta["messages"]], delta["truncated"], delta["next_before_id"]
+            ), since_id
+        # A client whose cursor is older than the buffer goes to the database
+        assert manager.history.since(room, ids[10], 200) is None
+
+
+def test_database_agreement():
+    run(run_database_agreement_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing the history buffer...")
+    test_paging()
+    test_whole_room_and_early_deletes()
+    test_memory_budget()
+    test_database_agreement()
+    print("✅ History buffer tests passed")
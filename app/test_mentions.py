@@ -0,0 +1,111 @@
+# app/test_mentions.py
+"""
+Test the mention inbox: rows are written with their message, the inbox pages
+newest first through next_before_id with per-room unread counts, and
+backfill_mentions resumes from its checkpoint instead of rescanning.
+
+Run with: python -m app.test_mentions
+"""
+
+from app.testing import run, unique_name
+
+from sqlalchemy import select, update
+
+from app import models
+from app.database import AsyncReadSessionLocal, AsyncSessionLocal, SessionLocal, engine
+from app.mentions import BACKFILL_SEQUENCE, MarkReadRequest, backfill_mentions, get_mentions, mark_mentions_read
+from app.persistence import message_writer
+
+
+async def inbox(username: str, before_id=None, limit: int = 50, room=None) -> dict:
+    async with AsyncReadSessionLocal() as db:
+        return await get_mentions(username, before_id=before_id, limit=limit, room=room, unread_only=False, db=db)
+
+
+def mention_rows(user_id: int, room_pk: int) -> dict:
+    """message id -> is_read of the user's mention rows in the room."""
+    with SessionLocal() as db:
+        return dict(db.execute(select(models.MessageMention.message_id, models.MessageMention.is_read).where(
+            models.MessageMention.user_id == user_id, models.MessageMention.room_id == room_pk
+        )).all())
+
+
+async def run_mentions_check():
+    alice, room, other_room = unique_name("alice"), unique_name("physics"), unique_name("chemistry")
+    with SessionLocal() as db:
+        db.add(models.User(username=alice, password_hash="", is_admin=0))
+        db.commit()
+
+    ids = []
+    for number, target in enumerate([room] * 7 + [other_room]):
+        message_id = await message_writer.allocate_id()
+        ids.append(message_id)
+        await message_writer.submit({
+            "id": message_id, "username": "bob", "room": target,
+            "content": f"@{alice} question {number}", "mentioned_users": f"{alice},nobody-by-that-name"
+        })
+    await message_writer.flush()
+    with SessionLocal() as db:
+        alice_id = db.scalar(select(models.User.id).where(models.User.username == alice))
+        room_pk = db.scalar(select(models.Room.id).where(models.Room.name == room))
+
+    # One unread row per message, written with it; unknown names get none
+    assert mention_rows(alice_id, room_pk) == {message_id: 0 for message_id in ids[:7]}
+
+    # Newest first, three at a time, across both rooms
+    seen, before_id = [], None
+    while True:
+        page = await inbox(alice, before_id, limit=3)
+        seen += [mention["id"] for mention in page["mentions"]]
+        if not page["has_more"]:
+            assert page["next_before_id"] is None
+            break
+        before_id = page["next_before_id"]
+        assert before_id == seen[-1]
+    assert seen == ids[::-1]
+    assert page["unread"] == {"total": 8, "by_room": {room: 7, other_room: 1}}
+    assert [mention["id"] for mention in (await inbox(alice, room=other_room))["mentions"]] == [ids[7]]
+
+    async with AsyncSessionLocal() as db:
+        marked = await mark_mentions_read(alice, MarkReadRequest(room=room, up_to_id=ids[3]), db=db)
+    assert marked["marked_read"] == 4 and marked["unread"]["by_room"] == {room: 3, other_room: 1}
+
+    # Messages from before the table existed: a backfill that stopped after the first three
+    legacy_room = unique_name("history")
+    with SessionLocal() as db:
+        legacy_room_row = models.Room(name=legacy_room, admin_username=None)
+        db.add(legacy_room_row)
+        db.flush()
+        legacy_room_pk = legacy_room_row.id
+        legacy = []
+        for number in range(6):
+            message_id = await message_writer.allocate_id()
+            legacy.append(message_id)
+            db.add(models.Message(
+                id=message_id, room_id=legacy_room_pk, user_id=alice_id,
+                content=f"old note {number}", mentioned_users=alice
+            ))
+        db.execute(update(models.IdSequence).where(models.IdSequence.name == BACKFILL_SEQUENCE).values(next_value=legacy[3]))
+        db.commit()
+
+    with engine.connect() as connection:
+        backfill_mentions(connection, batch_size=2)
+    # Resumed at the checkpoint; backfilled mentions start out read
+    assert mention_rows(alice_id, legacy_room_pk) == {message_id: 1 for message_id in legacy[3:]}
+    with SessionLocal() as db:
+        assert db.scalar(select(models.IdSequence.next_value).where(models.IdSequence.name == BACKFILL_SEQUENCE)) > legacy[-1]
+
+    # A rerun finds nothing left to do
+    with engine.connect() as connection:
+        backfill_mentions(connection, batch_size=2)
+    assert mention_rows(alice_id, legacy_room_pk) == {message_id: 1 for message_id in legacy[3:]}
+
+
+def test_mentions():
+    run(run_mentions_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing the mention inbox...")
+    test_mentions()
+    print("✅ Mentions test passed")
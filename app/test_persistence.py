@@ -0,0 +1,134 @@
+# app/test_persistence.py
+"""
+Test the write-behind message writer: ids handed out by several processes
+follow the order they were asked for, a row the database rejects is
+dead-lettered without holding up the rest of its batch, an outage keeps
+every message pending, and a failing write fails the chat frame (with an
+error frame) rather than the socket.
+
+Run with: python -m app.test_persistence
+"""
+
+from app.testing import run, unique_name
+
+import json
+
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from app import models
+from app.database import AsyncReadSessionLocal
+from app.main import app
+from app.persistence import DEAD_LETTER_PATH, MessageIdAllocator, MessageWriter, message_writer
+
+
+async def saved_ids(ids: list) -> set:
+    async with AsyncReadSessionLocal() as db:
+        return set(await db.scalars(select(models.Message.id).where(models.Message.id.in_(ids))))
+
+
+async def run_id_order_check():
+    # Two workers taking turns, as their senders' messages arrive
+    first, second = MessageIdAllocator(block_size=1), MessageIdAllocator(block_size=1)
+    ids = [await allocator.allocate() for allocator in (first, second, first, second, second, first)]
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+
+
+def test_id_order():
+    run(run_id_order_check())
+
+
+async def run_dead_letter_check():
+    room, writer, dropped = unique_name("physics"), MessageWriter(), []
+    writer.on_dropped = dropped.append
+    first, second = await writer.allocate_id(), await writer.allocate_id()
+    await writer.submit({"id": first, "username": "bob", "room": room, "content": "saved"})
+    await writer.flush()
+
+    # The same id again can never be written; the message after it can
+    await writer.submit({"id": first, "username": "bob", "room": room, "content": "duplicate"})
+    await writer.submit({"id": second, "username": "bob", "room": room, "content": "also saved"})
+    for _ in range(2):
+        try:
+            await writer.flush()
+            raise AssertionError("The batch should have failed")
+        except Exception:
+            pass  # Retried as a batch first
+    await writer.flush()
+
+    assert not writer.pending and await saved_ids([first, second]) == {first, second}
+    assert [record["content"] for record in dropped] == ["duplicate"] and writer.dead_lettered == 1
+    lines = [json.loads(line) for line in DEAD_LETTER_PATH.read_text().splitlines()]
+    assert {"id": first, "room": room, "content": "duplicate"}.items() <= lines[-1].items()
+
+
+def test_dead_letter():
+    run(run_dead_letter_check())
+
+
+async def run_outage_check():
+    room, writer = unique_name("physics"), MessageWriter()
+    ids = [await writer.allocate_id() for _ in range(3)]
+    for message_id in ids:
+        await writer.submit({"id": message_id, "username": "bob", "room": room, "content": "note"})
+    writer._failures = 2  # The next failure goes row by row
+
+    write_batch, calls = writer._write_batch, []
+
+    async def failing_write(batch):
+        calls.append(batch)
+        if len(calls) == 1:
+            raise ValueError("Rejected")  # Sends the batch row by row
+        if len(calls) == 3:
+            raise OperationalError("INSERT", {}, ConnectionError("Database went away"))
+        await write_batch(batch)
+
+    writer._write_batch = failing_write
+    try:
+        await writer.flush()
+        raise AssertionError("The outage should have been raised")
+    except OperationalError:
+        pass
+    # The row written before the outage is done with; the others wait, none dead-lettered
+    assert [record["id"] for record in writer.pending] == ids[1:] and writer.dead_lettered == 0
+    await writer.flush()
+    assert not writer.pending and await saved_ids(ids) == set(ids)
+
+
+def test_outage():
+    run(run_outage_check())
+
+
+def receive_until(websocket, message_type: str) -> dict:
+    while True:
+        message = websocket.receive_json()
+        if message.get("type") == message_type:
+            return message
+
+
+def test_write_error_keeps_socket():
+    room, dana = unique_name("physics"), unique_name("dana")
+
+    async def unavailable():
+        raise OperationalError("UPDATE id_sequences", {}, ConnectionError("Database went away"))
+
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/chat/ws/{room}?username={dana}") as websocket:
+            message_writer.allocate_id = unavailable
+            try:
+                websocket.send_json({"type": "chat", "username": dana, "message": "lost"})
+                assert "could not be processed" in receive_until(websocket, "error")["message"]
+            finally:
+                del message_writer.allocate_id
+            websocket.send_json({"type": "chat", "username": dana, "message": "saved"})
+            assert receive_until(websocket, "chat")["message"] == "saved"
+
+
+if __name__ == "__main__":
+    print("🧪 Testing the message writer...")
+    test_id_order()
+    test_dead_letter()
+    test_outage()
+    test_write_error_keeps_socket()
+    print("✅ Message writer tests passed")
@@ -0,0 +1,60 @@
+# app/test_postgres.py
+"""
+Run the storage tests on PostgreSQL as part of the default run.
+
+The test modules below run on the scratch SQLite database by default. This
+test reruns them in a fresh interpreter (app.database builds its engines at
+import) against a throwaway cluster started with initdb/pg_ctl, found on the
+PATH or in PG_BIN. It is skipped, with the reason, when no cluster can be
+started, and when the whole run is already on TEST_POSTGRES_URL.
+
+Run with: python -m app.test_postgres
+"""
+
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from app.testing import postgres_unavailable, temporary_postgres
+
+ROOT = Path(__file__).resolve().parent.parent
+STORAGE_TESTS = [
+    "app/test_storage.py", "app/test_persistence.py", "app/test_retention.py", "app/test_export.py",
+    "app/test_search.py", "app/test_mentions.py", "app/test_history_buffer.py", "app/test_ai_cache.py",
+    "app/test_blobs.py", "app/test_history.py",
+]
+
+
+def skip_reason():
+    if os.getenv("TEST_POSTGRES_URL"):
+        return "the whole run is already on TEST_POSTGRES_URL"
+    return postgres_unavailable()
+
+
+def run_on_postgres(url: str):
+    env = dict(os.environ, TEST_POSTGRES_URL=url)
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", *STORAGE_TESTS],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=600
+    )
+    assert result.returncode == 0, result.stdout + result.stderr
+
+
+def test_storage_on_postgres():
+    reason = skip_reason()
+    if reason:
+        import pytest
+        pytest.skip(f"PostgreSQL storage tests not run: {reason}")
+    with temporary_postgres() as url:
+        run_on_postgres(url)
+
+
+if __name__ == "__main__":
+    reason = skip_reason()
+    if reason:
+        print(f"⏭️ Skipping the PostgreSQL storage tests: {reason}")
+    else:
+        print("🧪 Running the storage tests on PostgreSQL...")
+        test_storage_on_postgres()
+        print("✅ PostgreSQL storage tests passed")
@@ -0,0 +1,96 @@
+# app/test_presence.py
+"""
+Test presence aggregation: a user with several tabs and rooms is one online
+user with a connection count per room, closing one tab changes nothing for the
+room, and the last one is announced as a leave only after the grace window
+(and not at all if the user comes back in time).
+
+Run with: python -m app.test_presence
+"""
+
+from app.testing import unique_name
+
+import time
+
+from fastapi.testclient import TestClient
+
+from app import chat
+from app.chat import manager
+from app.main import app
+
+GRACE_SECONDS = 0.2
+
+
+def wait_until(condition, timeout: float = 3):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Timed out"
+        time.sleep(0.01)
+
+
+def drain(websocket) -> list:
+    """Everything the socket was sent up to now (a ping is answered after whatever came before it)."""
+    websocket.send_json({"type": "ping"})
+    received = []
+    while True:
+        message = websocket.receive_json()
+        if message.get("type") == "pong":
+            return received
+        received.append(message)
+
+
+def presence(client: TestClient, **params) -> dict:
+    return client.get("/chat/presence", params=params).json()
+
+
+def test_presence():
+    default_grace, chat.PRESENCE_GRACE_SECONDS = chat.PRESENCE_GRACE_SECONDS, GRACE_SECONDS
+    room, other_room = unique_name("physics"), unique_name("chemistry")
+    gina, hank = unique_name("gina"), unique_name("hank")
+    try:
+        with TestClient(app) as client:
+            with client.websocket_connect(f"/chat/ws/{room}?username={hank}") as hank_socket, \
+                    client.websocket_connect(f"/chat/ws/{room}?username={gina}") as tab_one, \
+                    client.websocket_connect(f"/chat/ws/{other_room}?username={gina}"):
+                with client.websocket_connect(f"/chat/ws/{room}?username={gina}"):
+                    state = presence(client, users=f"{gina},{hank},nobody", room=room)
+                    assert state["users"][gina] == {"online": True, "rooms": {room: 2, other_room: 1}}
+                    assert state["users"][hank] == {"online": True, "rooms": {room: 1}}
+                    assert state["users"]["nobody"] == {"online": False, "rooms": {}}
+                    assert sorted(state["online_users_in_room"]) == sorted([gina, hank])
+                    drain(hank_socket)
+
+                # One of two tabs closed: still in the room, nothing announced
+                wait_until(lambda: len(manager.room_presence[room][gina]) == 1)
+                assert not any(message.get("type") == "user_left" for message in drain(hank_socket))
+
+                tab_one.close()
+                wait_until(lambda: not manager.room_presence[room][gina])
+                # Listed through the grace window, in case this is a page reload
+                assert gina in presence(client, room=room)["online_users_in_room"]
+                wait_until(lambda: gina not in manager.room_presence.get(room, {}))
+                assert manager.user_rooms[gina] == {other_room}
+                left = [message for message in drain(hank_socket) if message.get("type") == "user_left"]
+                assert [message["username"] for message in left] == [gina]
+                assert presence(client, users=gina)["users"][gina] == {"online": True, "rooms": {other_room: 1}}
+
+                # Back within the grace window: neither the leave nor a new join is announced
+                rejoins = manager.quiet_rejoins
+                with client.websocket_connect(f"/chat/ws/{room}?username={gina}"):
+                    drain(hank_socket)
+                wait_until(lambda: not manager.room_presence[room][gina])
+                with client.websocket_connect(f"/chat/ws/{room}?username={gina}"):
+                    time.sleep(GRACE_SECONDS * 1.5)
+                    assert manager.quiet_rejoins == rejoins + 1
+                    events = [message.get("type") for message in drain(hank_socket)]
+                    assert "user_left" not in events and "user_joined" not in events
+
+            wait_until(lambda: gina not in manager.user_rooms and hank not in manager.user_rooms)
+    finally:
+        chat.PRESENCE_GRACE_SECONDS = default_grace
+
+
+if __name__ == "__main__":
+    print("🧪 Testing presence aggregation...")
+    test_presence()
+    print("✅ Presence test passed")
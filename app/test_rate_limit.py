@@ -0,0 +1,119 @@
+# app/test_rate_limit.py
+"""
+Test rate limiting: limit parsing, token buckets, and the chat WebSocket's
+per-user limit, which must follow the name the socket connected with rather
+than the username a frame claims, must not lump anonymous sockets together,
+and charges @bot questions to the ai limit; uploads are limited per user, not
+per shared address.
+
+Run with: python -m app.test_rate_limit
+"""
+
+from app.testing import unique_name
+
+import time
+
+from fastapi.testclient import TestClient
+
+from app.main import app
+from app.rate_limit import Limit, RateLimiter, parse_limits
+
+
+def test_parse_limits():
+    limits = parse_limits("connection=5:10, room=50")
+    assert (limits["connection"].rate, limits["connection"].burst) == (5, 10)
+    assert (limits["room"].rate, limits["room"].burst) == (50, 50)
+    for spec in ("user=0:10", "user=-1:10", "user=5:0"):
+        try:
+            parse_limits(spec)
+        except ValueError:
+            continue
+        raise AssertionError(f"{spec} was accepted")
+
+
+def test_token_bucket():
+    limiter = RateLimiter({"chat": {"user": Limit(rate=10, burst=2)}})
+    assert limiter.check("chat", user="alice") == 0
+    assert limiter.check("chat", user="alice") == 0
+    wait = limiter.check("chat", user="alice")
+    assert 0 < wait <= 0.1
+    assert limiter.check("chat", user="bob") == 0  # Buckets are per key
+    time.sleep(wait)
+    assert limiter.check("chat", user="alice") == 0
+
+
+def send_and_collect(websocket, frames: list) -> list:
+    """Send frames, then a ping, and return everything received up to the pong."""
+    for frame in frames:
+        websocket.send_json(frame)
+    websocket.send_json({"type": "ping"})
+    received = []
+    while True:
+        message = websocket.receive_json()
+        if message.get("type") == "pong":
+            return received
+        received.append(message)
+
+
+def rate_limited(messages: list) -> bool:
+    return any(message.get("code") == "rate_limited" for message in messages)
+
+
+def test_chat_limits_follow_connected_user():
+    room = unique_name("physics")
+    with TestClient(app) as client:
+        # dave floods while claiming to be carol, then with a new name on every frame
+        with client.websocket_connect(f"/chat/ws/{room}?username=dave") as dave:
+            send_and_collect(dave, [{"type": "chat", "username": "carol", "message": "spam"}] * 5)
+            send_and_collect(dave, [{"type": "chat", "username": f"x{n}", "message": "spam"} for n in range(5)])
+            # carol's own bucket was never touched
+            with client.websocket_connect(f"/chat/ws/{room}?username=carol") as carol:
+                assert not rate_limited(send_and_collect(carol, [{"type": "chat", "message": "hi"}]))
+            # All ten counted against dave, so a fresh connection of his is limited too
+            with client.websocket_connect(f"/chat/ws/{room}?username=dave") as dave_again:
+                assert rate_limited(send_and_collect(dave_again, [{"type": "chat", "message": "one more"}]))
+
+
+def test_anonymous_sockets_have_no_shared_bucket():
+    room = unique_name("physics")
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/chat/ws/{room}") as first, client.websocket_connect(f"/chat/ws/{room}") as second:
+            # Uses up the first socket's connection burst (10); a shared "Anonymous" user bucket would go too
+            send_and_collect(first, [{"type": "chat", "message": "spam"}] * 10)
+            assert not rate_limited(send_and_collect(second, [{"type": "chat", "message": "hi"}]))
+
+
+def test_uploads_are_limited_per_user():
+    room = unique_name("physics")
+    frank, grace = unique_name("frank"), unique_name("grace")
+
+    def start_upload(username: str) -> int:
+        session = {"filename": "notes.txt", "size": 5, "room": room, "username": username}
+        return client.post("/upload/sessions", json=session).status_code
+
+    with TestClient(app) as client:
+        # Same address for everyone, as behind a school NAT; the default user burst is 10
+        assert [start_upload(frank) for _ in range(11)] == [200] * 10 + [429]
+        assert start_upload(grace) == 200
+
+
+def test_bot_questions_use_ai_limit():
+    room = unique_name("physics")
+    asker = unique_name("erin")
+    with TestClient(app) as client:
+        with client.websocket_connect(f"/chat/ws/{room}?username={asker}") as websocket:
+            # The default ai limit has a burst of 5 per user
+            received = send_and_collect(websocket, [{"type": "chat", "message": f"@bot question {n}"} for n in range(6)])
+    errors = [message for message in received if message.get("code") == "rate_limited"]
+    assert len(errors) == 1 and "AI assistant" in errors[0]["message"]
+
+
+if __name__ == "__main__":
+    print("🧪 Testing rate limiting...")
+    test_parse_limits()
+    test_token_bucket()
+    test_chat_limits_follow_connected_user()
+    test_anonymous_sockets_have_no_shared_bucket()
+    test_uploads_are_limited_per_user()
+    test_bot_questions_use_ai_limit()
+    print("✅ Rate limiting tests passed")
@@ -0,0 +1,98 @@
+# app/test_room_cache.py
+"""
+Test the room metadata cache: mutes, unmutes and admin changes are written
+through to the cached entry, unclaimed and missing rooms aren't cached, the
+least recently used room is evicted, and a mute that lands while a load is
+reading the database isn't overwritten by what the load read.
+
+Run with: python -m app.test_room_cache
+"""
+
+from app.testing import run, unique_name
+
+from app import models
+from app.database import SessionLocal
+from app.room_cache import RoomCache
+
+
+def create_room(admin_username=None) -> str:
+    name = unique_name("physics")
+    with SessionLocal() as db:
+        db.add(models.Room(name=name, admin_username=admin_username))
+        db.commit()
+    return name
+
+
+def mute_in_database(room_name: str, username: str):
+    with SessionLocal() as db:
+        room = db.query(models.Room).filter(models.Room.name == room_name).one()
+        db.add(models.MutedUser(room_id=room.id, username=username, muted_by="alice"))
+        db.commit()
+
+
+async def run_write_through_check():
+    cache = RoomCache(max_rooms=2)
+    room = create_room("alice")
+    info = await cache.get(room)
+    assert (info.admin_username, info.muted, cache.misses) == ("alice", set(), 1)
+
+    # Applied to the cached entry; no reload needed
+    cache.mark_muted(room, "bob")
+    cache.mark_muted(room, "carol")
+    cache.mark_unmuted(room, "carol")
+    cache.set_admin(room, "dave")
+    info = await cache.get(room)
+    assert (info.admin_username, info.muted) == ("dave", {"bob"})
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # Missing and unclaimed rooms are read again every time
+    assert await cache.get(unique_name("nowhere")) is None
+    unclaimed = create_room()
+    assert (await cache.get(unclaimed)).admin_username is None
+    assert room in cache._rooms and unclaimed not in cache._rooms
+
+    # Least recently used goes first
+    second, third = create_room("erin"), create_room("frank")
+    await cache.get(second)
+    await cache.get(room)
+    await cache.get(third)
+    assert list(cache._rooms) == [room, third]
+
+    cache.invalidate(room)
+    assert room not in cache._rooms
+
+
+def test_write_through():
+    run(run_write_through_check())
+
+
+async def run_mute_during_load_check():
+    cache = RoomCache()
+    room = create_room("alice")
+    loads = []
+
+    async def load_then_mute(room_name):
+        info = await RoomCache._load(cache, room_name)
+        if not loads:
+            # The mute commits after this load read the muted list
+            mute_in_database(room_name, "bob")
+            cache.mark_muted(room_name, "bob")
+        loads.append(info)
+        return info
+
+    cache._load = load_then_mute
+    info = await cache.get(room)
+    assert len(loads) == 2 and "bob" not in loads[0].muted
+    assert info.muted == {"bob"} and (await cache.get(room)).muted == {"bob"}
+    assert not cache._loads
+
+
+def test_mute_during_load():
+    run(run_mute_during_load_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing the room cache...")
+    test_write_through()
+    test_mute_during_load()
+    print("✅ Room cache tests passed")
@@ -0,0 +1,111 @@
+# app/test_search.py
+"""
+Test message search: the FTS5 triggers keep messages_fts in step with inserts,
+edits, soft-deletes and deletes, and the in-process InvertedIndex fallback
+finds the same messages, catches up with new ones (including ones committed
+after a higher id was indexed) and drops deleted ones.
+
+The FTS5 part runs on SQLite only; the fallback runs on either backend.
+
+Run with: python -m app.test_search
+"""
+
+from app.testing import run, unique_name
+
+from sqlalchemy import delete, select, update
+
+from app import models, search
+from app.database import AsyncReadSessionLocal, SessionLocal, engine
+from app.persistence import message_writer
+from app.search import SNIPPET_CLOSE, SNIPPET_OPEN, InvertedIndex, search_fallback, search_fts, tokenize
+
+CONTENTS = [
+    "Photosynthesis turns light into sugar",
+    "The café next door sells photosynthetic algae snacks",
+    "Mitochondria are the powerhouse of the cell",
+]
+
+
+async def post(room: str, content: str) -> int:
+    message_id = await message_writer.allocate_id()
+    await message_writer.submit({"id": message_id, "username": "bob", "room": room, "content": content})
+    return message_id
+
+
+def set_message(message_id: int, **values):
+    with SessionLocal() as db:
+        db.execute(update(models.Message).where(models.Message.id == message_id).values(**values))
+        db.commit()
+
+
+async def found(find, room_pk: int, query: str) -> list:
+    async with AsyncReadSessionLocal() as db:
+        return [message_id for message_id, _, _ in await find(db, room_pk, tokenize(query), 10, 0)]
+
+
+async def run_search_check():
+    room, other_room = unique_name("biology"), unique_name("chemistry")
+    ids = [await post(room, content) for content in CONTENTS]
+    other_id = await post(other_room, "Photosynthesis again, elsewhere")
+    await message_writer.flush()
+    with SessionLocal() as db:
+        room_pk = db.scalar(select(models.Room.id).where(models.Room.name == room))
+
+    # Fresh fallback index, so the first search below builds the room from scratch
+    search.inverted_index = InvertedIndex()
+    finders = [search_fallback]
+    if engine.dialect.name == "sqlite":
+        finders.insert(0, search_fts)
+
+    for find in finders:
+        # The last term is a prefix, accents are folded, and only the room's own messages count
+        assert sorted(await found(find, room_pk, "photosynth")) == ids[:2], find.__name__
+        assert await found(find, room_pk, "cafe snacks") == [ids[1]], find.__name__
+        assert other_id not in await found(find, room_pk, "elsewhere"), find.__name__
+
+    if engine.dialect.name == "sqlite":
+        async with AsyncReadSessionLocal() as db:
+            (_, _, snippet), = await search_fts(db, room_pk, tokenize("mitochondria"), 10, 0)
+        assert f"{SNIPPET_OPEN}Mitochondria{SNIPPET_CLOSE}" in snippet
+
+    # The triggers follow edits, soft-deletes, restores and deletes
+    set_message(ids[0], content="Chlorophyll absorbs red light")
+    set_message(ids[2], is_deleted=1)
+    added = await post(room, "Photosynthesis needs chlorophyll")
+    await message_writer.flush()
+    if engine.dialect.name == "sqlite":
+        assert sorted(await found(search_fts, room_pk, "chlorophyll")) == [ids[0], added]
+        assert await found(search_fts, room_pk, "sugar") == []
+        assert await found(search_fts, room_pk, "mitochondria") == []
+        set_message(ids[2], is_deleted=0)
+        assert await found(search_fts, room_pk, "mitochondria") == [ids[2]]
+        with SessionLocal() as db:
+            db.execute(delete(models.Message).where(models.Message.id == ids[2]))
+            db.commit()
+        assert await found(search_fts, room_pk, "mitochondria") == []
+
+    # The fallback picks up the new message and forgets the deleted one when it runs into it
+    assert added in await found(search_fallback, room_pk, "photosynth")
+    assert await found(search_fallback, room_pk, "powerhouse") == []
+    assert ids[2] not in search.inverted_index._rooms[room_pk].lengths
+
+    # Ids are allocated before the write: an earlier id can land after a later one was indexed
+    late_id, early_id = await message_writer.allocate_id(), await message_writer.allocate_id()
+    await message_writer.submit({"id": early_id, "username": "bob", "room": room, "content": "Stomata open at dawn"})
+    await message_writer.flush()
+    assert await found(search_fallback, room_pk, "stomata") == [early_id]
+    await message_writer.submit({"id": late_id, "username": "bob", "room": room, "content": "Stomata close at noon"})
+    await message_writer.flush()
+    assert sorted(await found(search_fallback, room_pk, "stomata")) == [late_id, early_id]
+    index = search.inverted_index._rooms[room_pk]
+    assert len(index.postings["stomata"]) == 2 and index.lengths[early_id] == 4  # Not indexed twice
+
+
+def test_search():
+    run(run_search_check())
+
+
+if __name__ == "__main__":
+    print(f"🧪 Testing message search on {engine.dialect.name}...")
+    test_search()
+    print("✅ Search test passed")
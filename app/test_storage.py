@@ -0,0 +1,99 @@
+# app/test_storage.py
+"""
+Test the storage layer: schema creation, a batch written through the message
+writer (bulk insert / COPY), a rerun of the mentions backfill
+(insert-or-ignore), a room indexed through a streamed, server-side-cursor
+read, and the drivers and read-only pool picked for the backend.
+
+Runs on the scratch SQLite database, or on PostgreSQL with
+TEST_POSTGRES_URL=postgresql://... (see app/testing.py). The default run also
+repeats it on a throwaway PostgreSQL cluster through app/test_postgres.py,
+which reports a skip with the reason when it can't start one.
+
+Run with: python -m app.test_storage
+"""
+
+from app.testing import run, unique_name
+
+from sqlalchemy import func, select, update
+from sqlalchemy.exc import DBAPIError
+
+from app import models
+from app.database import AsyncReadSessionLocal, SessionLocal, async_engine, engine
+from app.mentions import backfill_mentions
+from app.persistence import message_writer
+from app.search import InvertedIndex
+
+MESSAGES = 1200
+
+
+async def run_storage_check():
+    # psycopg 3 for sync code and asyncpg on the event loop, whatever form DATABASE_URL took
+    drivers = ("psycopg", "asyncpg") if engine.dialect.name == "postgresql" else ("pysqlite", "aiosqlite")
+    assert (engine.dialect.driver, async_engine.dialect.driver) == drivers
+
+    room, mentioned = unique_name("physics"), unique_name("alice")
+    with SessionLocal() as db:
+        db.add(models.User(username=mentioned, password_hash="", is_admin=0))
+        db.commit()
+
+    ids = []
+    for number in range(MESSAGES):
+        message_id = await message_writer.allocate_id()
+        ids.append(message_id)
+        await message_writer.submit({
+            "id": message_id,
+            "username": "bob",
+            "room": room,
+            "content": f"note {number} about @{mentioned}" if number % 10 == 0 else f"note {number}",
+            "mentioned_users": mentioned if number % 10 == 0 else None
+        })
+    await message_writer.flush()
+
+    def room_counts():
+        with SessionLocal() as db:
+            room_pk = db.scalar(select(models.Room.id).where(models.Room.name == room))
+            return (
+                room_pk,
+                db.scalar(select(func.count()).where(models.Message.room_id == room_pk)),
+                db.scalar(select(func.count()).where(models.MessageMention.room_id == room_pk))
+            )
+
+    room_pk, messages, mentions = room_counts()
+    assert (messages, mentions) == (MESSAGES, MESSAGES // 10)
+    with SessionLocal() as db:
+        # Python-side column defaults were applied by the bulk insert
+        assert db.scalar(select(func.count()).where(
+            models.Message.room_id == room_pk, models.Message.is_deleted == 0
+        )) == MESSAGES
+        assert sorted(db.scalars(select(models.Message.id).where(models.Message.room_id == room_pk))) == ids
+
+    # The rows already exist: the backfill must skip them, not fail
+    with engine.connect() as connection:
+        backfill_mentions(connection, batch_size=100)
+    assert room_counts() == (room_pk, MESSAGES, MESSAGES // 10)
+
+    async with AsyncReadSessionLocal() as db:
+        index = await InvertedIndex().room(db, room_pk)
+    assert len(index.lengths) == MESSAGES
+    assert index.max_id == ids[-1]
+
+    # The read pool refuses writes: query_only on SQLite, READ ONLY transactions on PostgreSQL
+    async with AsyncReadSessionLocal() as db:
+        try:
+            await db.execute(update(models.Message).where(models.Message.id == ids[0]).values(content="changed"))
+            await db.commit()
+        except DBAPIError:
+            pass
+        else:
+            raise AssertionError("A read session wrote to the database")
+
+
+def test_storage():
+    run(run_storage_check())
+
+
+if __name__ == "__main__":
+    print(f"🧪 Testing storage on {engine.dialect.name}...")
+    test_storage()
+    print("✅ Storage test passed")
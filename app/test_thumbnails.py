@@ -0,0 +1,101 @@
+# app/test_thumbnails.py
+"""
+Test attachment previews: render_preview on a generated PNG, EXIF-rotated JPEG
+and PDF, and the thumbnail URL and ETag carrying THUMBNAIL_MAX_SIZE, since
+thumbnails are cached as immutable. The rendering tests need Pillow (and
+PyMuPDF for the PDF) and are skipped without them.
+
+Run with: python -m app.test_thumbnails
+"""
+
+from app.testing import SCRATCH_DIR, unique_name
+
+import io
+import os
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import files
+from app.main import app
+from app.thumbnails import THUMBNAIL_MAX_SIZE, render_preview, thumbnail_name
+
+
+def scratch_path(name: str) -> str:
+    return os.path.join(SCRATCH_DIR, f"{unique_name('preview')}-{name}")
+
+
+def test_render_image():
+    Image = pytest.importorskip("PIL.Image")
+    source, dest = scratch_path("wide.png"), scratch_path("wide.jpg")
+    Image.new("RGBA", (1200, 600), (30, 120, 200, 128)).save(source)
+    assert render_preview(source, dest, max_size=100) == {
+        "width": 1200, "height": 600, "thumbnail_width": 100, "thumbnail_height": 50
+    }
+    with Image.open(dest) as thumbnail:
+        assert (thumbnail.format, thumbnail.mode, thumbnail.size) == ("JPEG", "RGB", (100, 50))
+    assert not os.path.exists(f"{dest}.tmp")
+
+    # A phone photo stored landscape with "rotate 90" in EXIF is reported and rendered upright
+    source, dest = scratch_path("photo.jpg"), scratch_path("photo.thumb.jpg")
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new("RGB", (800, 400), "white").save(source, exif=exif)
+    preview = render_preview(source, dest, max_size=200)
+    assert (preview["width"], preview["height"]) == (400, 800)
+    assert (preview["thumbnail_width"], preview["thumbnail_height"]) == (100, 200)
+
+
+def test_render_pdf():
+    Image = pytest.importorskip("PIL.Image")
+    fitz = pytest.importorskip("fitz")
+    source, dest = scratch_path("notes.pdf"), scratch_path("notes.jpg")
+    with fitz.open() as document:
+        page = document.new_page(width=595, height=842)  # A4 in points
+        page.insert_text((72, 72), "Lecture notes")
+        document.save(source)
+    preview = render_preview(source, dest, max_size=120)
+    assert (preview["width"], preview["height"]) == (595, 842)
+    assert preview["thumbnail_height"] == 120 and preview["thumbnail_width"] in (84, 85)
+    with Image.open(dest) as thumbnail:
+        assert thumbnail.format == "JPEG"
+
+
+def test_thumbnail_cache_key():
+    sha256 = uuid.uuid4().hex * 2
+    assert thumbnail_name(f"{sha256}.png", 480) == f"{sha256}.thumb-480.jpg"
+    assert thumbnail_name(f"{sha256}.png", 480) != thumbnail_name(f"{sha256}.png", 240)
+
+    name = thumbnail_name(f"{sha256}.png")
+    files.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    (files.UPLOAD_DIR / name).write_bytes(b"jpeg")
+    with TestClient(app) as client:
+        response = client.get(f"/uploads/{name}")
+        assert response.headers["etag"] == f'"{sha256}-thumb{THUMBNAIL_MAX_SIZE}"'
+        assert "immutable" in response.headers["cache-control"]
+        assert client.get(f"/uploads/{name}", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+
+def test_uploaded_image_gets_sized_thumbnail():
+    Image = pytest.importorskip("PIL.Image")
+    image = io.BytesIO()
+    Image.new("RGB", (640, 480), tuple(uuid.uuid4().bytes[:3])).save(image, "PNG")  # Unique content
+    with TestClient(app) as client:
+        response = client.post(
+            "/upload", files={"file": ("diagram.png", image.getvalue(), "image/png")},
+            data={"room": unique_name("physics"), "username": unique_name("alice")}
+        )
+        uploaded = response.json()
+        assert uploaded["thumbnail_url"].endswith(f".thumb-{THUMBNAIL_MAX_SIZE}.jpg")
+        assert (uploaded["width"], uploaded["height"]) == (640, 480)
+        assert client.get(uploaded["thumbnail_url"]).content[:2] == b"\xff\xd8"  # JPEG
+
+
+if __name__ == "__main__":
+    print("🧪 Testing attachment previews...")
+    test_render_image()
+    test_render_pdf()
+    test_thumbnail_cache_key()
+    test_uploaded_image_gets_sized_thumbnail()
+    print("✅ Preview tests passed")
@@ -0,0 +1,89 @@
+# app/test_typing.py
+"""
+Test typing-indicator aggregation: bursts of typing events become one
+typing_state frame per room and interval, nothing is sent while the list is
+unchanged, and typists who stop reporting expire.
+
+Run with: python -m app.test_typing
+"""
+
+import asyncio
+import time
+
+from app.presence import TypingAggregator
+
+
+def collecting_aggregator(**options):
+    frames = []
+    aggregator = TypingAggregator(**options)
+    aggregator.deliver = lambda room_id, message: frames.append((room_id, message["users"]))
+    return aggregator, frames
+
+
+def test_typing_batching():
+    aggregator, frames = collecting_aggregator(ttl_seconds=60)
+    for _ in range(3):
+        for user in ("carol", "alice", "bob"):
+            aggregator.set_typing("physics", user, True)
+    aggregator.set_typing("chemistry", "dave", True)
+    aggregator.flush()
+    # Nine events in physics, one sorted list per room
+    assert sorted(frames) == [("chemistry", ["dave"]), ("physics", ["alice", "bob", "carol"])]
+
+    # Refreshes don't change the list, so nothing is sent
+    frames.clear()
+    aggregator.set_typing("physics", "alice", True)
+    aggregator.flush()
+    assert frames == []
+
+    # A stop goes out with the next flush; the last one leaves an empty list
+    assert aggregator.set_typing("physics", "bob", False)
+    assert not aggregator.set_typing("physics", "erin", False)  # Was never typing
+    aggregator.flush()
+    assert frames == [("physics", ["alice", "carol"])]
+    for user in ("alice", "carol"):
+        aggregator.set_typing("physics", user, False)
+    aggregator.set_typing("chemistry", "dave", False)
+    frames.clear()
+    aggregator.flush()
+    assert sorted(frames) == [("chemistry", []), ("physics", [])]
+    frames.clear()
+    aggregator.flush()
+    assert frames == []
+    assert aggregator.stats()["typing_rooms"] == 0
+
+
+def test_typing_expiry():
+    aggregator, frames = collecting_aggregator(ttl_seconds=0.05)
+    aggregator.set_typing("physics", "alice", True)
+    aggregator.flush()
+    assert frames == [("physics", ["alice"])]
+    time.sleep(0.06)
+    # No stop_typing ever came: alice drops out anyway
+    assert aggregator.typing_users("physics") == []
+    aggregator.flush()
+    assert frames[-1] == ("physics", [])
+
+
+async def run_typing_loop_check():
+    aggregator, frames = collecting_aggregator(flush_ms=20, ttl_seconds=60)
+    await aggregator.start(aggregator.deliver)
+    try:
+        for user in ("alice", "bob"):
+            aggregator.set_typing("physics", user, True)
+        await asyncio.sleep(0.1)
+        assert frames == [("physics", ["alice", "bob"])]
+    finally:
+        await aggregator.stop()
+
+
+def test_typing_loop():
+    asyncio.run(run_typing_loop_check())
+
+
+if __name__ == "__main__":
+    print("🧪 Testing typing aggregation...")
+    test_typing_batching()
+    test_typing_expiry()
+    test_typing_loop()
+    print("✅ Typing aggregation tests passed")
@@ -0,0 +1,82 @@
+# app/test_upload_serving.py
+"""
+Test GET /uploads/{name}: byte ranges (206, and 416 past the end), the strong
+ETag and immutable caching of content-addressed files, If-None-Match (304),
+and the weaker validators of files that aren't content-addressed.
+
+Run with: python -m app.test_upload_serving
+"""
+
+from app.testing import unique_name
+
+import hashlib
+import os
+
+from fastapi.testclient import TestClient
+
+from app.files import IMMUTABLE_CACHE_CONTROL, UPLOAD_DIR
+from app.main import app
+
+
+def stored_file(data: bytes, name: str = None) -> str:
+    name = name or f"{hashlib.sha256(data).hexdigest()}.mp4"
+    UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+    (UPLOAD_DIR / name).write_bytes(data)
+    return name
+
+
+def test_ranges():
+    data = os.urandom(10_000)
+    name = stored_file(data)
+    with TestClient(app) as client:
+        whole = client.get(f"/uploads/{name}")
+        assert whole.status_code == 200 and whole.content == data
+        assert whole.headers["accept-ranges"] == "bytes"
+
+        part = client.get(f"/uploads/{name}", headers={"Range": "bytes=100-199"})
+        assert part.status_code == 206 and part.content == data[100:200]
+        assert part.headers["content-range"] == f"bytes 100-199/{len(data)}"
+        tail = client.get(f"/uploads/{name}", headers={"Range": "bytes=-500"})
+        assert tail.status_code == 206 and tail.content == data[-500:]
+
+        beyond = client.get(f"/uploads/{name}", headers={"Range": f"bytes={len(data)}-"})
+        assert beyond.status_code == 416
+        assert beyond.headers["content-range"] == f"bytes */{len(data)}"
+
+        # If-Range with a stale validator gets the whole file instead of a part
+        stale = client.get(f"/uploads/{name}", headers={"Range": "bytes=0-9", "If-Range": '"not-the-etag"'})
+        assert stale.status_code == 200 and stale.content == data
+
+
+def test_conditional_requests():
+    data = os.urandom(1000)
+    name = stored_file(data)
+    sha256 = name.split(".")[0]
+    with TestClient(app) as client:
+        response = client.get(f"/uploads/{name}")
+        assert response.headers["etag"] == f'"{sha256}"'
+        assert response.headers["cache-control"] == IMMUTABLE_CACHE_CONTROL
+        assert response.headers["x-content-type-options"] == "nosniff"
+
+        for if_none_match in (f'"{sha256}"', f'W/"{sha256}"', f'"other", "{sha256}"', "*"):
+            cached = client.get(f"/uploads/{name}", headers={"If-None-Match": if_none_match})
+            assert cached.status_code == 304 and cached.content == b"", if_none_match
+            assert cached.headers["etag"] == f'"{sha256}"'
+        assert client.get(f"/uploads/{name}", headers={"If-None-Match": '"other"'}).status_code == 200
+        assert client.head(f"/uploads/{name}").headers["content-length"] == str(len(data))
+
+        # Legacy names aren't content-addressed: mtime/size validator and a bounded max-age
+        legacy = stored_file(b"old upload", f"{unique_name('legacy')}.txt")
+        response = client.get(f"/uploads/{legacy}")
+        assert response.status_code == 200 and "immutable" not in response.headers["cache-control"]
+        assert client.get(f"/uploads/{legacy}", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+        for name in ("missing.txt", ".hidden", "..%2Fapp.db"):
+            assert client.get(f"/uploads/{name}").status_code == 404
+
+
+if __name__ == "__main__":
+    print("🧪 Testing upload serving...")
+    test_ranges()
+    test_conditional_requests()
+    print("✅ Upload serving tests passed")
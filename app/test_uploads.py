@@ -0,0 +1,66 @@
+# app/test_uploads.py
+"""
+Test resumable upload sessions: chunks, finalize, and that the per-session
+locks are only created for sessions that exist and are dropped again when a
+session is finalized, expires, or turns out to be gone.
+
+Run with: python -m app.test_uploads
+"""
+
+from app.testing import unique_name
+
+import os
+import time
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app import files
+from app.main import app
+
+
+def start_session(client: TestClient, data: bytes) -> str:
+    response = client.post("/upload/sessions", json={
+        "filename": f"{unique_name('notes')}.txt", "size": len(data), "room": "physics", "username": "alice"
+    })
+    assert response.status_code == 200
+    return response.json()["upload_id"]
+
+
+def test_upload_session_locks():
+    data = os.urandom(1000) + uuid.uuid4().bytes  # Unique, so it isn't deduplicated
+    with TestClient(app) as client:
+        # Unknown and malformed ids are turned away without leaving a lock behind
+        for upload_id in (uuid.uuid4().hex, "not-an-id"):
+            assert client.put(f"/upload/sessions/{upload_id}?offset=0", content=b"x").status_code == 404
+            assert client.post(f"/upload/sessions/{upload_id}/finalize").status_code == 404
+            assert upload_id not in files._session_locks
+
+        upload_id = start_session(client, data)
+        assert client.put(f"/upload/sessions/{upload_id}?offset=0", content=data[:600]).json()["received"] == 600
+        assert client.put(f"/upload/sessions/{upload_id}?offset=600", content=data[600:]).json()["received"] == len(data)
+        assert upload_id in files._session_locks
+        finalized = client.post(f"/upload/sessions/{upload_id}/finalize")
+        assert finalized.status_code == 200 and client.get(finalized.json()["file_url"]).content == data
+        assert upload_id not in files._session_locks
+        # A late retry of the finalize finds nothing and adds nothing
+        assert client.post(f"/upload/sessions/{upload_id}/finalize").status_code == 404
+        assert upload_id not in files._session_locks
+
+        # An abandoned session is purged together with its lock
+        upload_id = start_session(client, data)
+        client.put(f"/upload/sessions/{upload_id}?offset=0", content=data[:100])
+        assert upload_id in files._session_locks
+        stale = time.time() - files.UPLOAD_SESSION_TTL_SECONDS - 1
+        for path in (files._state_path(upload_id), files._part_path(upload_id)):
+            os.utime(path, (stale, stale))
+        files._purge_stale_sessions()
+        assert upload_id not in files._session_locks and upload_id not in files._session_hashers
+        assert client.put(f"/upload/sessions/{upload_id}?offset=100", content=data[100:]).status_code == 404
+        assert upload_id not in files._session_locks
+
+
+if __name__ == "__main__":
+    print("🧪 Testing resumable upload sessions...")
+    test_upload_session_locks()
+    print("✅ Upload session test passed")
@@ -0,0 +1,111 @@
+# app/testing.py
+"""
+Shared setup for the app/test_*.py modules that touch storage.
+
+app.database builds its engines from DATABASE_URL when it is first imported,
+so this module must be imported before anything else from the app: conftest.py
+does it for pytest, and each test module imports it first for the
+`python -m app.test_...` runs. It points the app at a scratch SQLite database,
+archive and upload directories and a dead-letter file in a temporary
+directory, or at TEST_POSTGRES_URL when that is set, so the same tests run on
+PostgreSQL.
+
+Tests share the database: each works in rooms named with unique_name() and
+only asserts about those. Without TEST_POSTGRES_URL, app/test_postgres.py
+reruns the storage tests on a throwaway cluster from temporary_postgres().
+"""
+
+import asyncio
+import atexit
+import os
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Awaitable, Iterator, Optional
+
+SCRATCH_DIR = tempfile.mkdtemp(prefix="studychat-test-")
+atexit.register(shutil.rmtree, SCRATCH_DIR, True)
+
+os.environ["DATABASE_URL"] = os.getenv("TEST_POSTGRES_URL") or f"sqlite:///{SCRATCH_DIR}/studychat.db"
+os.environ.pop("ASYNC_DATABASE_URL", None)
+os.environ["ARCHIVE_DIR"] = os.path.join(SCRATCH_DIR, "archives")
+os.environ["UPLOAD_DIR"] = os.path.join(SCRATCH_DIR, "uploads")
+os.environ["UPLOAD_PARTIAL_DIR"] = os.path.join(SCRATCH_DIR, "uploads_partial")
+os.environ["MESSAGE_DEAD_LETTER_PATH"] = os.path.join(SCRATCH_DIR, "dead_letter_messages.ndjson")
+
+_initialized = False
+
+
+def unique_name(prefix: str) -> str:
+    return f"{prefix}-{uuid.uuid4().hex[:8]}"
+
+
+async def _run(test: Awaitable):
+    from app.database import async_engine, read_engine
+    from app.init_db import init_db
+
+    global _initialized
+    if not _initialized:
+        init_db()
+        _initialized = True
+    try:
+        await test
+    finally:
+        # Pooled async connections belong to this event loop; the next run() gets a new one
+        await async_engine.dispose()
+        await read_engine.dispose()
+
+
+def run(test: Awaitable):
+    """Run an async test against the scratch database (created on first use)."""
+    asyncio.run(_run(test))
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def postgres_unavailable() -> Optional[str]:
+    """Why temporary_postgres() can't start a cluster here, or None if it can."""
+    if os.getenv("TEST_POSTGRES_URL"):
+        return None
+    path = os.getenv("PG_BIN") or os.environ.get("PATH", "")
+    if not shutil.which("initdb", path=path) or not shutil.which("pg_ctl", path=path):
+        return "initdb/pg_ctl not found: install PostgreSQL, set PG_BIN to its bin directory, or set TEST_POSTGRES_URL"
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        return "PostgreSQL refuses to run as root: run the tests as another user, or set TEST_POSTGRES_URL"
+    return None
+
+
+@contextmanager
+def temporary_postgres() -> Iterator[str]:
+    """URL of TEST_POSTGRES_URL, or of a throwaway cluster started with initdb/pg_ctl (see postgres_unavailable())."""
+    if os.getenv("TEST_POSTGRES_URL"):
+        yield os.environ["TEST_POSTGRES_URL"]
+        return
+    path = os.getenv("PG_BIN") or os.environ.get("PATH", "")
+    initdb, pg_ctl = shutil.which("initdb", path=path), shutil.which("pg_ctl", path=path)
+    with tempfile.TemporaryDirectory(prefix="studychat-pg-") as directory:
+        data = Path(directory) / "data"
+        port = _free_port()
+        subprocess.run(
+            [initdb, "-D", str(data), "-U", "studychat", "--auth=trust", "-E", "UTF8"],
+            check=True, capture_output=True
+        )
+        subprocess.run(
+            [pg_ctl, "-D", str(data), "-l", str(Path(directory) / "log"), "-w",
+             "-o", f"-p {port} -k {directory} -c listen_addresses=127.0.0.1", "start"],
+            check=True, capture_output=True
+        )
+        try:
+            time.sleep(0.5)
+            yield f"postgresql://studychat@127.0.0.1:{port}/postgres"
+        finally:
+            subprocess.run([pg_ctl, "-D", str(data), "-m", "fast", "-w", "stop"], capture_output=True)
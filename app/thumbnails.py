@@ -0,0 +1,145 @@
+# app/thumbnails.py
+"""
+Thumbnail and preview generation for attachments.
+
+Decoding a phone photo or rasterizing a PDF page takes tens of milliseconds of
+pure CPU, so it runs in a process pool and never on the event loop. Images get a
+JPEG thumbnail no larger than THUMBNAIL_MAX_SIZE on either side (EXIF rotation
+applied); PDFs get one of their first page.
+
+Pillow is required for any preview, PyMuPDF additionally for PDFs. Without them
+uploads still work, they just come without a thumbnail.
+
+This module must stay importable on its own: pool workers are spawned fresh and
+import it without the rest of the app.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Optional
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+try:
+    import fitz  # PyMuPDF
+except ImportError:
+    fitz = None
+
+THUMBNAIL_MAX_SIZE = int(os.getenv("THUMBNAIL_MAX_SIZE", "480"))
+THUMBNAIL_QUALITY = int(os.getenv("THUMBNAIL_QUALITY", "80"))
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+# Refuse to decode images bigger than this (decompression bombs)
+THUMBNAIL_MAX_PIXELS = int(os.getenv("THUMBNAIL_MAX_PIXELS", str(80_000_000)))
+# <blob stem>.thumb-<max size>.jpg (.thumb.jpg before the size was part of the name)
+THUMBNAIL_NAME_PATTERN = re.compile(r"^([0-9a-f]{64})\.thumb(?:-(\d+))?\.jpg$")
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp", ".bmp", ".tif", ".tiff", ".heic"}
+PDF_EXTENSIONS = {".pdf"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def thumbnail_name(stored_name: str, max_size: int = THUMBNAIL_MAX_SIZE) -> str:
+    """
+    Name of the thumbnail stored next to an upload. Thumbnails are served as
+    immutable, so the size is in the name: a new THUMBNAIL_MAX_SIZE gets new URLs.
+    """
+    return f"{os.path.splitext(stored_name)[0]}.thumb-{max_size}.jpg"
+
+
+def thumbnail_glob(stored_name: str) -> str:
+    """Pattern matching every thumbnail of an upload, whatever size it was rendered at."""
+    return f"{os.path.splitext(stored_name)[0]}.thumb*.jpg"
+
+
+def can_preview(filename: str) -> bool:
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in IMAGE_EXTENSIONS:
+        return Image is not None
+    if extension in PDF_EXTENSIONS:
+        return Image is not None and fitz is not None
+    return False
+
+
+def render_preview(source: str, dest: str, max_size: int = THUMBNAIL_MAX_SIZE) -> Optional[dict]:
+    """
+    Write a JPEG thumbnail of source to dest. Runs in a pool worker.
+
+    Returns the original's width/height and the thumbnail's, or None if the
+    file can't be previewed.
+    """
+    Image.MAX_IMAGE_PIXELS = THUMBNAIL_MAX_PIXELS
+    if os.path.splitext(source)[1].lower() in PDF_EXTENSIONS:
+        with fitz.open(source) as document:
+            if document.page_count == 0:
+                return None
+            page = document[0]
+            width, height = int(page.rect.width), int(page.rect.height)
+            # Rasterize just big enough for the thumbnail
+            zoom = min(max_size / max(width, height, 1), 4.0)
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            image = Image.frombytes("RGB", (pixmap.width, pixmap.height), pixmap.samples)
+    else:
+        image = Image.open(source)
+        width, height = image.size
+        if image.getexif().get(0x0112) in (5, 6, 7, 8):
+            # EXIF orientation rotates by 90 degrees: report the size as displayed
+            width, height = height, width
+        image.draft("RGB", (max_size, max_size))  # Lets JPEG decode at reduced size
+        image = ImageOps.exif_transpose(image)
+
+    image.thumbnail((max_size, max_size))
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    temp = f"{dest}.tmp"
+    image.save(temp, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+    os.replace(temp, dest)
+    return {
+        "width": width,
+        "height": height,
+        "thumbnail_width": image.width,
+        "thumbnail_height": image.height
+    }
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: the server process has threads (DB driver, to_thread)
+        _pool = ProcessPoolExecutor(THUMBNAIL_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def generate_preview(source: Path) -> Optional[dict]:
+    """
+    Generate the thumbnail for an upload in the process pool.
+
+    Returns render_preview's dimensions plus "thumbnail_name", or None if the
+    file type isn't supported or decoding failed.
+    """
+    if not can_preview(source.name):
+        return None
+    name = thumbnail_name(source.name)
+    try:
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(_get_pool(), render_preview, str(source), str(source.with_name(name)))
+    except Exception as e:
+        print(f"Error generating preview for {source.name}: {e}")
+        return None
+    if result:
+        result["thumbnail_name"] = name
+    return result
+
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
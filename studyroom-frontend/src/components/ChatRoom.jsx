@@ -25,6 +25,47 @@ function MessageWithMentions({ text, mentions, currentUser }) {
   );
 }
 
+const RESUMABLE_UPLOAD_THRESHOLD = 8 * 1024 * 1024;
+const UPLOAD_RETRIES = 5;
+const DEDUP_HASH_LIMIT = 64 * 1024 * 1024;
+
+// SHA-256 of the file so the server can skip uploads it already has (null if too big to hash in memory)
+async function hashFile(file) {
+  if (file.size > DEDUP_HASH_LIMIT || !window.crypto?.subtle) return null;
+  const digest = await window.crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+  return Array.from(new Uint8Array(digest), b => b.toString(16).padStart(2, "0")).join("");
+}
+
+// Upload a file in chunks, resuming from the server's offset after failures
+async function uploadResumable(file, room, username, sha256) {
+  const base = "http://localhost:8000/upload/sessions";
+  const session = await axios.post(base, { filename: file.name, size: file.size, room, username, sha256 });
+  if (session.data.deduplicated) return session;
+  const { upload_id: uploadId, chunk_size: chunkSize } = session.data;
+  let received = 0;
+  let failures = 0;
+
+  while (received < file.size) {
+    try {
+      const res = await axios.put(`${base}/${uploadId}`, file.slice(received, received + chunkSize), {
+        params: { offset: received },
+        headers: { "Content-Type": "application/octet-stream" },
+      });
+      received = res.data.received;
+      failures = 0;
+    } catch (err) {
+      failures += 1;
+      if (failures > UPLOAD_RETRIES) throw err;
+      await new Promise(resolve => setTimeout(resolve, 1000 * failures));
+      // Ask the server how much it actually has before retrying
+      const status = await axios.get(`${base}/${uploadId}`);
+      received = status.data.received;
+    }
+  }
+
+  return axios.post(`${base}/${uploadId}/finalize`);
+}
+
 export default function ChatRoom({ username, room }) {
   const [socket, setSocket] = useState(null);
   const [messages, setMessages] = useState([]);
@@ -38,100 +79,190 @@ export default function ChatRoom({ username, room }) {
   const [showOnlineUsers, setShowOnlineUsers] = useState(false);
   const [isAdmin, setIsAdmin] = useState(false);
   const [showDeleteIcon, setShowDeleteIcon] = useState(null);
+  const [olderCursor, setOlderCursor] = useState(null);
   const messagesEndRef = useRef(null);
   const typingTimeoutRef = useRef(null);
+  const typingSentAtRef = useRef(0);
+  const lastSeenIdRef = useRef(null);
   
   // Debug: Log admin status changes
   useEffect(() => {
     console.log("🔑 Admin status changed to:", isAdmin);
   }, [isAdmin]);
 
-  // Fetch chat history on mount
-  useEffect(() => {
-    fetchChatHistory();
-  }, [room]);
-
-  const fetchChatHistory = async () => {
+  // Load the page of messages before the oldest one we have
+  const loadOlderMessages = async () => {
+    if (!olderCursor) return;
     try {
-      const res = await axios.get(`http://localhost:8000/chat/history/${room}`);
-      if (res.data.messages && res.data.messages.length > 0) {
-        setMessages(res.data.messages);
-      }
+      const res = await axios.get(`http://localhost:8000/chat/history/${room}`, {
+        params: { before_id: olderCursor }
+      });
+      const older = res.data.messages || [];
+      setMessages(prev => {
+        const seen = new Set(prev.map(m => m.id).filter(Boolean));
+        return [...older.filter(m => !seen.has(m.id)), ...prev];
+      });
+      setOlderCursor(res.data.next_before_id || null);
     } catch (err) {
-      console.error("Failed to fetch chat history:", err);
+      console.error("Failed to load older messages:", err);
     }
   };
 
-  // connect to backend websocket
+  // Remember the newest message id we have, so a reconnect only asks for the delta
+  const rememberSeen = (msgs) => {
+    msgs.forEach(m => {
+      if (m.id && (!lastSeenIdRef.current || m.id > lastSeenIdRef.current)) {
+        lastSeenIdRef.current = m.id;
+      }
+    });
+  };
+
+  // connect to backend websocket (history arrives over the socket, no separate HTTP fetch)
   useEffect(() => {
     if (!username || !room) {
       console.log("❌ Missing username or room:", { username, room });
       return;
     }
     
-    const wsUrl = `ws://localhost:8000/chat/ws/${room}?username=${encodeURIComponent(username)}`;
-    console.log("🔌 Connecting to WebSocket:", wsUrl);
-    
-    const ws = new WebSocket(wsUrl);
-    
-    ws.onopen = () => {
-      console.log("✅ Connected to WebSocket:", room, "as", username);
-      setIsConnected(true);
-    };
-    
-    ws.onclose = () => {
-      console.log("❌ Disconnected from WebSocket");
-      setIsConnected(false);
-    };
+    lastSeenIdRef.current = null;
+    let closedByUs = false;
+    let retryTimer = null;
+    let attempts = 0;
+    let ws;
 
-    ws.onmessage = (event) => {
-      try {
-        const data = JSON.parse(event.data);
-        
-        if (data.type === "typing") {
-          setTypingUsers(prev => {
-            const filtered = prev.filter(user => user !== data.username);
-            return [...filtered, data.username];
-          });
-        } else if (data.type === "stop_typing") {
-          setTypingUsers(prev => prev.filter(user => user !== data.username));
-        } else if (data.type === "user_joined" || data.type === "user_left") {
-          // Update online users list
-          if (data.online_users) {
-            setOnlineUsers(data.online_users);
-          }
-          setMessages((prev) => [...prev, data]);
-        } else if (data.type === "online_users") {
-          // Update online users list without adding to messages
-          if (data.online_users) {
-            setOnlineUsers(data.online_users);
-          }
-        } else if (data.type === "history") {
-          // Load chat history
-          if (data.messages && data.messages.length > 0) {
-            setMessages(data.messages);
+    const connect = () => {
+      const sinceParam = lastSeenIdRef.current ? `&since_id=${lastSeenIdRef.current}` : "";
+      const wsUrl = `ws://localhost:8000/chat/ws/${room}?username=${encodeURIComponent(username)}${sinceParam}`;
+      console.log("🔌 Connecting to WebSocket:", wsUrl);
+      
+      ws = new WebSocket(wsUrl);
+      
+      ws.onopen = () => {
+        console.log("✅ Connected to WebSocket:", room, "as", username);
+        attempts = 0;
+        setIsConnected(true);
+      };
+      
+      ws.onclose = () => {
+        console.log("❌ Disconnected from WebSocket");
+        setIsConnected(false);
+        if (!closedByUs) {
+          // Reconnect with backoff; the since_id cursor keeps the resync small
+          const delay = Math.min(1000 * 2 ** attempts, 15000);
+          attempts += 1;
+          retryTimer = setTimeout(connect, delay);
+        }
+      };
+
+      ws.onmessage = (event) => {
+        try {
+          const data = JSON.parse(event.data);
+          
+          if (data.type === "ping") {
+            // Server heartbeat: answer so we aren't reaped as a dead connection
+            ws.send(JSON.stringify({ type: "pong" }));
+          } else if (data.type === "typing_state") {
+            // The server sends the room's full list of typists, batched
+            setTypingUsers(data.users || []);
+          } else if (data.type === "typing") {
+            setTypingUsers(prev => {
+              const filtered = prev.filter(user => user !== data.username);
+              return [...filtered, data.username];
+            });
+          } else if (data.type === "stop_typing") {
+            setTypingUsers(prev => prev.filter(user => user !== data.username));
+          } else if (data.type === "user_joined" || data.type === "user_left") {
+            // Update online users list
+            if (data.online_users) {
+              setOnlineUsers(data.online_users);
+            }
+            setMessages((prev) => [...prev, data]);
+          } else if (data.type === "online_users") {
+            // Update online users list without adding to messages
+            if (data.online_users) {
+              setOnlineUsers(data.online_users);
+            }
+          } else if (data.type === "history") {
+            // History arrives in chunks: the first may replace our view, the rest append
+            const chunk = data.messages || [];
+            rememberSeen(chunk);
+            if (data.mode === "replace") {
+              setMessages(chunk);
+            } else {
+              setMessages(prev => {
+                const seen = new Set(prev.map(m => m.id).filter(Boolean));
+                return [...prev, ...chunk.filter(m => !seen.has(m.id))];
+              });
+            }
+            if (data.mode === "replace") {
+              setOlderCursor(data.next_before_id || null);
+            }
+          } else if (data.type === "admin_status") {
+            // User is admin
+            console.log("🎉 Admin status received:", data.is_admin);
+            setIsAdmin(data.is_admin);
+          } else if (data.type === "message_deleted") {
+            // Remove deleted message from UI
+            setMessages(prev => prev.filter(m => m.id !== data.message_id));
+          } else if (data.type === "ai_stream" && data.done) {
+            // The bot gave up on this answer (the asker gets an error frame): drop the draft
+            setMessages(prev => prev.filter(m => !((m.isAI || m.is_bot) && m.requestId === data.request_id)));
+          } else if (data.type === "ai_stream") {
+            // @bot answer streamed to the room: grow one message per request as text arrives
+            setMessages(prev => {
+              const index = prev.findIndex(m => (m.isAI || m.is_bot) && m.requestId === data.request_id);
+              if (index < 0 && !data.queued && !data.delta) return prev;
+              const current = index >= 0 ? prev[index] : {
+                type: "chat",
+                username: data.username,
+                message: "🤔 Thinking...",
+                timestamp: new Date().toISOString(),
+                isAI: true,
+                isThinking: true,
+                requestId: data.request_id,
+                askedBy: data.asked_by,
+                question: data.question,
+              };
+              if (data.queued) return index >= 0 ? prev : [...prev, current];
+              const updated = {
+                ...current,
+                message: (current.isThinking ? "" : current.message) + (data.delta || ""),
+                isThinking: false,
+                timestamp: data.timestamp || current.timestamp,
+              };
+              return index >= 0
+                ? [...prev.slice(0, index), updated, ...prev.slice(index + 1)]
+                : [...prev, updated];
+            });
+          } else if (data.type === "error") {
+            alert(data.message);
+          } else if (data.request_id && data.is_bot) {
+            // Finished @bot answer: replaces its streamed draft
+            rememberSeen([data]);
+            setMessages(prev => {
+              const index = prev.findIndex(m => (m.isAI || m.is_bot) && m.requestId === data.request_id);
+              return index >= 0
+                ? [...prev.slice(0, index), data, ...prev.slice(index + 1)]
+                : [...prev, data];
+            });
+          } else {
+            rememberSeen([data]);
+            setMessages((prev) => [...prev, data]);
           }
-        } else if (data.type === "admin_status") {
-          // User is admin
-          console.log("🎉 Admin status received:", data.is_admin);
-          setIsAdmin(data.is_admin);
-        } else if (data.type === "message_deleted") {
-          // Remove deleted message from UI
-          setMessages(prev => prev.filter(m => m.id !== data.message_id));
-        } else if (data.type === "error") {
-          alert(data.message);
-        } else {
-          setMessages((prev) => [...prev, data]);
+        } catch (e) {
+          console.error("Invalid message format:", e);
         }
-      } catch (e) {
-        console.error("Invalid message format:", e);
-      }
+      };
+
+      setSocket(ws);
     };
 
-    setSocket(ws);
+    connect();
     
     // Cleanup function
     return () => {
+      closedByUs = true;
+      clearTimeout(retryTimer);
       // Clear typing indicators when leaving room
       setTypingUsers([]);
       setIsTyping(false);
@@ -167,9 +298,11 @@ export default function ChatRoom({ username, room }) {
       return;
     }
     
-    // Only send typing indicator if there's actual content and we're not already typing
-    if (!isTyping) {
+    // Only send typing indicator if there's actual content and we're not already typing;
+    // refresh it every few seconds while typing, since the server expires it
+    if (!isTyping || Date.now() - typingSentAtRef.current > 3000) {
       setIsTyping(true);
+      typingSentAtRef.current = Date.now();
       if (socket) {
         socket.send(JSON.stringify({ type: "typing", username }));
       }
@@ -201,92 +334,9 @@ export default function ChatRoom({ username, room }) {
       clearTimeout(typingTimeoutRef.current);
     }
     
-    // Check if message starts with @bot for AI assistance
-    if (message.trim().toLowerCase().startsWith('@bot')) {
-      try {
-        // Extract the question part (remove @bot prefix)
-        const question = message.trim().substring(4).trim();
-        
-        if (!question) {
-          // If no question after @bot, show usage hint
-          const hintMessage = {
-            type: "chat",
-            username: "AI Assistant",
-            message: "Hi! I'm your AI Study Assistant. Ask me anything academic like:\n• @bot explain photosynthesis\n• @bot summarize this discussion\n• @bot help with calculus",
-            timestamp: new Date().toISOString(),
-            isAI: true
-          };
-          setMessages(prev => [...prev, hintMessage]);
-          setMessage("");
-          return;
-        }
-        
-        // Show AI is thinking message
-        const thinkingMessage = {
-          type: "chat",
-          username: "AI Assistant",
-          message: "🤔 Thinking...",
-          timestamp: new Date().toISOString(),
-          isAI: true,
-          isThinking: true
-        };
-        setMessages(prev => [...prev, thinkingMessage]);
-        
-        // Call AI helper API
-        const response = await fetch('http://localhost:8000/ai/helper', {
-          method: 'POST',
-          headers: {
-            'Content-Type': 'application/json',
-          },
-          body: JSON.stringify({ message: question })
-        });
-        
-        if (response.ok) {
-          const data = await response.json();
-          
-          // Remove thinking message and add AI response
-          setMessages(prev => {
-            const filtered = prev.filter(m => !m.isThinking);
-            return [...filtered, {
-              type: "chat",
-              username: "AI Assistant",
-              message: data.reply,
-              timestamp: new Date().toISOString(),
-              isAI: true
-            }];
-          });
-        } else {
-          // Handle API error
-          setMessages(prev => {
-            const filtered = prev.filter(m => !m.isThinking);
-            return [...filtered, {
-              type: "chat",
-              username: "AI Assistant",
-              message: "Sorry, I'm having trouble right now. Please try again later.",
-              timestamp: new Date().toISOString(),
-              isAI: true
-            }];
-          });
-        }
-      } catch (error) {
-        console.error('AI Helper Error:', error);
-        // Remove thinking message and show error
-        setMessages(prev => {
-          const filtered = prev.filter(m => !m.isThinking);
-          return [...filtered, {
-            type: "chat",
-            username: "AI Assistant",
-            message: "Sorry, I'm having trouble right now. Please try again later.",
-            timestamp: new Date().toISOString(),
-            isAI: true
-          }];
-        });
-      }
-    } else {
-      // Regular chat message - send through WebSocket
-      const msg = JSON.stringify({ username, message });
-      socket.send(msg);
-    }
+    // Send through WebSocket; the server answers @bot questions itself, with the room as context
+    const msg = JSON.stringify({ username, message });
+    socket.send(msg);
     
     setMessage("");
   };
@@ -301,9 +351,19 @@ export default function ChatRoom({ username, room }) {
     formData.append("username", username);
 
     try {
-      const res = await axios.post("http://localhost:8000/upload", formData, {
-        headers: { "Content-Type": "multipart/form-data" },
-      });
+      const sha256 = await hashFile(file);
+      // Already on the server (e.g. the same slides shared in another room): reuse it
+      const existing = sha256 && file.size <= RESUMABLE_UPLOAD_THRESHOLD
+        ? await axios.get(`http://localhost:8000/upload/blobs/${sha256}`).catch(() => null)
+        : null;
+      // Big files go through the resumable protocol so a dropped connection doesn't restart them
+      const res = existing
+        ? existing
+        : file.size > RESUMABLE_UPLOAD_THRESHOLD
+        ? await uploadResumable(file, room, username, sha256)
+        : await axios.post("http://localhost:8000/upload", formData, {
+            headers: { "Content-Type": "multipart/form-data" },
+          });
       const fileUrl = res.data.file_url;
 
       // Send file information through WebSocket
@@ -447,6 +507,17 @@ export default function ChatRoom({ username, room }) {
 
       {/* Messages */}
       <div className="flex-1 overflow-y-auto px-4 sm:px-6 py-4 space-y-3">
+        {olderCursor && (
+          <div className="text-center">
+            <button
+              onClick={loadOlderMessages}
+              className="text-xs text-blue-400 hover:text-blue-300"
+            >
+              Load earlier messages
+            </button>
+          </div>
+        )}
+
         {messages.length === 0 && (
           <div className="text-center mt-10">
             <div className="text-6xl mb-4">💬</div>
@@ -464,11 +535,11 @@ export default function ChatRoom({ username, room }) {
               {m.username && m.username !== username && (
                 <div className="flex items-center mb-1">
                   <div className={`w-6 h-6 rounded-full flex items-center justify-center text-xs font-bold mr-2 ${
-                    m.isAI 
+                    (m.isAI || m.is_bot) 
                       ? "bg-gradient-to-r from-purple-500 to-blue-500" 
                       : "bg-blue-500"
                   }`}>
-                    {m.isAI ? "🤖" : m.username.charAt(0).toUpperCase()}
+                    {(m.isAI || m.is_bot) ? "🤖" : m.username.charAt(0).toUpperCase()}
                   </div>
                   <span className="text-xs text-gray-400">{m.username}</span>
                 </div>
@@ -476,7 +547,7 @@ export default function ChatRoom({ username, room }) {
               
               <div
                 className={`px-4 py-2 rounded-2xl shadow-lg relative ${
-                  m.isAI
+                  (m.isAI || m.is_bot)
                     ? "bg-gradient-to-r from-purple-600 to-blue-600 text-white rounded-bl-none"
                     : m.username === username
                     ? "bg-blue-600 text-white rounded-br-none"
@@ -525,8 +596,31 @@ export default function ChatRoom({ username, room }) {
                 {/* Handle file attachments */}
                 {m.file_url && (
                   <div className="mt-2">
-                    {/* Image files */}
-                    {m.file_type && m.file_type.startsWith('image/') ? (
+                    {/* Server-generated thumbnail (images, first page of PDFs); full file on click */}
+                    {m.thumbnail_url ? (
+                      <div>
+                        <img
+                          src={m.thumbnail_url}
+                          alt={m.filename || 'shared'}
+                          loading="lazy"
+                          style={m.width && m.height ? { aspectRatio: `${m.width} / ${m.height}` } : undefined}
+                          className="max-w-[200px] sm:max-w-[250px] rounded-lg border border-gray-700 cursor-pointer"
+                          onClick={() => window.open(m.file_url, '_blank')}
+                        />
+                        {!(m.file_type && m.file_type.startsWith('image/')) && (
+                          <a
+                            href={m.file_url}
+                            target="_blank"
+                            rel="noopener noreferrer"
+                            className="flex items-center gap-2 mt-1 text-blue-400 hover:text-blue-300 text-sm underline"
+                          >
+                            <span>📎</span>
+                            <span>{m.filename || 'Download File'}</span>
+                          </a>
+                        )}
+                      </div>
+                    ) : /* Image files */
+                    m.file_type && m.file_type.startsWith('image/') ? (
                       <img
                         src={m.file_url}
                         alt={m.filename || 'shared'}